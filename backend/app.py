@@ -1,23 +1,39 @@
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, g, request, jsonify, send_from_directory, session
 from flask_cors import CORS
 import os
 from database import db, init_db
 from models import Product, Order, OrderItem, AdminAccessCode, AdminUser
-from routes.products import products_bp
+from routes.products import products_bp, warm_product_cache
 from routes.orders import orders_bp
 from routes.cart import cart_bp
 from routes.tracking import tracking_bp
 from routes.admin import admin_bp
 from routes.backup import backup_bp
 from backup_manager import backup_manager
+from backup_jobs import backup_jobs
+from backup_store import backup_store
+from backup_upload import backup_uploader
+from backup_verifier import backup_verifier
+from backup_export import table_transfer
+from backup_catalog import backup_catalog
+from shadow_restore import shadow_restorer
+from job_scheduler import job_scheduler
+from wal_backups import wal_archiver
+from rate_limiter import rate_limiter
 from datetime import datetime
+import json
 import secrets
 from dotenv import load_dotenv
-from redis import Redis
-from flask_session import Session
+from redis_tiers import redis_topology
+from session_store import RedisSessionInterface
 import time  # ADDED
 from performance_monitor import performance_monitor  # ADDED
-import logging  # ADDED
+from query_instrumentation import InstrumentedQueuePool, instrument_sqlalchemy, pop_request_queries
+from metrics import metrics_registry
+from performance_backends import RedisMonitorBackend
+from request_profiler import request_profiler, to_collapsed, to_speedscope
+from tracing import tracer
+from slo import admission_controller
 
 load_dotenv()
 
@@ -53,7 +69,8 @@ app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_recycle': 1800,      # Recycle connections every 30 minutes
     'pool_timeout': 30,        # Seconds to wait for a connection
     'echo': False,             # Don't log SQL queries (set to True for debugging)
-    'pool_reset_on_return': 'rollback'  # Reset connections when returned to pool
+    'pool_reset_on_return': 'rollback',  # Reset connections when returned to pool
+    'poolclass': InstrumentedQueuePool  # QueuePool that reports checkout wait time
 }
 
 # PostgreSQL specific optimizations
@@ -71,24 +88,34 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
 if not app.config['SECRET_KEY']:
     raise ValueError("SECRET_KEY environment variable is required")
 
-redis_url = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+# Sessions, product cache and rate limits each get their own pool and logical database
 try:
-    redis_client = Redis.from_url(redis_url)
-    redis_client.ping()
+    redis_topology.init_app(app)
 except Exception as redis_error:
     raise RuntimeError("❌ Unable to connect to Redis. Please verify REDIS_URL.") from redis_error
 
-app.redis_client = redis_client
+redis_client = redis_topology.client('cache')
+app.redis_client = redis_client  # Product cache (routes/products.py)
+
+# Fleet-wide metrics: workers flush deltas to the metrics tier, /metrics reads the totals
+metrics_registry.init_app(app, redis_topology.client('metrics'))
+
+# Fleet-wide /api/performance/* numbers: PERFORMANCE_BACKEND=local keeps them per worker
+if os.environ.get('PERFORMANCE_BACKEND', 'redis') == 'redis':
+    performance_backend = RedisMonitorBackend(redis_topology.client('metrics'),
+                                              flush_interval=metrics_registry.flush_interval)
+    performance_monitor.set_backend(performance_backend)
+    metrics_registry.add_flush_hook(performance_backend.flush)
 
 # Check if we're in production mode
 is_production = os.environ.get('FLASK_ENV') == 'production'
 
 # ENHANCED SESSION CONFIGURATION WITH PRODUCTION SETTINGS
-app.config['SESSION_TYPE'] = 'redis'
-app.config['SESSION_REDIS'] = redis_client
 app.config['SESSION_PERMANENT'] = True
 app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_KEY_PREFIX'] = 'hexashop:sess:'
+# Only these routes read or write the server-side session; storefront traffic never touches Redis
+app.config['SESSION_ROUTE_PREFIXES'] = ('/api/admin', '/api/performance', '/api/debug')
 app.config['SESSION_COOKIE_NAME'] = 'hexashop_sid'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
@@ -97,96 +124,31 @@ app.config['SESSION_COOKIE_DOMAIN'] = None
 app.config['SESSION_COOKIE_PATH'] = '/'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 app.config['SESSION_REFRESH_EACH_REQUEST'] = True  # Extend session on activity
+app.config['SESSION_REFRESH_INTERVAL'] = 300  # ...but rewrite the TTL at most every 5 minutes
 app.config['SESSION_COOKIE_MAX_AGE'] = 86400  # 24 hours max age
 
-# Session serialization optimization - FIXED: Use pickle for proper serialization
-app.config['SESSION_SERIALIZATION_FORMAT'] = 'pickle'  # Changed from 'json' to 'pickle'
-
 print(f"🔒 Session security: {'PRODUCTION (Secure cookies)' if is_production else 'DEVELOPMENT (HTTP allowed)'}")
 
-# Session cleanup and monitoring
-import threading
-import time
-from datetime import datetime, timedelta
-
-def session_cleanup_worker():
-    """Background worker to clean up expired sessions"""
-    # Get logger
-    logger = logging.getLogger(__name__)
-    
-    while True:
-        try:
-            # Run cleanup every 30 minutes
-            time.sleep(1800)  # 30 minutes
-            
-            logger.info("🧹 Running session cleanup...")
-            
-            # Delete expired session keys
-            pattern = app.config['SESSION_KEY_PREFIX'] + '*'
-            deleted_count = 0
-            
-            for key in redis_client.scan_iter(pattern):
-                try:
-                    # Check if key exists and TTL
-                    ttl = redis_client.ttl(key)
-                    if ttl == -2:  # Key doesn't exist
-                        redis_client.delete(key)
-                        deleted_count += 1
-                    elif ttl == -1:  # No expiration (shouldn't happen)
-                        # Set a reasonable expiration
-                        redis_client.expire(key, 86400)  # 24 hours
-                except Exception as e:
-                    logger.warning(f"Error cleaning up session {key}: {e}")
-            
-            if deleted_count > 0:
-                logger.info(f"🧹 Cleaned up {deleted_count} expired sessions")
-                
-        except Exception as e:
-            logger.error(f"Session cleanup error: {e}")
-            time.sleep(300)  # Wait 5 minutes on error
-
-# Start session cleanup thread
-def start_session_cleanup():
-    """Start the session cleanup background thread"""
-    if not hasattr(app, 'session_cleanup_thread'):
-        cleanup_thread = threading.Thread(target=session_cleanup_worker, daemon=True)
-        cleanup_thread.start()
-        app.session_cleanup_thread = cleanup_thread
-        print("✅ Session cleanup worker started")
-
-# Configure Redis for optimal session management
-try:
-    # Set memory limits
-    redis_client.config_set('maxmemory', '512mb')
-    
-    # More aggressive eviction policy for sessions
-    redis_client.config_set('maxmemory-policy', 'allkeys-lru')
-    
-    # Enable key eviction notifications (optional)
-    redis_client.config_set('notify-keyspace-events', 'Ex')
-    
-    # Configure save intervals (for persistence)
-    redis_client.config_set('save', '900 1 300 10 60 10000')
-    
-    print("✅ Redis configured: 512MB with LRU eviction + persistence")
-    
-except Exception as e:
-    print(f"⚠️ Could not configure Redis settings: {e}")
-    # Set defaults via command if config_set fails
-    import subprocess
-    try:
-        subprocess.run([
-            'redis-cli', 'config', 'set', 'maxmemory', '512mb'
-        ], capture_output=True)
-        subprocess.run([
-            'redis-cli', 'config', 'set', 'maxmemory-policy', 'allkeys-lru'
-        ], capture_output=True)
-        print("✅ Redis configured via redis-cli fallback")
-    except:
-        print("❌ Could not configure Redis via any method")
+# Configure Redis memory limits and per-tier eviction policies
+redis_topology.configure_servers(maxmemory=os.environ.get('REDIS_MAXMEMORY', '512mb'))
 
 db.init_app(app)
 
+# Time every SQL statement and count queries per request
+instrument_sqlalchemy()
+
+def _db_pool_gauges():
+    """Current SQLAlchemy pool usage of this worker"""
+    with app.app_context():
+        pool = db.engine.pool
+    return {
+        ('size',): pool.size(),
+        ('checked_out',): pool.checkedout(),
+        ('overflow',): max(pool.overflow(), 0)
+    }
+
+metrics_registry.set_gauge_callback('hexashop_db_pool_connections', _db_pool_gauges)
+
 # Enhanced CORS configuration - FIXED: Added specific headers for cookies
 # Enhanced CORS configuration for production
 allowed_origins = ['http://localhost:5000', 'http://127.0.0.1:5000']
@@ -208,11 +170,14 @@ CORS(app,
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
      expose_headers=['Set-Cookie'])
 
-# Initialize session after CORS
-Session(app)
-
-# Start session cleanup worker
-start_session_cleanup()
+# Initialize session after CORS (compact JSON, admin routes only)
+app.session_interface = RedisSessionInterface(
+    redis_topology.client('sessions'),
+    key_prefix=app.config['SESSION_KEY_PREFIX'],
+    route_prefixes=app.config['SESSION_ROUTE_PREFIXES'],
+    refresh_interval=app.config['SESSION_REFRESH_INTERVAL'],
+    use_signer=app.config['SESSION_USE_SIGNER']
+)
 
 
 # Register all blueprints
@@ -223,24 +188,38 @@ app.register_blueprint(tracking_bp, url_prefix='/api/tracking')
 app.register_blueprint(admin_bp, url_prefix='/api/admin')
 app.register_blueprint(backup_bp, url_prefix='/api/admin/backup')  # NEW: Register backup routes
 
-login_attempts = {}
-
-def is_rate_limited(identifier, max_attempts=5, window_seconds=300):
-    now = datetime.utcnow().timestamp()
-    if identifier not in login_attempts:
-        login_attempts[identifier] = []
-
-    login_attempts[identifier] = [
-        attempt_time
-        for attempt_time in login_attempts[identifier]
-        if now - attempt_time < window_seconds
-    ]
-
-    if len(login_attempts[identifier]) >= max_attempts:
-        return True
-
-    login_attempts[identifier].append(now)
-    return False
+# Backups and restores run as queued jobs, one at a time across all workers
+backup_manager.init_app(app)
+backup_store.init_app(app, backup_manager)
+backup_uploader.init_app(app, backup_manager)
+backup_verifier.init_app(app, backup_manager)
+table_transfer.init_app(app, backup_manager)
+# Index of every backup (listing, filters, retention); rebuilt from the backup directory if missing
+backup_catalog.init_app(app, backup_manager)
+backup_jobs.init_app(app, backup_manager, redis_topology.client('coordination'))
+# Restores load a shadow database and swap it in; workers reconnect when the generation changes
+shadow_restorer.init_app(app, backup_manager, redis_topology.client('coordination'))
+# BACKUP_MODE=incremental: continuous WAL archiving, nightly base backups, point-in-time restore
+wal_archiver.init_app(app, backup_manager, redis_topology.client('coordination'))
+
+# Periodic jobs run once per cluster (leader lease + per-occurrence claims), with catch-up after restarts
+job_scheduler.init_app(app, redis_topology.client('coordination'))
+backup_manager.schedule_automatic_backups(job_scheduler)
+job_scheduler.add('session_cleanup', lambda: app.session_interface.prune_expired(), every=300, jitter=30)
+job_scheduler.add('session_reconcile', lambda: app.session_interface.reconcile_registry(), every=3600, offset=900, jitter=300)
+job_scheduler.add('cache_warm', warm_product_cache, every=240, jitter=20)
+
+# Distributed rate limiting shared by all workers (login, orders, promo, admin code)
+rate_limiter.init_app(app, redis_topology.client('ratelimit'))
+
+# Request tracing: spans over SQL, Redis, cache and JSON, tail-sampled and exported as OTLP/JSON
+tracer.init_app(app)
+
+# SLO-driven load shedding: low-priority routes are queued or rejected while this worker is overloaded
+admission_controller.init_app(app, performance_monitor)
+
+# Opt-in request profiling (PROFILER_TOKEN header or PROFILE_SAMPLE_RATE), shared by all workers
+request_profiler.init_app(app, redis_topology.client('metrics'))
 
 # ========== PERFORMANCE MONITORING MIDDLEWARE ==========
 
@@ -248,12 +227,34 @@ def is_rate_limited(identifier, max_attempts=5, window_seconds=300):
 def before_request():
     """Start timer for request timing"""
     request.start_time = time.time()
+    
+    g.hexashop_trace = tracer.start_trace(
+        f"{request.method} {request.endpoint or 'unmatched'}",
+        traceparent=request.headers.get('traceparent'),
+        attributes={'http.method': request.method, 'http.target': request.path,
+                    'http.route': str(request.url_rule) if request.url_rule else ''}
+    )
+    
+    admitted, holds_slot = admission_controller.admit(request.path)
+    if not admitted:
+        # Counted in admission_controller.shed only, never as a 5xx or a latency sample
+        g.hexashop_shed = True
+        return admission_controller.reject()
+    g.hexashop_admission_slot = holds_slot
+    g.hexashop_queue_wait = time.time() - request.start_time
+    
+    trigger = request_profiler.trigger_for(request)
+    if trigger:
+        g.hexashop_profile = request_profiler.start(request.endpoint or 'unmatched', request.method,
+                                                    request.path, trigger)
 
 @app.after_request
 def after_request(response):
     """Record request performance after each request"""
     # Calculate request duration
-    if hasattr(request, 'start_time'):
+    if hasattr(request, 'start_time') and g.get('hexashop_shed'):
+        response.headers['X-Response-Time'] = f'{time.time() - request.start_time:.3f}s'
+    elif hasattr(request, 'start_time'):
         duration = time.time() - request.start_time
         
         # Record request metrics
@@ -262,14 +263,50 @@ def after_request(response):
             endpoint=endpoint,
             method=request.method,
             duration=duration,
-            status_code=response.status_code
+            status_code=response.status_code,
+            queries=pop_request_queries(),
+            client=request.remote_addr,
+            queue_wait=g.get('hexashop_queue_wait', 0.0)
+        )
+        
+        metrics_registry.observe(
+            'hexashop_http_request_duration_seconds',
+            duration,
+            endpoint=request.endpoint or 'unmatched',  # raw paths would explode label cardinality
+            method=request.method,
+            status=f'{response.status_code // 100}xx'
         )
         
         # Add performance header for debugging
         response.headers['X-Response-Time'] = f'{duration:.3f}s'
     
+    trace = g.get('hexashop_trace')
+    if trace is not None:
+        trace.root.set('http.status_code', response.status_code)
+        response.headers['X-Trace-Id'] = trace.trace_id
+    
+    profile = g.pop('hexashop_profile', None)
+    if profile is not None:
+        response.headers['X-Profile-Id'] = request_profiler.stop(profile, response.status_code)
+    
     return response
 
+@app.teardown_request
+def teardown_request(exc):
+    """Finish the request trace; stop sampling a profiled request that never produced a response"""
+    if g.pop('hexashop_admission_slot', False):
+        admission_controller.release()
+    
+    profile = g.pop('hexashop_profile', None)
+    if profile is not None:
+        request_profiler.discard(profile)
+    
+    trace = g.pop('hexashop_trace', None)
+    if trace is not None:
+        if exc is not None:
+            trace.root.record_error(exc)
+        tracer.finish_trace(trace, trace.root.attributes.get('http.status_code'))
+
 @app.errorhandler(Exception)
 def handle_exception(e):
     """Record exceptions in performance monitor"""
@@ -291,8 +328,12 @@ def handle_exception(e):
 @app.route('/api/admin/login', methods=['POST'])
 def admin_login():
     client_ip = request.remote_addr
-    if is_rate_limited(client_ip):
-        return jsonify({'success': False, 'message': 'Too many login attempts. Please try again later.'}), 429
+    limited, retry_after = rate_limiter.check('admin_login', client_ip)
+    if limited:
+        response = jsonify({'success': False, 'message': 'Too many login attempts. Please try again later.'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
 
     data = request.get_json()
 
@@ -360,10 +401,10 @@ def debug_session():
 def debug_redis_session():
     """Debug endpoint to check what's actually in Redis"""
     try:
-        session_id = request.cookies.get('hexashop_session')
+        session_id = app.session_interface.sid_from_cookie(app, request.cookies.get(app.config['SESSION_COOKIE_NAME']))
         if session_id:
-            redis_key = f"hexashop:session:{session_id}"
-            redis_data = redis_client.get(redis_key)
+            redis_key = f"{app.config['SESSION_KEY_PREFIX']}{session_id}"
+            redis_data = redis_topology.client('sessions').get(redis_key)
             return jsonify({
                 'session_id': session_id,
                 'redis_key': redis_key,
@@ -375,20 +416,20 @@ def debug_redis_session():
 
 @app.route('/api/debug/redis-memory')
 def debug_redis_memory():
-    """Check Redis memory usage"""
+    """Check Redis memory usage per tier"""
     try:
         info = redis_client.info('memory')
-        keys_count = redis_client.dbsize()
-        session_count = len(list(redis_client.scan_iter("hexashop:session:*")))
-        cache_count = len(list(redis_client.scan_iter("products:*")))
+        max_memory = info.get('maxmemory') or 512 * 1024 * 1024
+        tier_stats = redis_topology.stats()
         
         return jsonify({
             'used_memory': info['used_memory_human'],
             'used_memory_peak': info['used_memory_peak_human'],
-            'total_keys': keys_count,
-            'session_keys': session_count,
-            'cache_keys': cache_count,
-            'memory_usage_percentage': f"{(info['used_memory'] / (512 * 1024 * 1024)) * 100:.1f}%"
+            'total_keys': sum(stats.get('keys', 0) for stats in tier_stats.values()),
+            'session_keys': app.session_interface.active_session_count(),
+            'cache_keys': redis_topology.tier('cache').key_count(),
+            'memory_usage_percentage': f"{(info['used_memory'] / max_memory) * 100:.1f}%",
+            'tiers': tier_stats
         })
     except Exception as e:
         return jsonify({'error': str(e)})
@@ -411,24 +452,35 @@ def cleanup_sessions():
         return jsonify({'error': 'Authentication required'}), 401
         
     try:
-        deleted_count = 0
-        for key in redis_client.scan_iter("hexashop:session:*"):
-            ttl = redis_client.ttl(key)
-            if ttl == -2:  # Key doesn't exist (shouldn't happen)
-                redis_client.delete(key)
-                deleted_count += 1
-            elif ttl == -1:  # No expiration set (old sessions)
-                redis_client.delete(key)
-                deleted_count += 1
+        deleted_count = app.session_interface.prune_expired()
                 
         return jsonify({
             'success': True,
             'message': f'Cleaned up {deleted_count} stale sessions',
-            'deleted_count': deleted_count
+            'deleted_count': deleted_count,
+            'active_sessions': app.session_interface.active_session_count()
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/scheduler')
+def scheduler_status():
+    """Scheduled jobs with their last outcome and next run"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Authentication required'}), 401
+    return jsonify({'success': True, **job_scheduler.status()})
+
+@app.route('/api/admin/scheduler/<name>/run', methods=['POST'])
+def scheduler_run(name):
+    """Run a scheduled job now, outside its schedule"""
+    if not session.get('admin_logged_in'):
+        return jsonify({'error': 'Authentication required'}), 401
+    if name not in job_scheduler.jobs:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not job_scheduler.run_now(name):
+        return jsonify({'error': 'Job is already running'}), 409
+    return jsonify({'success': True, 'message': f'{name} started'}), 202
+
 @app.route('/')
 def serve_index():
     return send_from_directory(app.static_folder, 'index.html')
@@ -463,6 +515,7 @@ def performance_summary():
         return jsonify({"error": "Authentication required"}), 401
     
     summary = performance_monitor.get_summary()
+    summary['admission'] = admission_controller.stats()
     return jsonify(summary)
 
 @app.route('/api/performance/requests')
@@ -472,10 +525,9 @@ def performance_requests():
         return jsonify({"error": "Authentication required"}), 401
     
     # Get last 50 requests
-    requests = list(performance_monitor.request_times)[-50:]
     return jsonify({
-        'total_requests': len(performance_monitor.request_times),
-        'recent_requests': requests
+        'total_requests': performance_monitor.recent_request_count(),
+        'recent_requests': performance_monitor.recent_requests(50)
     })
 
 @app.route('/api/performance/slow-queries')
@@ -484,10 +536,7 @@ def performance_slow_queries():
     if not session.get('admin_logged_in'):
         return jsonify({"error": "Authentication required"}), 401
     
-    return jsonify({
-        'slow_queries': performance_monitor.slow_queries,
-        'total_slow_queries': len(performance_monitor.slow_queries)
-    })
+    return jsonify(performance_monitor.get_query_report())
 
 @app.route('/api/performance/system-metrics')
 def performance_system_metrics():
@@ -495,12 +544,76 @@ def performance_system_metrics():
     if not session.get('admin_logged_in'):
         return jsonify({"error": "Authentication required"}), 401
     
-    return jsonify({
-        'cpu_usage': performance_monitor.cpu_usage[-10:] if performance_monitor.cpu_usage else [],
-        'memory_usage': performance_monitor.memory_usage[-10:] if performance_monitor.memory_usage else [],
-        'disk_io': performance_monitor.disk_io[-10:] if performance_monitor.disk_io else []
+    sampler = performance_monitor.system
+    resolution = request.args.get('resolution', '1m')
+    if resolution not in sampler.resolutions:
+        return jsonify({"error": f"resolution must be one of {', '.join(sampler.resolutions)}"}), 400
+    
+    # Default window: the last 10 points of the chosen resolution
+    step = sampler.resolutions[resolution].step
+    window = request.args.get('window', 10 * step, type=int)
+    metrics = sampler.to_json(resolution, max(window, step))
+    
+    # Legacy per-point lists (cpu/memory/disk) for existing consumers
+    series = metrics['series']
+    metrics['cpu_usage'] = [
+        {'timestamp': ts, 'percent': cpu}
+        for ts, cpu in zip(metrics['timestamps'], series['cpu_percent'])
+    ]
+    metrics['memory_usage'] = [
+        {'timestamp': ts, 'percent': percent, 'used_gb': used, 'total_gb': total}
+        for ts, percent, used, total in zip(metrics['timestamps'], series['memory_percent'],
+                                            series['memory_used_gb'], series['memory_total_gb'])
+    ]
+    metrics['disk_io'] = [
+        {'timestamp': ts, 'read_mb_s': read, 'write_mb_s': write}
+        for ts, read, write in zip(metrics['timestamps'], series['disk_read_mb_s'], series['disk_write_mb_s'])
+    ]
+    metrics['current'] = sampler.current
+    return jsonify(metrics)
+
+@app.route('/api/performance/profiles')
+def performance_profiles():
+    """List captured request profiles, newest first (admin only)"""
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Authentication required"}), 401
+    
+    return jsonify({'profiles': request_profiler.list_profiles()})
+
+@app.route('/api/performance/profiles/<profile_id>')
+def performance_profile_download(profile_id):
+    """Download a profile as collapsed stacks or speedscope JSON (admin only)"""
+    if not session.get('admin_logged_in'):
+        return jsonify({"error": "Authentication required"}), 401
+    
+    data = request_profiler.get_profile(profile_id)
+    if data is None:
+        return jsonify({"error": "Profile not found"}), 404
+    
+    profile_format = request.args.get('format', 'speedscope')
+    if profile_format == 'collapsed':
+        body, content_type, extension = to_collapsed(data), 'text/plain; charset=utf-8', 'txt'
+    elif profile_format == 'speedscope':
+        body, content_type, extension = json.dumps(to_speedscope(data)), 'application/json', 'speedscope.json'
+    else:
+        return jsonify({"error": "format must be 'collapsed' or 'speedscope'"}), 400
+    
+    return Response(body, content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename=profile-{profile_id}.{extension}'
     })
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Fleet-wide metrics in OpenMetrics text format (Prometheus scrape target)"""
+    metrics_token = os.environ.get('METRICS_TOKEN')
+    if metrics_token and request.headers.get('Authorization') != f'Bearer {metrics_token}':
+        return jsonify({"error": "Unauthorized"}), 401
+    
+    return Response(
+        metrics_registry.render(),
+        content_type='application/openmetrics-text; version=1.0.0; charset=utf-8'
+    )
+
 # ========== END PERFORMANCE ENDPOINTS ==========
 
 def initialize_database():
@@ -511,11 +624,6 @@ def create_app():
     with app.app_context():
         initialize_database()
         
-        # NEW: Initialize backup manager and schedule automatic backups
-        backup_manager.init_app(app)
-        backup_manager.schedule_automatic_backups()
-        print("✅ Backup system initialized and scheduled!")
-        
         # NEW: Initialize performance monitor
         performance_monitor.init_app(app)
         print("📊 Performance monitoring initialized!")
@@ -529,7 +637,7 @@ if __name__ == '__main__':
     print("📧 API Running at: http://127.0.0.1:5000")
     print("🛍️  Frontend at: http://127.0.0.1:5000")
     print("⚡ Using Waitress Production Server (20 threads)")
-    print("💾 Redis Memory: 512MB with LRU eviction policy")
+    print("💾 Redis: sessions (noeviction), cache + rate limits (volatile-ttl)")
     print("⏰ Session Lifetime: 2 hours")
     print("💾 Backup System: Active (Every 30 minutes + Daily at 02:00)")
 
@@ -0,0 +1,327 @@
+"""
+Backup Catalog for Hexashop
+SQLite index of every backup file and store snapshot, so listing, filtering
+and retention are indexed lookups instead of directory scans
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+
+from backup_store import SNAPSHOT_SUFFIX
+
+CATALOG_FILENAME = 'catalog.sqlite3'
+EXPORT_SUFFIX = '.dir.tar.export'   # Single-file copy of a store snapshot, uploaded off-site
+BACKUP_FILE_RE = re.compile(r'^hexashop_backup_(.+)_(\d{8}_\d{6})(\.sql|\.dump|\.dir\.tar|\.snapshot)$')
+EXTENSION_FORMATS = {'.sql': 'plain', '.dump': 'custom', '.dir.tar': 'directory', SNAPSHOT_SUFFIX: 'store'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    filename            TEXT PRIMARY KEY,
+    type                TEXT NOT NULL,
+    format              TEXT NOT NULL,
+    compression         TEXT,
+    created             TEXT NOT NULL,
+    timestamp           TEXT,
+    size                INTEGER,
+    raw_size            INTEGER,
+    stored_bytes        INTEGER,
+    sha256              TEXT,
+    dump_seconds        REAL,
+    uploads             TEXT,
+    upload_status       TEXT,
+    verification        TEXT,
+    verification_status TEXT
+);
+CREATE INDEX IF NOT EXISTS backups_created ON backups (created);
+CREATE INDEX IF NOT EXISTS backups_type_created ON backups (type, created);
+CREATE INDEX IF NOT EXISTS backups_format_created ON backups (format, created);
+CREATE INDEX IF NOT EXISTS backups_verification_created ON backups (verification_status, created);
+CREATE INDEX IF NOT EXISTS backups_upload_status ON backups (upload_status);
+"""
+
+COLUMNS = ('filename', 'type', 'format', 'compression', 'created', 'timestamp', 'size', 'raw_size',
+           'stored_bytes', 'sha256', 'dump_seconds', 'uploads', 'upload_status', 'verification',
+           'verification_status')
+JSON_COLUMNS = ('uploads', 'verification')
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def upload_status(uploads):
+    """One status over all targets: complete, failed (any target) or uploading"""
+    if not uploads:
+        return None
+    statuses = list(uploads.values())
+    if all(status == 'complete' for status in statuses):
+        return 'complete'
+    if any(status.startswith('failed') for status in statuses):
+        return 'failed'
+    return 'uploading'
+
+
+class BackupCatalog:
+    """
+    One row per backup in backups/catalog.sqlite3 (BACKUP_CATALOG_PATH):
+    type, format, compression, size, checksum, dump duration, per-target
+    upload status and the last verification. The manager, store, uploader
+    and verifier record changes as they happen; the .meta.json sidecars and
+    the store index stay the source of truth, so the catalog can always be
+    rebuilt from them (automatically when the file is missing, and by
+    reconcile(), which picks up files added or removed behind our back).
+
+    SQLite in WAL mode lets every worker read while one writes.
+    """
+
+    def __init__(self, app=None, manager=None):
+        self.app = app
+        self.manager = manager
+        self.path = None
+
+        if app is not None:
+            self.init_app(app, manager)
+
+    def init_app(self, app, manager):
+        self.app = app
+        self.manager = manager
+        self.path = os.environ.get('BACKUP_CATALOG_PATH', os.path.join(manager.backup_dir, CATALOG_FILENAME))
+        fresh = not os.path.exists(self.path)
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")    # Persistent; cannot be set inside a transaction
+            connection.executescript(SCHEMA)
+        finally:
+            connection.close()
+        manager.catalog = self
+        app.backup_catalog = self
+        if fresh:
+            self.rebuild()
+
+    @contextmanager
+    def _connect(self, immediate=False):
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    # ----- writes -----
+
+    def _upsert(self, connection, row):
+        columns = [column for column in COLUMNS if column in row]
+        values = [json.dumps(row[column]) if column in JSON_COLUMNS and row[column] is not None else row[column]
+                  for column in columns]
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != 'filename')
+        connection.execute(
+            f"INSERT INTO backups ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT (filename) DO UPDATE SET {updates}",
+            values
+        )
+
+    def record(self, filename, **fields):
+        """Add or update a backup's entry"""
+        with self._connect(immediate=True) as connection:
+            self._upsert(connection, dict(fields, filename=filename))
+
+    def update_meta(self, filename, fields):
+        """Mirror metadata changes (currently the verification result) into the entry"""
+        if 'verification' not in fields:
+            return
+        verification = fields['verification']
+        with self._connect(immediate=True) as connection:
+            connection.execute(
+                "UPDATE backups SET verification = ?, verification_status = ? WHERE filename = ?",
+                (json.dumps(verification), (verification or {}).get('status'), filename)
+            )
+
+    def set_upload(self, filename, target, status):
+        """Record one target's upload status and recompute the overall one"""
+        with self._connect(immediate=True) as connection:
+            row = connection.execute("SELECT uploads FROM backups WHERE filename = ?", (filename,)).fetchone()
+            if row is None:
+                return
+            uploads = json.loads(row['uploads']) if row['uploads'] else {}
+            uploads[target] = status
+            connection.execute(
+                "UPDATE backups SET uploads = ?, upload_status = ? WHERE filename = ?",
+                (json.dumps(uploads), upload_status(uploads), filename)
+            )
+
+    def remove(self, *filenames):
+        if not filenames:
+            return
+        with self._connect(immediate=True) as connection:
+            connection.executemany("DELETE FROM backups WHERE filename = ?", [(name,) for name in filenames])
+
+    # ----- reads -----
+
+    def _to_backup(self, row):
+        backup = dict(row)
+        for column in JSON_COLUMNS:
+            backup[column] = json.loads(backup[column]) if backup[column] else None
+        backup['filepath'] = os.path.join(self.manager.backup_dir, backup['filename'])
+        raw_size, size = backup['raw_size'], backup['size']
+        backup['compression_ratio'] = (round(raw_size / size, 1)
+                                       if raw_size and size and backup['format'] != 'store' else None)
+        return backup
+
+    def query(self, type=None, format=None, verification=None, upload=None, since=None, until=None, limit=None):
+        """Backups newest first, filtered on indexed columns"""
+        clauses, params = [], []
+        for column, value in (('type', type), ('format', format),
+                              ('verification_status', verification), ('upload_status', upload)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            clauses.append("created >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created < ?")
+            params.append(until)
+        statement = "SELECT * FROM backups"
+        if clauses:
+            statement += " WHERE " + " AND ".join(clauses)
+        statement += " ORDER BY created DESC"
+        if limit is not None:
+            statement += " LIMIT ?"
+            params.append(int(limit))
+        with self._connect() as connection:
+            return [self._to_backup(row) for row in connection.execute(statement, params)]
+
+    def get(self, filename):
+        with self._connect() as connection:
+            row = connection.execute("SELECT * FROM backups WHERE filename = ?", (filename,)).fetchone()
+        return self._to_backup(row) if row else None
+
+    def retention_items(self):
+        """(filename, time, type) of every backup file retention applies to (store snapshots prune themselves)"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT filename, timestamp, type FROM backups WHERE format != 'store' AND timestamp IS NOT NULL"
+            ).fetchall()
+        return [(row['filename'], datetime.strptime(row['timestamp'], "%Y%m%d_%H%M%S"), row['type']) for row in rows]
+
+    # ----- rebuild from the backup directory -----
+
+    def _file_entry(self, filename, match):
+        filepath = os.path.join(self.manager.backup_dir, filename)
+        stats = os.stat(filepath)
+        meta = self.manager.read_meta(filepath)
+        backup_type, timestamp, extension = match.groups()
+        verification = meta.get('verification')
+        return {
+            'filename': filename,
+            'type': backup_type,
+            'format': meta.get('format') or EXTENSION_FORMATS[extension],
+            'compression': meta.get('compression'),
+            'created': datetime.fromtimestamp(stats.st_ctime).isoformat(),
+            'timestamp': timestamp,
+            'size': stats.st_size,
+            'raw_size': meta.get('raw_size') or (stats.st_size if extension == '.sql' else None),
+            'sha256': meta.get('sha256'),
+            'dump_seconds': meta.get('dump_seconds'),
+            'verification': verification,
+            'verification_status': verification.get('status') if verification else None,
+        }
+
+    def _snapshot_entry(self, snapshot):
+        filename = snapshot['id'] + SNAPSHOT_SUFFIX
+        match = BACKUP_FILE_RE.match(filename)
+        verification = snapshot.get('verification')
+        return {
+            'filename': filename,
+            'type': snapshot['type'],
+            'format': 'store',
+            'compression': 'zlib chunks',
+            'created': snapshot['created'],
+            'timestamp': match.group(2) if match else None,
+            'size': snapshot['size'],
+            'raw_size': snapshot.get('raw_size'),
+            'stored_bytes': snapshot['new_bytes'],    # Bytes this snapshot added to the store
+            'dump_seconds': snapshot.get('dump_seconds'),
+            'verification': verification,
+            'verification_status': verification.get('status') if verification else None,
+        }
+
+    def _scan(self, known=()):
+        """Entries for backups on disk; files already in `known` are listed by name only"""
+        entries, present = [], set()
+        for filename in os.listdir(self.manager.backup_dir):
+            match = BACKUP_FILE_RE.match(filename)
+            if not match or filename.endswith(SNAPSHOT_SUFFIX):
+                continue
+            present.add(filename)
+            if filename not in known:
+                entries.append(self._file_entry(filename, match))
+        for snapshot in self.manager.store.list_snapshots() if self.manager.store is not None else []:
+            filename = snapshot['id'] + SNAPSHOT_SUFFIX
+            present.add(filename)
+            if filename not in known:
+                entries.append(self._snapshot_entry(snapshot))
+        return entries, present
+
+    def _upload_states(self):
+        """{catalog filename: {target: status}} from the uploader's state files"""
+        uploads = {}
+        uploader = self.manager.uploader
+        for state in uploader.list_uploads() if uploader is not None else []:
+            filename = catalog_name(state['source'])
+            status = state['status'] if state['status'] != 'failed' else f"failed: {state.get('error')}"
+            uploads.setdefault(filename, {})[state['target']] = status
+        return uploads
+
+    def rebuild(self):
+        """Replace the catalog with what is on disk (one directory scan)"""
+        with self._connect(immediate=True) as connection:
+            entries, _present = self._scan()
+            uploads = self._upload_states()
+            connection.execute("DELETE FROM backups")
+            for entry in entries:
+                if entry['filename'] in uploads:
+                    entry['uploads'] = uploads[entry['filename']]
+                    entry['upload_status'] = upload_status(entry['uploads'])
+                self._upsert(connection, entry)
+        print(f"📇 Backup catalog rebuilt: {len(entries)} backups")
+        return len(entries)
+
+    def reconcile(self):
+        """Add backups the catalog is missing and drop entries whose file is gone"""
+        with self._connect(immediate=True) as connection:
+            known = {row['filename'] for row in connection.execute("SELECT filename FROM backups")}
+            entries, present = self._scan(known)
+            for entry in entries:
+                self._upsert(connection, entry)
+            gone = known - present
+            connection.executemany("DELETE FROM backups WHERE filename = ?", [(name,) for name in gone])
+        if entries or gone:
+            print(f"📇 Backup catalog reconciled: {len(entries)} added, {len(gone)} removed")
+        return {'added': len(entries), 'removed': len(gone)}
+
+
+def catalog_name(source):
+    """Catalog filename for an uploaded file (snapshot exports map back to their snapshot)"""
+    name = os.path.basename(source)
+    if name.endswith(EXPORT_SUFFIX):
+        return name[:-len(EXPORT_SUFFIX)] + SNAPSHOT_SUFFIX
+    return name
+
+# Global backup catalog instance
+backup_catalog = BackupCatalog()
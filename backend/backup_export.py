@@ -0,0 +1,428 @@
+"""
+Table Export/Import for Hexashop
+Streams selected tables to JSON Lines, CSV or Parquet and loads them back
+with COPY and upserts - catalog sync without a whole-database restore
+"""
+import gzip
+import io
+import json
+import os
+import secrets
+import tarfile
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import sql
+
+DEFAULT_EXPORT_DIR = 'backups/exports'
+EXPORT_PREFIX = 'hexashop_export_'
+# Parents before children: imports follow this order, replace-mode deletes the reverse
+EXPORT_TABLES = ('product', 'promo_code', 'order', 'order_item')
+EXPORT_FORMATS = {
+    'jsonl': '.jsonl.gz',       # row_to_json per row, server-side cursor
+    'csv': '.csv.gz',           # COPY ... TO STDOUT, streamed straight into gzip
+    'parquet': '.parquet',      # Typed columns, zstd; needs pyarrow
+}
+IMPORT_MODES = ('upsert', 'insert', 'replace')
+FETCH_SIZE = 5000               # Rows per server-side cursor round trip
+IMPORT_BATCH = 5000             # Rows per COPY into the staging table
+
+# information_schema data_type -> pyarrow type name, everything else as string
+PARQUET_TYPES = {
+    'smallint': 'int16',
+    'integer': 'int32',
+    'bigint': 'int64',
+    'real': 'float32',
+    'double precision': 'float64',
+    'boolean': 'bool_',
+    'timestamp without time zone': 'timestamp',
+    'date': 'date32',
+}
+
+
+def _csv_value(value):
+    """One COPY CSV field: unquoted empty is NULL, everything else quoted"""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    elif isinstance(value, datetime):
+        value = value.isoformat()
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet export/import needs pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+class TableTransfer:
+    """
+    Exports are one uncompressed tar per run (backups/exports/<id>.tar)
+    holding a file per table and a manifest.json with columns, primary keys
+    and row counts. All tables of an export are read in one REPEATABLE READ
+    snapshot, so orders and their items stay consistent.
+
+    Imports stream each table file in batches: rows are COPYed into a
+    temporary table shaped like the target, then merged with INSERT ... ON
+    CONFLICT (primary key) DO UPDATE (upsert), DO NOTHING (insert), or after
+    deleting the existing rows (replace). One transaction per import.
+    Memory stays at one fetch/batch whatever the table size.
+    """
+
+    def __init__(self, app=None, manager=None):
+        self.app = app
+        self.manager = manager
+        self.export_dir = DEFAULT_EXPORT_DIR
+
+        if app is not None:
+            self.init_app(app, manager)
+
+    def init_app(self, app, manager):
+        self.app = app
+        self.manager = manager
+        self.export_dir = os.environ.get('EXPORT_DIR', DEFAULT_EXPORT_DIR)
+        os.makedirs(self.export_dir, exist_ok=True)
+        manager.transfer = self
+        app.table_transfer = self
+
+    def _database_url(self):
+        if self.manager is not None and self.manager.app is not None:
+            return self.manager.get_database_url()
+        return os.environ['DATABASE_URL']
+
+    # ----- catalog -----
+
+    def _columns(self, cursor, table):
+        cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position",
+            (table,)
+        )
+        return cursor.fetchall()
+
+    def _primary_key(self, cursor, table):
+        cursor.execute(
+            "SELECT a.attname FROM pg_index i "
+            "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+            "WHERE i.indrelid = %s::regclass AND i.indisprimary",
+            (sql.Identifier(table).as_string(cursor),)
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _check_tables(self, tables):
+        tables = list(tables or EXPORT_TABLES)
+        unknown = [table for table in tables if table not in EXPORT_TABLES]
+        if unknown:
+            raise ValueError(f"Tables not exportable: {', '.join(unknown)} (allowed: {', '.join(EXPORT_TABLES)})")
+        return [table for table in EXPORT_TABLES if table in tables]
+
+    # ----- export -----
+
+    def export_tables(self, tables=None, export_format='jsonl', progress=None):
+        """Export `tables` (default: all exportable) to backups/exports/<id>.tar"""
+        progress = progress or (lambda *args, **kwargs: None)
+        if export_format not in EXPORT_FORMATS:
+            return {"success": False, "error": f"Unknown export format: {export_format}"}
+        try:
+            tables = self._check_tables(tables)
+        except ValueError as e:
+            return {"success": False, "error": str(e)}
+
+        export_id = f"{EXPORT_PREFIX}{datetime.now().strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(2)}"
+        staging = os.path.join(self.export_dir, f"{export_id}.partial")
+        archive_path = os.path.join(self.export_dir, f"{export_id}.tar")
+        os.makedirs(staging, exist_ok=True)
+        started = time.time()
+        manifest = {'id': export_id, 'format': export_format, 'created': datetime.utcnow().isoformat(), 'tables': {}}
+
+        try:
+            connection = psycopg2.connect(self._database_url())
+            try:
+                # One snapshot for every table of the export
+                connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+                for number, table in enumerate(tables, 1):
+                    progress('export', number - 1, len(tables), f"Exporting {table}")
+                    table_started = time.time()
+                    with connection.cursor() as cursor:
+                        columns = self._columns(cursor, table)
+                        primary_key = self._primary_key(cursor, table)
+                    filename = f"{table}{EXPORT_FORMATS[export_format]}"
+                    writer = getattr(self, f"_export_{export_format}")
+                    rows = writer(connection, table, columns, primary_key, os.path.join(staging, filename))
+                    manifest['tables'][table] = {
+                        'file': filename,
+                        'rows': rows,
+                        'columns': [{'name': name, 'type': data_type} for name, data_type in columns],
+                        'primary_key': primary_key,
+                        'bytes': os.path.getsize(os.path.join(staging, filename)),
+                        'seconds': round(time.time() - table_started, 2),
+                    }
+                    print(f"📤 Exported {table}: {rows} rows ({export_format})")
+            finally:
+                connection.rollback()
+                connection.close()
+
+            with open(os.path.join(staging, 'manifest.json'), 'w', encoding='utf-8') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+            with tarfile.open(archive_path + '.tmp', 'w') as archive:
+                archive.add(os.path.join(staging, 'manifest.json'), arcname='manifest.json')
+                for entry in manifest['tables'].values():
+                    archive.add(os.path.join(staging, entry['file']), arcname=entry['file'])
+            os.replace(archive_path + '.tmp', archive_path)
+        except Exception as e:
+            print(f"❌ Export error: {e}")
+            return {"success": False, "error": str(e)}
+        finally:
+            if os.path.exists(archive_path + '.tmp'):
+                os.remove(archive_path + '.tmp')
+            for filename in os.listdir(staging):
+                os.remove(os.path.join(staging, filename))
+            os.rmdir(staging)
+
+        seconds = time.time() - started
+        print(f"✅ Export written: {archive_path} in {seconds:.1f}s")
+        return {
+            "success": True,
+            "file": os.path.basename(archive_path),
+            "size": os.path.getsize(archive_path),
+            "format": export_format,
+            "tables": {table: entry['rows'] for table, entry in manifest['tables'].items()},
+            "seconds": round(seconds, 2)
+        }
+
+    def _select(self, table, columns, primary_key, expression=None):
+        return sql.SQL("SELECT {} FROM {} t ORDER BY {}").format(
+            expression or sql.SQL(', ').join(sql.Identifier(name) for name, _type in columns),
+            sql.Identifier(table),
+            sql.SQL(', ').join(sql.Identifier(name) for name in primary_key) if primary_key else sql.SQL('1'),
+        )
+
+    def _export_jsonl(self, connection, table, columns, primary_key, path):
+        rows = 0
+        # Named cursor = server-side: rows arrive FETCH_SIZE at a time
+        with connection.cursor(name=f"export_{table}") as cursor, gzip.open(path, 'wt', encoding='utf-8') as output:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(self._select(table, columns, primary_key, sql.SQL('row_to_json(t)::text')))
+            for (line,) in cursor:
+                output.write(line)
+                output.write('\n')
+                rows += 1
+        return rows
+
+    def _export_csv(self, connection, table, columns, primary_key, path):
+        with connection.cursor() as cursor, gzip.open(path, 'wb') as output:
+            cursor.copy_expert(
+                sql.SQL("COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER)").format(
+                    self._select(table, columns, primary_key)
+                ).as_string(cursor),
+                output
+            )
+            return cursor.rowcount
+
+    def _export_parquet(self, connection, table, columns, primary_key, path):
+        pyarrow = _pyarrow()
+        schema = pyarrow.schema([
+            (name, pyarrow.timestamp('us') if PARQUET_TYPES.get(data_type) == 'timestamp'
+             else getattr(pyarrow, PARQUET_TYPES.get(data_type, 'string'))())
+            for name, data_type in columns
+        ])
+        string_columns = [index for index, (_name, data_type) in enumerate(columns) if data_type not in PARQUET_TYPES]
+        rows = 0
+        with connection.cursor(name=f"export_{table}") as cursor, \
+                pyarrow.parquet.ParquetWriter(path, schema, compression='zstd') as writer:
+            cursor.itersize = FETCH_SIZE
+            cursor.execute(self._select(table, columns, primary_key))
+            while True:
+                batch = cursor.fetchmany(FETCH_SIZE)
+                if not batch:
+                    break
+                arrays = [list(column) for column in zip(*batch)]
+                for index in string_columns:
+                    arrays[index] = [None if value is None else str(value) for value in arrays[index]]
+                writer.write_table(pyarrow.Table.from_pydict(
+                    {name: arrays[index] for index, (name, _type) in enumerate(columns)}, schema=schema))
+                rows += len(batch)
+        return rows
+
+    # ----- import -----
+
+    def import_tables(self, archive_path, tables=None, mode='upsert', progress=None):
+        """Load an export archive; `tables` limits it to some of the tables it holds"""
+        progress = progress or (lambda *args, **kwargs: None)
+        if mode not in IMPORT_MODES:
+            return {"success": False, "error": f"Unknown import mode: {mode}"}
+        started = time.time()
+        results = {}
+        try:
+            with tarfile.open(archive_path, 'r:') as archive:
+                manifest = json.load(archive.extractfile('manifest.json'))
+                wanted = self._check_tables(tables or list(manifest['tables']))
+                missing = [table for table in wanted if table not in manifest['tables']]
+                if missing:
+                    return {"success": False, "error": f"Not in this export: {', '.join(missing)}"}
+
+                connection = psycopg2.connect(self._database_url())
+                try:
+                    with connection.cursor() as cursor:
+                        if mode == 'replace':
+                            for table in reversed(wanted):
+                                cursor.execute(sql.SQL("DELETE FROM {}").format(sql.Identifier(table)))
+                        for number, table in enumerate(wanted, 1):
+                            progress('import', number - 1, len(wanted), f"Importing {table}")
+                            entry = manifest['tables'][table]
+                            member = archive.extractfile(entry['file'])
+                            results[table] = self._import_table(
+                                cursor, table, member, manifest['format'], [column['name'] for column in entry['columns']],
+                                'insert' if mode == 'replace' else mode
+                            )
+                            print(f"📥 Imported {table}: {results[table]['rows']} rows, {results[table]['written']} written ({mode})")
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                finally:
+                    connection.close()
+        except Exception as e:
+            print(f"❌ Import error: {e}")
+            return {"success": False, "error": str(e)}
+
+        if self.app is not None and {'product', 'promo_code'} & set(results):
+            from routes.products import invalidate_product_cache
+            with self.app.app_context():
+                invalidate_product_cache()
+        seconds = time.time() - started
+        print(f"✅ Import finished: {os.path.basename(archive_path)} in {seconds:.1f}s")
+        return {"success": True, "tables": results, "mode": mode, "seconds": round(seconds, 2)}
+
+    def _import_table(self, cursor, table, member, import_format, file_columns, mode):
+        target_columns = [name for name, _type in self._columns(cursor, table)]
+        columns = [name for name in file_columns if name in target_columns]
+        if import_format == 'csv' and len(columns) != len(file_columns):
+            # COPY reads every CSV field, so the target needs all of them
+            raise ValueError(f"{table} has no column(s) {', '.join(set(file_columns) - set(columns))}")
+        primary_key = self._primary_key(cursor, table)
+        staging = f"import_{table}"
+        cursor.execute(sql.SQL("CREATE TEMP TABLE {} (LIKE {} INCLUDING DEFAULTS) ON COMMIT DROP").format(
+            sql.Identifier(staging), sql.Identifier(table)))
+        column_list = sql.SQL(', ').join(sql.Identifier(name) for name in columns)
+        copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv{})").format(
+            sql.Identifier(staging), column_list, sql.SQL(', HEADER') if import_format == 'csv' else sql.SQL(''))
+
+        if mode == 'upsert' and primary_key:
+            updates = [name for name in columns if name not in primary_key]
+            conflict = sql.SQL(" ON CONFLICT ({}) DO UPDATE SET {}").format(
+                sql.SQL(', ').join(sql.Identifier(name) for name in primary_key),
+                sql.SQL(', ').join(sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(name)) for name in updates)
+            ) if updates else sql.SQL(" ON CONFLICT DO NOTHING")
+        else:
+            conflict = sql.SQL(" ON CONFLICT DO NOTHING")
+        merge = sql.SQL("INSERT INTO {} ({}) SELECT {} FROM {}").format(
+            sql.Identifier(table), column_list, column_list, sql.Identifier(staging)) + conflict
+        totals = {'rows': 0, 'written': 0}
+
+        def flush(buffer, count):
+            buffer.seek(0)
+            cursor.copy_expert(copy.as_string(cursor), buffer)
+            cursor.execute(merge)
+            totals['rows'] += count
+            totals['written'] += cursor.rowcount
+            cursor.execute(sql.SQL("TRUNCATE {}").format(sql.Identifier(staging)))
+
+        if import_format == 'csv':
+            # Already COPY CSV: stream the whole file into the staging table
+            with gzip.open(member, 'rb') as source:
+                cursor.copy_expert(copy.as_string(cursor), source)
+                count = cursor.rowcount
+            cursor.execute(merge)
+            totals.update(rows=count, written=cursor.rowcount)
+        else:
+            for batch in self._read_batches(member, import_format, columns):
+                buffer = io.StringIO()
+                for row in batch:
+                    buffer.write(','.join(_csv_value(value) for value in row))
+                    buffer.write('\n')
+                flush(buffer, len(batch))
+
+        # Keep serial ids ahead of imported rows
+        for name in primary_key:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", (sql.Identifier(table).as_string(cursor), name))
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                cursor.execute(sql.SQL("SELECT setval(%s, GREATEST((SELECT max({}) FROM {}), 1))").format(
+                    sql.Identifier(name), sql.Identifier(table)), (sequence,))
+        cursor.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(staging)))
+        return totals
+
+    def _read_batches(self, member, import_format, columns):
+        """Lists of row tuples (in `columns` order), IMPORT_BATCH at a time"""
+        if import_format == 'jsonl':
+            batch = []
+            with gzip.open(member, 'rt', encoding='utf-8') as source:
+                for line in source:
+                    if line.strip():
+                        record = json.loads(line)
+                        batch.append(tuple(record.get(name) for name in columns))
+                    if len(batch) >= IMPORT_BATCH:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+        else:
+            pyarrow = _pyarrow()
+            parquet = pyarrow.parquet.ParquetFile(member)
+            for record_batch in parquet.iter_batches(batch_size=IMPORT_BATCH, columns=columns):
+                data = record_batch.to_pydict()
+                yield list(zip(*(data[name] for name in columns)))
+
+    # ----- listing -----
+
+    def list_exports(self):
+        exports = []
+        for filename in os.listdir(self.export_dir) if os.path.isdir(self.export_dir) else []:
+            if not (filename.startswith(EXPORT_PREFIX) and filename.endswith('.tar')):
+                continue
+            path = os.path.join(self.export_dir, filename)
+            try:
+                with tarfile.open(path, 'r:') as archive:
+                    manifest = json.load(archive.extractfile('manifest.json'))
+            except (OSError, KeyError, ValueError, tarfile.TarError):
+                continue
+            exports.append({
+                'filename': filename,
+                'size': os.path.getsize(path),
+                'format': manifest['format'],
+                'created': manifest['created'],
+                'tables': {table: entry['rows'] for table, entry in manifest['tables'].items()},
+            })
+        return sorted(exports, key=lambda export: export['created'], reverse=True)
+
+# Global table transfer instance
+table_transfer = TableTransfer()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Hexashop table export/import (uses DATABASE_URL)")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    export = subcommands.add_parser('export')
+    export.add_argument('--tables', default=','.join(EXPORT_TABLES))
+    export.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='jsonl')
+    load = subcommands.add_parser('import')
+    load.add_argument('archive')
+    load.add_argument('--tables', help="Subset of the archive's tables")
+    load.add_argument('--mode', choices=IMPORT_MODES, default='upsert')
+    args = parser.parse_args()
+
+    os.makedirs(table_transfer.export_dir, exist_ok=True)
+    if args.command == 'export':
+        print(json.dumps(table_transfer.export_tables(args.tables.split(','), args.format), indent=2))
+    else:
+        tables = args.tables.split(',') if args.tables else None
+        print(json.dumps(table_transfer.import_tables(args.archive, tables, args.mode), indent=2))
@@ -0,0 +1,473 @@
+"""
+Backup Jobs for Hexashop
+Backups and restores run as queued jobs off the request threads, one at a time across all workers
+"""
+import json
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+JOB_TTL = 7 * 24 * 3600         # Finished jobs stay readable for a week
+JOB_HISTORY = 100               # Jobs listed by /jobs
+LOG_LINES = 200                 # Log lines kept per job
+LEASE_SECONDS = 60              # Runner lock, renewed while a job runs
+HEARTBEAT_INTERVAL = 10         # Seconds between a running job's heartbeats
+HEARTBEAT_TTL = 30              # A job whose heartbeat is older than this has lost its runner
+MAX_ATTEMPTS = 2                # Runs of a job before a crashed one is failed instead of requeued
+POLL_INTERVAL = 2.0             # Seconds between queue checks when idle
+PROGRESS_WRITE_INTERVAL = 1.0   # Seconds between job status writes while running
+DEDUPE_SECONDS = 6 * 3600       # Upper bound on how long a queued job blocks an identical one
+
+# Kinds that change the live database are failed, never rerun, when their runner dies
+NOT_RETRIED = ('restore', 'pitr', 'import')
+
+# Renew the lease only if this runner still holds it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class BackupJobQueue:
+    """
+    Jobs (backup, restore, base_backup, pitr, store_verify, upload,
+    upload_resume, verify, export, import) are JSON documents under
+    hexashop:backup_jobs:job:<id>, queued on a Redis list. Each worker
+    process runs one runner thread; a runner takes the `lock` lease before
+    moving a job onto the `processing` list, so only one pg_dump,
+    pg_basebackup or pg_restore runs at a time across the fleet. Without
+    Redis the queue and job records are kept in this process. A job bound
+    to a host (base backups and PITR need the WAL archive's host) is queued
+    on `queue:<host>`, which only that host's runners read.
+
+    While a job runs, a heartbeat thread renews the lease, the job's
+    heartbeat key and its dedupe key. A runner that takes the lease first
+    recovers jobs left on `processing` by a dead runner: they are requeued,
+    or failed if they touch the live database or ran MAX_ATTEMPTS times,
+    and their dedupe keys are released.
+
+    A job carries status (queued, running, succeeded, failed), stage,
+    progress, bytes/items done and total, timestamps, the runner id, result
+    and a log.
+    """
+
+    def __init__(self, app=None, manager=None, redis_client=None):
+        self.app = app
+        self.manager = manager
+        self.redis = None
+        self.key_prefix = 'hexashop:backup_jobs:'
+        self.runner_id = None
+        self.host = socket.gethostname()
+        self._local_jobs = {}
+        self._local_order = deque(maxlen=JOB_HISTORY)
+        self._local_queue = queue.Queue()
+        self._local_dedupe = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._runner_pid = None
+
+        if app is not None:
+            self.init_app(app, manager, redis_client)
+
+    def init_app(self, app, manager, redis_client=None):
+        self.app = app
+        self.manager = manager
+        self.redis = redis_client
+        if redis_client is not None:
+            self._renew = redis_client.register_script(RENEW_SCRIPT)
+            self._release = redis_client.register_script(RELEASE_SCRIPT)
+        manager.job_queue = self
+        app.backup_jobs = self
+        self._start_runner()
+
+    # ----- job records -----
+
+    def _job_key(self, job_id):
+        return f"{self.key_prefix}job:{job_id}"
+
+    def _heartbeat_key(self, job_id):
+        return f"{self.key_prefix}heartbeat:{job_id}"
+
+    def _alive(self, job):
+        """Whether a running job's runner is still heartbeating"""
+        if self.redis is None or job['status'] != 'running':
+            return True     # Local jobs die with this process; queued jobs need no runner
+        return bool(self.redis.exists(self._heartbeat_key(job['id'])))
+
+    def _save(self, job):
+        if self.redis is None:
+            with self._lock:
+                self._local_jobs[job['id']] = job
+            return
+        self.redis.set(self._job_key(job['id']), json.dumps(job), ex=JOB_TTL)
+
+    def get_job(self, job_id):
+        if self.redis is None:
+            with self._lock:
+                job = self._local_jobs.get(job_id)
+                return json.loads(json.dumps(job)) if job else None
+        raw = self.redis.get(self._job_key(job_id))
+        return json.loads(raw) if raw else None
+
+    def list_jobs(self, limit=20):
+        if self.redis is None:
+            with self._lock:
+                ids = list(self._local_order)[:limit]
+        else:
+            ids = [job_id.decode() if isinstance(job_id, bytes) else job_id
+                   for job_id in self.redis.lrange(f"{self.key_prefix}index", 0, limit - 1)]
+        jobs = [self.get_job(job_id) for job_id in ids]
+        return [job for job in jobs if job]
+
+    # ----- enqueue -----
+
+    def _queue_key(self, host=None):
+        return f"{self.key_prefix}queue:{host}" if host else f"{self.key_prefix}queue"
+
+    def enqueue(self, kind, params, dedupe_key=None, host=None):
+        """
+        Queue a job of one of the kinds above, to run on `host` if given.
+        Returns (job, created); while a job with the same dedupe_key is
+        queued or running, that job is returned instead of a new one.
+        """
+        job_id = f"{datetime.now().strftime('%Y%m%d%H%M%S')}-{secrets.token_hex(3)}"
+        if dedupe_key and not self._claim_dedupe(dedupe_key, job_id):
+            existing = self.get_job(self._dedupe_owner(dedupe_key))
+            if existing and existing['status'] in ('queued', 'running') and self._alive(existing):
+                return existing, False
+            self._release_dedupe(dedupe_key)
+            if not self._claim_dedupe(dedupe_key, job_id):
+                return self.get_job(self._dedupe_owner(dedupe_key)), False
+
+        job = {
+            'id': job_id,
+            'kind': kind,
+            'params': params,
+            'dedupe_key': dedupe_key,
+            'host': host,
+            'status': 'queued',
+            'stage': None,
+            'progress': None,
+            'done': None,
+            'total': None,
+            'created_at': datetime.utcnow().isoformat(),
+            'started_at': None,
+            'finished_at': None,
+            'runner': None,
+            'attempts': 0,
+            'result': None,
+            'error': None,
+            'log': [f"{datetime.utcnow().isoformat()} queued {kind} {params}"],
+        }
+        self._save(job)
+        if self.redis is None:
+            with self._lock:
+                self._local_order.appendleft(job_id)
+            self._local_queue.put(job_id)
+        else:
+            pipe = self.redis.pipeline()
+            pipe.rpush(self._queue_key(host), job_id)
+            pipe.lpush(f"{self.key_prefix}index", job_id)
+            pipe.ltrim(f"{self.key_prefix}index", 0, JOB_HISTORY - 1)
+            pipe.execute()
+
+        self._start_runner()
+        self._wakeup.set()
+        print(f"🗂️ Backup job {job_id} queued ({kind}{f' on {host}' if host else ''})")
+        return job, True
+
+    def enqueue_backup(self, backup_type):
+        # One queued/running backup per type: a manual click during a running dump joins it
+        return self.enqueue('backup', {'type': backup_type}, dedupe_key=f"backup:{backup_type}")
+
+    def enqueue_restore(self, filename, mode=None):
+        # Restores exclude each other whatever the file
+        return self.enqueue('restore', {'filename': filename, 'mode': mode}, dedupe_key='restore')
+
+    def _archive_host(self):
+        wal = getattr(self.manager, 'wal', None)
+        return wal.archive_host() if wal is not None else None
+
+    def enqueue_base_backup(self):
+        # Bases sit next to the WAL they are rolled forward with
+        return self.enqueue('base_backup', {}, dedupe_key='base_backup', host=self._archive_host())
+
+    def enqueue_pitr(self, target_time):
+        return self.enqueue('pitr', {'target_time': target_time}, dedupe_key='restore', host=self._archive_host())
+
+    def enqueue_upload(self, filename):
+        # Shares the 'upload' key with resume runs so two never send the same parts
+        return self.enqueue('upload', {'filename': filename}, dedupe_key='upload')
+
+    def enqueue_verify(self, filename=None):
+        return self.enqueue('verify', {'filename': filename}, dedupe_key='verify')
+
+    def enqueue_export(self, tables, export_format):
+        return self.enqueue('export', {'tables': tables, 'format': export_format},
+                            dedupe_key=f"export:{','.join(tables or [])}:{export_format}")
+
+    def enqueue_import(self, filename, tables, mode):
+        # One import at a time, whatever the archive
+        return self.enqueue('import', {'filename': filename, 'tables': tables, 'mode': mode}, dedupe_key='import')
+
+    def active_job(self, dedupe_key):
+        """The queued or running job holding `dedupe_key`, if any"""
+        job_id = self._dedupe_owner(dedupe_key)
+        job = self.get_job(job_id) if job_id else None
+        if job and job['status'] in ('queued', 'running') and self._alive(job):
+            return job
+        return None
+
+    def queue_length(self):
+        if self.redis is None:
+            return self._local_queue.qsize()
+        return self.redis.llen(self._queue_key()) + self.redis.llen(self._queue_key(self.host))
+
+    def _claim_dedupe(self, dedupe_key, job_id):
+        if self.redis is None:
+            with self._lock:
+                if dedupe_key in self._local_dedupe:
+                    return False
+                self._local_dedupe[dedupe_key] = job_id
+                return True
+        return bool(self.redis.set(f"{self.key_prefix}dedupe:{dedupe_key}", job_id, nx=True, ex=DEDUPE_SECONDS))
+
+    def _dedupe_owner(self, dedupe_key):
+        if self.redis is None:
+            with self._lock:
+                return self._local_dedupe.get(dedupe_key)
+        owner = self.redis.get(f"{self.key_prefix}dedupe:{dedupe_key}")
+        return owner.decode() if isinstance(owner, bytes) else owner
+
+    def _release_dedupe(self, dedupe_key):
+        if self.redis is None:
+            with self._lock:
+                self._local_dedupe.pop(dedupe_key, None)
+            return
+        self.redis.delete(f"{self.key_prefix}dedupe:{dedupe_key}")
+
+    # ----- runner -----
+
+    def _start_runner(self):
+        # One runner thread per (forked) worker process
+        with self._lock:
+            if self._runner_pid == os.getpid():
+                return
+            self._runner_pid = os.getpid()
+            self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        threading.Thread(target=self._run_loop, daemon=True).start()
+
+    def _run_loop(self):
+        while True:
+            try:
+                job_id = self._next_job()
+                if job_id is None:
+                    self._wakeup.wait(POLL_INTERVAL)
+                    self._wakeup.clear()
+                    continue
+                stop = threading.Event()
+                heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop), daemon=True)
+                heartbeat.start()
+                try:
+                    self._run(job_id)
+                finally:
+                    stop.set()
+                    heartbeat.join()
+                    self._finish(job_id)
+                    self._release_lease()
+            except Exception as e:
+                print(f"⚠️ Backup job runner error: {e}")
+                time.sleep(POLL_INTERVAL)
+
+    def _next_job(self):
+        """Pop a job id while holding the runner lease (None if idle or another runner is busy)"""
+        if self.redis is None:
+            try:
+                return self._local_queue.get_nowait()
+            except queue.Empty:
+                return None
+
+        lock_key = f"{self.key_prefix}lock"
+        if not self.redis.set(lock_key, self.runner_id, nx=True, ex=LEASE_SECONDS):
+            return None
+        if not self._recover():
+            self._release_lease()
+            return None
+        processing = f"{self.key_prefix}processing"
+        job_id = (self.redis.lmove(self._queue_key(self.host), processing, 'LEFT', 'RIGHT')
+                  or self.redis.lmove(self._queue_key(), processing, 'LEFT', 'RIGHT'))
+        if job_id is None:
+            self._release_lease()
+            return None
+        job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+        self.redis.set(self._heartbeat_key(job_id), self.runner_id, ex=HEARTBEAT_TTL)
+        return job_id
+
+    def _recover(self):
+        """
+        Requeue or fail jobs left on `processing` by a runner that stopped
+        heartbeating. False while a live runner still has a job there.
+        """
+        processing = f"{self.key_prefix}processing"
+        for job_id in self.redis.lrange(processing, 0, -1):
+            job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+            owner = self.redis.get(self._heartbeat_key(job_id))
+            if owner is not None:
+                owner = owner.decode() if isinstance(owner, bytes) else owner
+                print(f"⚠️ Backup job {job_id} is still heartbeating on {owner}; not starting another")
+                return False
+
+            job = self.get_job(job_id)
+            if job is None or job['status'] not in ('queued', 'running'):
+                self.redis.lrem(processing, 0, job_id)
+                continue
+
+            dedupe_key = job.get('dedupe_key')
+            superseded = dedupe_key and self._dedupe_owner(dedupe_key) not in (None, job_id)
+            started = job['status'] == 'running'
+            if superseded or (started and (job['kind'] in NOT_RETRIED or job.get('attempts', 0) >= MAX_ATTEMPTS)):
+                job.update(status='failed', finished_at=datetime.utcnow().isoformat(),
+                           error=f"Runner {job.get('runner')} stopped heartbeating during {job.get('stage') or 'start-up'}")
+                job['result'] = {'success': False, 'error': job['error']}
+                self._log(job, f"failed: {job['error']}")
+                self._save(job)
+                self.redis.lrem(processing, 0, job_id)
+                if dedupe_key and not superseded:
+                    self._release_dedupe(dedupe_key)
+                print(f"💀 Backup job {job_id} ({job['kind']}) failed: its runner died")
+            else:
+                job.update(status='queued', stage=None, progress=None)
+                self._log(job, f"requeued: runner {job.get('runner')} stopped heartbeating")
+                self._save(job)
+                pipe = self.redis.pipeline()
+                pipe.lrem(processing, 0, job_id)
+                pipe.lpush(self._queue_key(job.get('host')), job_id)
+                if dedupe_key:
+                    pipe.set(f"{self.key_prefix}dedupe:{dedupe_key}", job_id, ex=DEDUPE_SECONDS)
+                pipe.execute()
+                print(f"♻️ Backup job {job_id} ({job['kind']}) requeued: its runner died")
+        return True
+
+    def _heartbeat(self, job_id, stop):
+        """Keep the lease, the job's heartbeat and its dedupe key alive for the whole run"""
+        if self.redis is None:
+            return
+        while True:
+            try:
+                if not self._renew(keys=[f"{self.key_prefix}lock"], args=[self.runner_id, LEASE_SECONDS * 1000]):
+                    print(f"⚠️ Backup job {job_id} lost the runner lease")
+                pipe = self.redis.pipeline()
+                pipe.set(self._heartbeat_key(job_id), self.runner_id, ex=HEARTBEAT_TTL)
+                job = self.get_job(job_id)
+                if job and job.get('dedupe_key') and self._dedupe_owner(job['dedupe_key']) == job_id:
+                    pipe.expire(f"{self.key_prefix}dedupe:{job['dedupe_key']}", DEDUPE_SECONDS)
+                pipe.execute()
+            except Exception as e:
+                print(f"⚠️ Backup job heartbeat failed: {e}")
+            if stop.wait(HEARTBEAT_INTERVAL):
+                return
+
+    def _finish(self, job_id):
+        if self.redis is not None:
+            pipe = self.redis.pipeline()
+            pipe.lrem(f"{self.key_prefix}processing", 0, job_id)
+            pipe.delete(self._heartbeat_key(job_id))
+            pipe.execute()
+
+    def _release_lease(self):
+        if self.redis is not None:
+            self._release(keys=[f"{self.key_prefix}lock"], args=[self.runner_id])
+
+    def _run(self, job_id):
+        job = self.get_job(job_id)
+        if job is None:
+            return  # Expired while queued
+        job.update(status='running', started_at=datetime.utcnow().isoformat(), runner=self.runner_id,
+                   attempts=job.get('attempts', 0) + 1)
+        self._log(job, f"started on {self.runner_id} (attempt {job['attempts']})")
+        self._save(job)
+
+        last_write = [0.0]
+
+        def progress(stage, done=None, total=None, message=None):
+            job['stage'] = stage
+            job['done'] = done
+            job['total'] = total
+            job['progress'] = round(min(done / total, 1.0) * 100, 1) if done is not None and total else None
+            if message:
+                self._log(job, message)
+            now = time.time()
+            if message or now - last_write[0] >= PROGRESS_WRITE_INTERVAL:
+                last_write[0] = now
+                self._save(job)
+
+        try:
+            if job['kind'] == 'backup':
+                result = self.manager.create_backup(job['params']['type'], progress=progress)
+            elif job['kind'] == 'restore':
+                backup_file = os.path.join(self.manager.backup_dir, job['params']['filename'])
+                result = self.manager.restore_backup(backup_file, progress=progress, mode=job['params'].get('mode'))
+            elif job['kind'] == 'base_backup':
+                result = self.manager.create_base_backup(progress=progress)
+            elif job['kind'] == 'pitr':
+                result = self.manager.wal.prepare_pitr(job['params']['target_time'], progress=progress)
+            elif job['kind'] == 'upload':
+                backup_file = os.path.join(self.manager.backup_dir, job['params']['filename'])
+                uploads = self.manager.uploader.upload(backup_file, job['params'].get('type', 'manual'), progress)
+                failed = {target: status for target, status in uploads.items() if status != 'complete'}
+                result = {'success': bool(uploads) and not failed, 'uploads': uploads,
+                          'error': None if uploads and not failed else str(failed or 'No upload target configured')}
+            elif job['kind'] == 'upload_resume':
+                uploads = self.manager.uploader.resume_pending(progress)
+                failed = {key: status for key, status in uploads.items() if status != 'complete'}
+                result = {'success': not failed, 'uploads': uploads, 'error': str(failed) if failed else None}
+            elif job['kind'] == 'export':
+                result = self.manager.export_tables(job['params']['tables'], job['params']['format'], progress)
+            elif job['kind'] == 'import':
+                params = job['params']
+                result = self.manager.import_tables(params['filename'], params['tables'], params['mode'], progress)
+            elif job['kind'] == 'verify':
+                result = self.manager.verifier.verify_backup(job['params'].get('filename'), progress)
+            elif job['kind'] == 'store_verify':
+                verification = self.manager.store.verify(job['params'].get('snapshot'), full=True)
+                result = dict(verification, success=verification['ok'],
+                              error=None if verification['ok'] else
+                              f"{len(verification['bad_chunks'])} bad chunks in {len(verification['damaged_snapshots'])} snapshots")
+            else:
+                result = {'success': False, 'error': f"Unknown job kind: {job['kind']}"}
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        job.update(
+            status='succeeded' if result.get('success') else 'failed',
+            finished_at=datetime.utcnow().isoformat(),
+            result=result,
+            error=None if result.get('success') else result.get('error'),
+        )
+        if result.get('success'):
+            job['progress'] = 100.0
+        self._log(job, f"{job['status']}" + (f": {job['error']}" if job['error'] else ""))
+        self._save(job)
+        if job.get('dedupe_key'):
+            self._release_dedupe(job['dedupe_key'])
+
+    def _log(self, job, message):
+        job['log'].append(f"{datetime.utcnow().isoformat()} {message}")
+        del job['log'][:-LOG_LINES]
+
+# Global backup job queue instance
+backup_jobs = BackupJobQueue()
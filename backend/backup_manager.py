@@ -2,28 +2,92 @@
 Database Backup Manager for Hexashop
 Simple, automated PostgreSQL backup system with Telegram notifications
 """
+import json
 import os
+import re
+import shutil
 import subprocess
-import schedule
+import tarfile
+import tempfile
 import time
 import threading
+from collections import deque
 from datetime import datetime
 from flask import current_app
 import psycopg2
-import requests  # ADDED: For Telegram API calls
 from database import db
+from metrics import metrics_registry
+from backup_store import SNAPSHOT_SUFFIX, MANUAL_RETENTION_HOURS, RETENTION_TIERS, retention_keep, retention_tiers
+from backup_verifier import source_snapshot
+from backup_catalog import EXPORT_SUFFIX, catalog_name, file_sha256
+from job_scheduler import job_scheduler
+
+BACKUP_PREFIX = 'hexashop_backup_'
+META_SUFFIX = '.meta.json'
+
+# BACKUP_FORMAT -> (pg_dump -F value, file extension)
+BACKUP_FORMATS = {
+    'custom': ('c', '.dump'),           # One compressed archive, pg_restore -j capable
+    'directory': ('d', '.dir.tar'),     # One compressed file per table, dumped with -j; tarred afterwards
+    'plain': ('p', '.sql'),             # Legacy uncompressed SQL, restored with psql
+    'store': ('d', SNAPSHOT_SUFFIX),    # Uncompressed directory dump, chunked into the deduplicated store
+}
+DEFAULT_FORMAT = 'custom'
+DEFAULT_COMPRESSION = 'zstd:3'          # Falls back to gzip:6 before pg_dump 16
+PROGRESS_INTERVAL = 1.0                # Seconds between progress reports of a running command
+RESTORE_ITEM_MARKERS = ('processing item', 'finished item')    # pg_restore --verbose, serial / parallel
+
+def _no_progress(stage, done=None, total=None, message=None):
+    pass
+
+def _path_size(path):
+    """Bytes in a file, or in every file below a directory"""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for directory, _subdirs, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(directory, filename))
+            except OSError:
+                pass    # Written and renamed by pg_dump meanwhile
+    return total
 
 class BackupManager:
     def __init__(self, app=None):
         self.app = app
         self.backup_dir = "backups"
-        self.max_backups = 96  # Keep last 96 backups (48 hours of 30-min backups)
+        self.retention_tiers = RETENTION_TIERS  # Hourly for 2 days, daily for 30, weekly for a year
+        self.manual_retention_hours = MANUAL_RETENTION_HOURS  # Manual backups: outside the tiers
+        self.format = DEFAULT_FORMAT
+        self.compression = DEFAULT_COMPRESSION
+        self.jobs = min(4, os.cpu_count() or 1)
+        self._pg_dump_version = None
+        self.job_queue = None  # Set by BackupJobQueue.init_app
+        self.wal = None        # Set by WalArchiver.init_app
+        self.store = None      # Set by BackupStore.init_app
+        self.uploader = None   # Set by BackupUploader.init_app
+        self.verifier = None   # Set by BackupVerifier.init_app
+        self.transfer = None   # Set by TableTransfer.init_app
+        self.catalog = None    # Set by BackupCatalog.init_app
+        self.shadow = None     # Set by ShadowRestorer.init_app
+        self.mode = 'full'
         
         # Create backup directory if it doesn't exist
         os.makedirs(self.backup_dir, exist_ok=True)
     
     def init_app(self, app):
         self.app = app
+        self.format = os.environ.get('BACKUP_FORMAT', DEFAULT_FORMAT).lower()
+        if self.format not in BACKUP_FORMATS:
+            print(f"⚠️ Unknown BACKUP_FORMAT '{self.format}', using {DEFAULT_FORMAT}")
+            self.format = DEFAULT_FORMAT
+        self.compression = os.environ.get('BACKUP_COMPRESSION', DEFAULT_COMPRESSION).lower()
+        self.jobs = max(1, int(os.environ.get('BACKUP_JOBS', self.jobs)))
+        # 'full': logical dumps every 30 minutes; 'incremental': WAL archiving + nightly base backups
+        self.mode = os.environ.get('BACKUP_MODE', 'full').lower()
+        self.retention_tiers = retention_tiers(os.environ.get('BACKUP_RETENTION'))
+        self.manual_retention_hours = float(os.environ.get('BACKUP_MANUAL_RETENTION_HOURS', self.manual_retention_hours))
     
     def get_database_url(self):
         """Extract database connection details from app config"""
@@ -32,81 +96,192 @@ class BackupManager:
             return database_url
         return database_url
     
-    def _send_to_telegram(self, backup_file, backup_type):
-        """Send backup file to Telegram bot"""
+    def pg_dump_version(self):
+        """Major version of the installed pg_dump (cached)"""
+        if self._pg_dump_version is None:
+            output = subprocess.run(['pg_dump', '--version'], capture_output=True, text=True).stdout
+            match = re.search(r'(\d+)(?:\.\d+)?', output)
+            self._pg_dump_version = int(match.group(1)) if match else 0
+        return self._pg_dump_version
+    
+    def _compression_option(self):
+        """pg_dump -Z value: 'zstd:3', 'gzip:6', 'none' (pg_dump 16+) or a gzip level"""
+        method, _, level = self.compression.partition(':')
+        if method in ('none', '0') or self.format == 'store':
+            # Store chunks are compressed individually; compressed dumps would not dedupe
+            return 'none' if self.pg_dump_version() >= 16 else '0'
+        if self.pg_dump_version() >= 16:
+            return self.compression
+        if method != 'gzip':
+            print(f"⚠️ pg_dump {self.pg_dump_version()} has no {method} support, using gzip")
+            return '6'
+        return level or '6'
+    
+    def _dump_command(self, database_url, target, compression, snapshot=None):
+        dump_format, _extension = BACKUP_FORMATS[self.format]
+        command = ['pg_dump', database_url, '-F', dump_format, '-f', target, '--no-password']
+        if snapshot is not None:
+            command += ['--snapshot', snapshot.name]
+        if compression is not None:
+            command += ['-Z', compression]
+        if self.format == 'directory' and self.jobs > 1:
+            command += ['-j', str(self.jobs)]
+        return command
+    
+    def meta_path(self, backup_file):
+        return backup_file + META_SUFFIX
+    
+    def read_meta(self, backup_file):
         try:
-            # Get Telegram credentials from environment variables
-            bot_token = os.environ.get('TELEGRAM_BOT_TOKEN')
-            chat_id = os.environ.get('TELEGRAM_CHAT_ID')
-            
-            if not bot_token or not chat_id:
-                print("⚠️ Telegram credentials not configured. Skipping Telegram upload.")
-                return False
-            
-            # Prepare the message
-            file_size_mb = os.path.getsize(backup_file) / (1024 * 1024)
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            caption = (
-                f"🔐 Hexashop Database Backup\n"
-                f"📅 {timestamp}\n"
-                f"📁 Type: {backup_type}\n"
-                f"📊 Size: {file_size_mb:.2f} MB\n"
-                f"✅ Backup created successfully"
-            )
-            
-            # Send file to Telegram
-            url = f"https://api.telegram.org/bot{bot_token}/sendDocument"
-            
-            with open(backup_file, 'rb') as file:
-                files = {'document': (os.path.basename(backup_file), file)}
-                data = {'chat_id': chat_id, 'caption': caption}
-                
-                response = requests.post(url, files=files, data=data, timeout=30)
-                response.raise_for_status()
-                
-                if response.json().get('ok'):
-                    print(f"✅ Backup sent to Telegram: {os.path.basename(backup_file)}")
-                    return True
-                else:
-                    print(f"❌ Telegram API error: {response.json()}")
-                    return False
-                    
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Telegram connection error: {str(e)}")
-            return False
-        except Exception as e:
-            print(f"❌ Telegram upload error: {str(e)}")
-            return False
+            with open(self.meta_path(backup_file), encoding='utf-8') as meta_file:
+                return json.load(meta_file)
+        except (OSError, ValueError):
+            return {}
+    
+    def _write_meta(self, backup_file, meta):
+        temp_path = self.meta_path(backup_file) + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+        os.replace(temp_path, self.meta_path(backup_file))
     
-    def create_backup(self, backup_type="manual"):
-        """Create a database backup and send to Telegram"""
+    def backup_meta(self, filename):
+        """Metadata of a backup file or store snapshot"""
+        if filename.endswith(SNAPSHOT_SUFFIX):
+            return self.store.get_manifest(filename[:-len(SNAPSHOT_SUFFIX)])
+        return self.read_meta(os.path.join(self.backup_dir, filename))
+    
+    def update_meta(self, filename, fields):
+        if filename.endswith(SNAPSHOT_SUFFIX):
+            self.store.update_meta(filename[:-len(SNAPSHOT_SUFFIX)], fields)
+            self.catalog.update_meta(filename, fields)
+            return
+        backup_file = os.path.join(self.backup_dir, filename)
+        meta = self.read_meta(backup_file)
+        meta.update(fields)
+        self._write_meta(backup_file, meta)
+        self.catalog.update_meta(filename, fields)
+    
+    def backup_exists(self, filename):
+        if filename.endswith(SNAPSHOT_SUFFIX):
+            return self.store is not None and self.store.exists(filename[:-len(SNAPSHOT_SUFFIX)])
+        return os.path.exists(os.path.join(self.backup_dir, filename))
+    
+    def delete_backup_file(self, backup_file):
+        """Remove a backup and its metadata sidecar (or a store snapshot)"""
+        self.catalog.remove(os.path.basename(backup_file))
+        if backup_file.endswith(SNAPSHOT_SUFFIX):
+            snapshot_id = os.path.basename(backup_file)[:-len(SNAPSHOT_SUFFIX)]
+            self.store.delete_snapshot(snapshot_id)
+            self._remove_export(snapshot_id)
+            return
+        os.remove(backup_file)
+        if os.path.exists(self.meta_path(backup_file)):
+            os.remove(self.meta_path(backup_file))
+        if self.uploader is not None:
+            self.uploader.forget(backup_file)
+    
+    def export_path(self, snapshot_id):
+        """Single-file copy of a store snapshot, kept only until every upload target has it"""
+        return os.path.join(self.backup_dir, snapshot_id + EXPORT_SUFFIX)
+    
+    def _remove_export(self, snapshot_id):
+        if os.path.exists(self.export_path(snapshot_id)):
+            os.remove(self.export_path(snapshot_id))
+        if self.uploader is not None:
+            self.uploader.forget(self.export_path(snapshot_id))
+    
+    def record_upload(self, source, target, status):
+        """Called by the uploader as each target finishes or fails"""
+        self.catalog.set_upload(catalog_name(source), target, status)
+    
+    def _upload_offsite(self, backup_file, backup_type, progress, object_name=None):
+        """Copy a backup to the configured off-site targets; failed uploads are resumed later"""
+        if self.uploader is None or not self.uploader.enabled():
+            return {}
+        progress('upload', 0, os.path.getsize(backup_file), "Uploading off-site")
+        return self.uploader.upload(backup_file, backup_type, progress, object_name=object_name)
+    
+    def create_backup(self, backup_type="manual", progress=None):
+        """
+        Create a database backup and copy it off-site. `progress`, when
+        given, is called as progress(stage, done, total, message).
+        """
+        started = time.time()
+        result = self._create_backup(backup_type, progress or _no_progress)
+        metrics_registry.observe(
+            'hexashop_backup_duration_seconds',
+            time.time() - started,
+            type=backup_type,
+            status='success' if result.get('success') else 'failure'
+        )
+        return result
+    
+    def _create_backup(self, backup_type, progress):
         try:
             database_url = self.get_database_url()
+            _dump_format, extension = BACKUP_FORMATS[self.format]
             
             # Generate backup filename with timestamp
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             backup_file = os.path.join(
                 self.backup_dir, 
-                f"hexashop_backup_{backup_type}_{timestamp}.sql"
+                f"{BACKUP_PREFIX}{backup_type}_{timestamp}{extension}"
             )
+            if self.format == 'store':
+                return self._create_snapshot(backup_type, timestamp, database_url, progress)
+            # Directory dumps are written next to the final file and tarred
+            dump_target = backup_file[:-len('.tar')] if self.format == 'directory' else backup_file
             
             # Use pg_dump to create backup
             env = os.environ.copy()
             
-            # For local PostgreSQL installation
-            result = subprocess.run([
-                'pg_dump',
-                database_url,
-                '-f', backup_file,
-                '--verbose',
-                '--no-password'
-            ], capture_output=True, text=True, env=env)
+            compression = None if self.format == 'plain' else self._compression_option()
+            previous = next(iter(self.list_backups(format=self.format, limit=1)), None)
+            progress('dump', 0, previous['size'] if previous else None, f"pg_dump ({self.format}) started")
+            started = time.time()
+            with source_snapshot(database_url) as snapshot:
+                # Row counts and checksums from the dump's own snapshot, for restore verification
+                if snapshot is not None:
+                    snapshot.start_fingerprints()
+                result = self._run_command(
+                    self._dump_command(database_url, dump_target, compression, snapshot), env,
+                    progress, 'dump',
+                    measure=lambda output: _path_size(dump_target),
+                    total=previous['size'] if previous else None  # Estimate: the last backup's size
+                )
+                fingerprints = snapshot.wait() if snapshot is not None else None
+                # Table data in the dump's snapshot: the 'raw' side of the compression ratio
+                raw_size = snapshot.table_bytes if snapshot is not None else None
             
             if result.returncode == 0:
-                print(f"✅ Backup created successfully: {backup_file}")
+                dump_seconds = time.time() - started
+                if self.format == 'directory':
+                    progress('pack', None, None, "Packing directory dump")
+                    self._pack_directory(dump_target, backup_file)
+                size = os.path.getsize(backup_file)
+                if self.format == 'plain':
+                    raw_size = size
+                sha256 = file_sha256(backup_file)
+                self._write_meta(backup_file, {
+                    'format': self.format,
+                    'compression': compression,
+                    'jobs': self.jobs if self.format == 'directory' else 1,
+                    'size': size,
+                    'raw_size': raw_size,
+                    'sha256': sha256,
+                    'dump_seconds': round(dump_seconds, 2),
+                    'pg_dump_version': self.pg_dump_version(),
+                    'fingerprints': fingerprints,
+                })
+                self.catalog.record(
+                    os.path.basename(backup_file), type=backup_type, format=self.format,
+                    compression=compression, created=datetime.now().isoformat(), timestamp=timestamp,
+                    size=size, raw_size=raw_size, sha256=sha256, dump_seconds=round(dump_seconds, 2)
+                )
+                print(f"✅ Backup created successfully: {backup_file} ({size / (1024 * 1024):.2f} MB in {dump_seconds:.1f}s)")
+                progress('dump', size, size, f"Dump written: {os.path.basename(backup_file)}")
                 
-                # Try to send to Telegram
-                telegram_sent = self._send_to_telegram(backup_file, backup_type)
+                uploads = self._upload_offsite(backup_file, backup_type, progress)
                 
                 # Clean up old backups
                 self._cleanup_old_backups()
@@ -114,12 +289,17 @@ class BackupManager:
                 return {
                     "success": True,
                     "file": backup_file,
-                    "size": os.path.getsize(backup_file),
+                    "size": size,
+                    "raw_size": raw_size,
+                    "format": self.format,
                     "timestamp": timestamp,
                     "type": backup_type,
-                    "telegram_sent": telegram_sent
+                    "uploads": uploads,
+                    "telegram_sent": uploads.get('telegram') == 'complete'
                 }
             else:
+                if self.format == 'directory':
+                    shutil.rmtree(dump_target, ignore_errors=True)
                 print(f"❌ Backup failed: {result.stderr}")
                 return {
                     "success": False,
@@ -133,30 +313,115 @@ class BackupManager:
                 "error": str(e)
             }
     
-    def restore_backup(self, backup_file):
-        """Restore database from backup file"""
+    def _create_snapshot(self, backup_type, timestamp, database_url, progress):
+        """Dump uncompressed in directory format and chunk it into the backup store"""
+        snapshot_id = f"{BACKUP_PREFIX}{backup_type}_{timestamp}"
+        dump_target = os.path.join(self.backup_dir, f"{snapshot_id}.staging")
+        previous = next(iter(self.store.list_snapshots()), None)
+        progress('dump', 0, previous['size'] if previous else None, "pg_dump (store) started")
+        started = time.time()
         try:
-            if not os.path.exists(backup_file):
-                return {"success": False, "error": "Backup file not found"}
+            with source_snapshot(database_url) as source:
+                if source is not None:
+                    source.start_fingerprints()
+                result = self._run_command(
+                    self._dump_command(database_url, dump_target, self._compression_option(), source),
+                    os.environ.copy(), progress, 'dump',
+                    measure=lambda output: _path_size(dump_target),
+                    total=previous['size'] if previous else None
+                )
+                fingerprints = source.wait() if source is not None else None
+                raw_size = source.table_bytes if source is not None else None
+            if result.returncode != 0:
+                print(f"❌ Backup failed: {result.stderr}")
+                return {"success": False, "error": result.stderr}
             
-            database_url = self.get_database_url()
+            dump_seconds = time.time() - started
+            snapshot = self.store.ingest(dump_target, snapshot_id, backup_type, {
+                'format': 'store',
+                'raw_size': raw_size,
+                'dump_seconds': round(dump_seconds, 2),
+                'pg_dump_version': self.pg_dump_version(),
+                'fingerprints': fingerprints,
+            }, progress)
+        finally:
+            shutil.rmtree(dump_target, ignore_errors=True)
+        self.catalog.record(
+            f"{snapshot_id}{SNAPSHOT_SUFFIX}", type=backup_type, format='store', compression='zlib chunks',
+            created=snapshot['created'], timestamp=timestamp, size=snapshot['size'],
+            raw_size=snapshot['raw_size'], stored_bytes=snapshot['new_bytes'], dump_seconds=snapshot['dump_seconds']
+        )
+        
+        # Off-site copy as one tar; kept until every target has it so a failed upload can resume
+        uploads = {}
+        if self.uploader is not None and self.uploader.enabled():
+            export_path = self.export_path(snapshot_id)
+            self.store.export_tar(snapshot_id, export_path)
+            uploads = self._upload_offsite(export_path, backup_type, progress, object_name=f"{snapshot_id}.dir.tar")
+            if all(status == 'complete' for status in uploads.values()):
+                os.remove(export_path)
+        
+        self._cleanup_old_backups()
+        return {
+            "success": True,
+            "file": f"{snapshot_id}{SNAPSHOT_SUFFIX}",
+            "size": snapshot['size'],
+            "stored_bytes": snapshot['new_bytes'],
+            "raw_size": snapshot['raw_size'],
+            "format": 'store',
+            "timestamp": timestamp,
+            "type": backup_type,
+            "uploads": uploads,
+            "telegram_sent": uploads.get('telegram') == 'complete'
+        }
+    
+    def _pack_directory(self, dump_dir, backup_file):
+        """Tar a directory-format dump (members are already compressed) so a backup stays one file"""
+        temp_path = backup_file + '.tmp'
+        with tarfile.open(temp_path, 'w') as archive:
+            archive.add(dump_dir, arcname='dump')
+        os.replace(temp_path, backup_file)
+        shutil.rmtree(dump_dir)
+    
+    def _unpack_directory(self, backup_file, destination):
+        """Extract a .dir.tar, refusing links and paths that escape the destination"""
+        root = os.path.realpath(destination)
+        with tarfile.open(backup_file) as archive:
+            members = archive.getmembers()
+            for member in members:
+                target = os.path.realpath(os.path.join(root, member.name))
+                if not (member.isfile() or member.isdir()) or os.path.commonpath([root, target]) != root:
+                    raise ValueError(f"Unsafe entry in backup archive: {member.name}")
+            archive.extractall(root, members=members)
+    
+    def restore_backup(self, backup_file, progress=None, mode=None):
+        """
+        Restore database from backup file, reporting progress(stage, done, total, message).
+        mode 'shadow' restores into a new database and swaps it in (see shadow_restore.py),
+        'inplace' restores over the live database; the default is BACKUP_RESTORE_MODE (inplace).
+        """
+        progress = progress or _no_progress
+        try:
+            if not self.backup_exists(os.path.basename(backup_file)):
+                return {"success": False, "error": "Backup file not found"}
             
-            # Use psql to restore backup
-            env = os.environ.copy()
+            mode = mode or (self.shadow.mode if self.shadow is not None else 'inplace')
+            if mode == 'shadow':
+                return self.shadow.restore(backup_file, progress)
             
-            result = subprocess.run([
-                'psql',
-                database_url,
-                '-f', backup_file,
-                '--verbose',
-                '--no-password'
-            ], capture_output=True, text=True, env=env)
+            started = time.time()
+            result = self.restore_into(self.get_database_url(), backup_file, progress)
             
             if result.returncode == 0:
-                print(f"✅ Database restored successfully from: {backup_file}")
+                print(f"✅ Database restored successfully from: {backup_file} in {time.time() - started:.1f}s")
+                from routes.products import clear_all_cache
+                with self.app.app_context():
+                    clear_all_cache()   # Cached listings describe the pre-restore data
                 return {
                     "success": True,
-                    "message": "Database restored successfully"
+                    "message": "Database restored successfully",
+                    "mode": "inplace",
+                    "seconds": round(time.time() - started, 2)
                 }
             else:
                 print(f"❌ Restore failed: {result.stderr}")
@@ -172,82 +437,194 @@ class BackupManager:
                 "error": str(e)
             }
     
-    def list_backups(self):
-        """List all available backups"""
+    def restore_into(self, database_url, backup_file, progress=_no_progress, jobs=None, strict=False):
+        """
+        Restore any backup format into `database_url` and return the finished
+        process. `strict` stops plain SQL replays at the first error (psql
+        otherwise carries on and exits 0).
+        """
+        env = os.environ.copy()
+        if backup_file.endswith(SNAPSHOT_SUFFIX):
+            with tempfile.TemporaryDirectory(dir=self.backup_dir) as scratch:
+                progress('unpack', None, None, "Rebuilding dump from the backup store")
+                snapshot_id = os.path.basename(backup_file)[:-len(SNAPSHOT_SUFFIX)]
+                self.store.materialize(snapshot_id, os.path.join(scratch, 'dump'))
+                return self._pg_restore(database_url, os.path.join(scratch, 'dump'), env, progress, jobs)
+        if backup_file.endswith('.sql'):
+            # Plain SQL dumps can only be replayed by psql, single-threaded
+            progress('restore', None, None, "psql restore started")
+            command = ['psql', database_url, '-f', backup_file, '--no-password']
+            if strict:
+                command += ['-v', 'ON_ERROR_STOP=1']
+            return self._run_command(command, env)
+        if backup_file.endswith('.dir.tar'):
+            with tempfile.TemporaryDirectory(dir=self.backup_dir) as scratch:
+                progress('unpack', None, None, "Unpacking directory dump")
+                self._unpack_directory(backup_file, scratch)
+                return self._pg_restore(database_url, os.path.join(scratch, 'dump'), env, progress, jobs)
+        return self._pg_restore(database_url, backup_file, env, progress, jobs)
+    
+    def _pg_restore(self, database_url, source, env, progress, jobs=None):
+        """Parallel pg_restore of a custom or directory archive, replacing existing objects"""
+        jobs = jobs or self.jobs
+        # The archive's table of contents gives the number of items to restore
+        listing = subprocess.run(['pg_restore', '-l', source], capture_output=True, text=True, env=env)
+        total = sum(1 for line in listing.stdout.splitlines() if line and not line.startswith(';')) or None
+        progress('restore', 0, total, f"pg_restore -j {jobs} started")
+        return self._run_command([
+            'pg_restore',
+            '-d', database_url,
+            '-j', str(jobs),
+            '--clean', '--if-exists',
+            '--no-owner', '--no-privileges',
+            '--no-password',
+            '--verbose',
+            source
+        ], env, progress, 'restore', measure=lambda output: output['items'], total=total)
+    
+    def _run_command(self, command, env, progress=_no_progress, stage=None, measure=None, total=None):
+        """
+        Run a pg_* command, calling progress(stage, measure(output), total)
+        every PROGRESS_INTERVAL (measure may return (done, total) instead). Only the tail of stderr is kept; restore
+        items are counted as the verbose lines stream past.
+        """
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   text=True, env=env)
+        output = {'lines': deque(maxlen=200), 'items': 0}
+        
+        def read_stderr():
+            for line in process.stderr:
+                if any(marker in line for marker in RESTORE_ITEM_MARKERS):
+                    output['items'] += 1
+                else:
+                    output['lines'].append(line)
+        
+        reader = threading.Thread(target=read_stderr, daemon=True)
+        reader.start()
+        while True:
+            try:
+                process.wait(timeout=PROGRESS_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if measure is not None:
+                    done = measure(output)
+                    if isinstance(done, tuple):
+                        done, total = done     # The command reports its own total
+                    progress(stage, done, total, None)
+        reader.join()
+        return subprocess.CompletedProcess(command, process.returncode, None, ''.join(output['lines']))
+    
+    def list_backups(self, **filters):
+        """
+        Backups newest first, from the catalog. Filters: type, format,
+        verification (status), upload (status), since/until (ISO time), limit.
+        """
         try:
-            backups = []
-            for filename in os.listdir(self.backup_dir):
-                if filename.endswith('.sql') and filename.startswith('hexashop_backup_'):
-                    filepath = os.path.join(self.backup_dir, filename)
-                    stats = os.stat(filepath)
-                    
-                    # Parse backup type and timestamp from filename
-                    parts = filename.replace('hexashop_backup_', '').replace('.sql', '').split('_')
-                    backup_type = parts[0]
-                    timestamp = '_'.join(parts[1:])
-                    
-                    backups.append({
-                        'filename': filename,
-                        'filepath': filepath,
-                        'size': stats.st_size,
-                        'created': datetime.fromtimestamp(stats.st_ctime).isoformat(),
-                        'type': backup_type,
-                        'timestamp': timestamp
-                    })
-            
-            # Sort by creation time (newest first)
-            backups.sort(key=lambda x: x['created'], reverse=True)
-            return backups
-            
+            return self.catalog.query(**filters)
         except Exception as e:
             print(f"❌ Error listing backups: {str(e)}")
             return []
     
     def _cleanup_old_backups(self):
-        """Remove old backups beyond the maximum limit"""
+        """Apply the grandfather-father-son tiers to backup files and store snapshots"""
         try:
-            backups = self.list_backups()
+            items = self.catalog.retention_items()
+            keep = retention_keep(items, tiers=self.retention_tiers, manual_hours=self.manual_retention_hours)
+            backups_to_delete = [filename for filename, _created, _type in items if filename not in keep]
             
-            if len(backups) > self.max_backups:
-                # Keep only the newest max_backups
-                backups_to_delete = backups[self.max_backups:]
-                
-                for backup in backups_to_delete:
-                    os.remove(backup['filepath'])
-                    print(f"🗑️ Deleted old backup: {backup['filename']}")
-                
+            for filename in backups_to_delete:
+                backup_file = os.path.join(self.backup_dir, filename)
+                if os.path.exists(backup_file):
+                    self.delete_backup_file(backup_file)
+                else:
+                    self.catalog.remove(filename)
+                print(f"🗑️ Deleted old backup: {filename}")
+            
+            if backups_to_delete:
                 print(f"✅ Cleaned up {len(backups_to_delete)} old backups")
+            
+            if self.store is not None:
+                pruned = self.store.prune()
+                self.catalog.remove(*(snapshot_id + SNAPSHOT_SUFFIX for snapshot_id in pruned['expired']))
+                for snapshot_id in pruned['expired']:
+                    self._remove_export(snapshot_id)
                 
         except Exception as e:
             print(f"❌ Error cleaning up backups: {str(e)}")
     
-    def schedule_automatic_backups(self):
-        """Schedule automatic backups at :00 and :30 of every hour"""
-        # Backup at :00 and :30 of every hour (clock-aligned)
-        schedule.every().hour.at(":00").do(
-            lambda: self.create_backup("auto_30min")
-        )
-        schedule.every().hour.at(":30").do(
-            lambda: self.create_backup("auto_30min")
-        )
-        
-        # Daily backup at 2 AM (as a fallback)
-        schedule.every().day.at("02:00").do(
-            lambda: self.create_backup("auto_daily")
-        )
-        
-        print("✅ Automatic backups scheduled: At :00 and :30 of every hour + Daily at 02:00")
-        print("💾 Backup retention: Last 96 backups (48 hours)")
-        print("🤖 Telegram notifications: Enabled" if os.environ.get('TELEGRAM_BOT_TOKEN') else "⚠️ Telegram notifications: Not configured")
-        
-        # Run scheduler in background thread
-        def run_scheduler():
-            while True:
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
-        
-        scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-        scheduler_thread.start()
+    def export_tables(self, tables=None, export_format='jsonl', progress=None):
+        """Selected tables to JSON Lines, CSV or Parquet (backups/exports/<id>.tar)"""
+        return self.transfer.export_tables(tables, export_format, progress)
+    
+    def import_tables(self, filename, tables=None, mode='upsert', progress=None):
+        """Load an export archive into the live database with upsert/insert/replace semantics"""
+        return self.transfer.import_tables(os.path.join(self.transfer.export_dir, filename), tables, mode, progress)
+    
+    def create_base_backup(self, progress=None):
+        """Physical base backup for incremental mode (see wal_backups.py)"""
+        if self.wal is None:
+            return {"success": False, "error": "WAL archiving is not configured"}
+        return self.wal.create_base_backup(progress)
+    
+    def _scheduled_base_backup(self):
+        if self.job_queue is not None:
+            self.job_queue.enqueue_base_backup()
+        else:
+            self.create_base_backup()
+    
+    def _scheduled_verify(self):
+        """Restore-test the newest backup; queued so it never overlaps a dump or restore"""
+        if self.job_queue is not None:
+            self.job_queue.enqueue_verify()
+        else:
+            self.verifier.verify_backup()
+    
+    def _scheduled_upload_resume(self):
+        if not self.uploader.pending():
+            return
+        if self.job_queue is not None:
+            self.job_queue.enqueue('upload_resume', {}, dedupe_key='upload')
+        else:
+            self.uploader.resume_pending()
+    
+    def _scheduled_backup(self, backup_type):
+        """Scheduled backups share the job queue with manual ones"""
+        if self.job_queue is not None:
+            self.job_queue.enqueue_backup(backup_type)
+        else:
+            self.create_backup(backup_type)
+    
+    def schedule_automatic_backups(self, scheduler=job_scheduler):
+        """Register backups at :00 and :30 of every hour (full mode) or nightly base backups (incremental)"""
+        if self.mode == 'incremental' and self.wal is not None and self.wal.enabled:
+            # WAL streams continuously; a nightly base backup bounds replay time,
+            # and a daily logical dump stays as the portable/Telegram copy
+            scheduler.add('base_backup', self._scheduled_base_backup, at="02:00")
+            scheduler.add('backup_daily', lambda: self._scheduled_backup("auto_daily"), at="02:30")
+            print("✅ Incremental backups: continuous WAL archiving + base backup daily at 02:00 + dump at 02:30")
+            print(f"💾 Base backup retention: last {self.wal.base_keep} (WAL kept back to the oldest)")
+        else:
+            # Backup at :00 and :30 of every hour (clock-aligned)
+            scheduler.add('backup_30min', lambda: self._scheduled_backup("auto_30min"), every=1800, jitter=30)
+            
+            # Daily backup at 2 AM (as a fallback)
+            scheduler.add('backup_daily', lambda: self._scheduled_backup("auto_daily"), at="02:00", jitter=30)
+            
+            print("✅ Automatic backups scheduled: At :00 and :30 of every hour + Daily at 02:00")
+            print("💾 Backup retention: " + ", ".join(f"{name} x{count}" for name, _period, count in self.retention_tiers)
+                  + f", manual {self.manual_retention_hours:g}h")
+        print(f"🗜️ Backup format: {self.format}" + ("" if self.format == 'plain' else f" ({self.compression}, {self.jobs} jobs)"))
+        if self.verifier is not None and self.verifier.enabled:
+            scheduler.add('backup_verify', self._scheduled_verify, at=self.verifier.verify_time, jitter=300)
+            print(f"🧪 Backup verification: newest backup restore-tested daily at {self.verifier.verify_time}")
+        # Picks up backup files added or removed outside the manager
+        scheduler.add('backup_catalog_reconcile', self.catalog.reconcile, every=3600, offset=1500, jitter=300)
+        if self.uploader is not None and self.uploader.enabled():
+            # Uploads interrupted by a crash or outage are picked up again
+            scheduler.add('upload_resume', self._scheduled_upload_resume, every=900, offset=420, jitter=60)
+            print("☁️ Off-site uploads: " + ", ".join(target.name for target in self.uploader.targets))
+        else:
+            print("⚠️ Off-site uploads: No target configured")
 
 # Global backup manager instance
 backup_manager = BackupManager()
\ No newline at end of file
@@ -0,0 +1,429 @@
+"""
+Backup Store for Hexashop
+Content-addressed, deduplicated snapshots of directory-format dumps with GFS retention
+"""
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+DEFAULT_STORE_DIR = os.path.join('backups', 'store')
+SNAPSHOT_SUFFIX = '.snapshot'
+
+# Content-defined chunking on row boundaries: pg_dump writes table data as
+# COPY text, one row per line. A chunk ends after a line whose CRC32 has the
+# low bits clear, so an inserted or updated row only changes the chunk it
+# lands in - the boundaries around it stay where they were.
+BOUNDARY_MASK = 0x1FF           # ~1 boundary per 512 lines
+MIN_CHUNK = 64 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+COMPRESSION_LEVEL = 6
+
+# Grandfather-father-son: (tier, seconds per period, periods kept). The
+# newest snapshot of each period is kept; BACKUP_RETENTION overrides the
+# counts, e.g. "hourly=48,daily=30,weekly=52".
+RETENTION_TIERS = (
+    ('hourly', 3600, 48),           # 2 days
+    ('daily', 86400, 30),           # 30 days
+    ('weekly', 7 * 86400, 52),      # 1 year
+)
+ALWAYS_KEEP = 2                     # Newest snapshots kept whatever the tiers say
+MANUAL_RETENTION_HOURS = 48         # Manual backups sit outside the tiers and are kept this long
+
+
+def retention_tiers(spec=None):
+    """RETENTION_TIERS with counts from a "hourly=48,daily=30,weekly=52" spec"""
+    counts = {}
+    for part in (spec or '').split(','):
+        name, _, count = part.partition('=')
+        if name.strip() and count.strip():
+            counts[name.strip()] = int(count)
+    return tuple((name, period, counts.get(name, keep)) for name, period, keep in RETENTION_TIERS)
+
+
+def gfs_keep(items, now=None, tiers=RETENTION_TIERS, always_keep=ALWAYS_KEEP):
+    """
+    items: [(key, created datetime)]. Returns {key: [tiers]} for the items
+    to keep - the newest item of each hourly/daily/weekly period inside
+    that tier's window, plus the newest `always_keep`.
+    """
+    now = now or datetime.now()
+    newest_first = sorted(items, key=lambda item: item[1], reverse=True)
+    keep = {key: ['latest'] for key, _created in newest_first[:always_keep]}
+    now_ts = now.timestamp()
+    for name, period, count in tiers:
+        current = int(now_ts // period)
+        seen = set()
+        for key, created in newest_first:
+            bucket = int(created.timestamp() // period)
+            if current - bucket >= count:
+                break           # Sorted newest first: everything after is older
+            if bucket not in seen:
+                seen.add(bucket)
+                keep.setdefault(key, []).append(name)
+    return keep
+
+
+def retention_keep(items, now=None, tiers=RETENTION_TIERS, manual_hours=MANUAL_RETENTION_HOURS):
+    """
+    items: [(key, created datetime, backup type)]. Scheduled backups go
+    through gfs_keep; manual ones are kept for `manual_hours` instead, so a
+    manual backup never takes an auto_30min backup's place in a tier.
+    """
+    now = now or datetime.now()
+    keep = gfs_keep([(key, created) for key, created, backup_type in items if backup_type != 'manual'], now, tiers)
+    for key, created, backup_type in items:
+        if backup_type == 'manual' and (now - created).total_seconds() < manual_hours * 3600:
+            keep.setdefault(key, []).append('manual')
+    for key, _created, _type in sorted(items, key=lambda item: item[1], reverse=True)[:ALWAYS_KEEP]:
+        keep.setdefault(key, ['latest'])
+    return keep
+
+
+def iter_chunks(path):
+    """Yield content-defined chunks of a file"""
+    buffer = []
+    size = 0
+    crc32 = zlib.crc32
+    with open(path, 'rb') as source:
+        for line in source:
+            buffer.append(line)
+            size += len(line)
+            if size >= MAX_CHUNK or (size >= MIN_CHUNK and not crc32(line) & BOUNDARY_MASK):
+                yield b''.join(buffer)
+                buffer = []
+                size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+class BackupStore:
+    """
+    Layout under backups/store:
+
+        chunks/ab/<sha256>          zlib-compressed chunk, named by the hash of its content
+        snapshots/<id>.json         manifest: files -> [[sha256, length], ...]
+        index.json                  snapshot summaries (listing never opens manifests)
+        lock                        flock held while the store is modified
+
+    A snapshot stores only chunks no earlier snapshot had. Pruning deletes
+    manifests outside the GFS tiers and then sweeps chunks no remaining
+    manifest references.
+    """
+
+    def __init__(self, app=None, manager=None):
+        self.app = app
+        self.manager = manager
+        self.root = DEFAULT_STORE_DIR
+        self.tiers = RETENTION_TIERS
+        self.manual_hours = MANUAL_RETENTION_HOURS
+
+        if app is not None:
+            self.init_app(app, manager)
+
+    def init_app(self, app, manager):
+        self.app = app
+        self.manager = manager
+        self.root = os.environ.get('BACKUP_STORE_DIR', DEFAULT_STORE_DIR)
+        self.tiers = retention_tiers(os.environ.get('BACKUP_RETENTION'))
+        self.manual_hours = float(os.environ.get('BACKUP_MANUAL_RETENTION_HOURS', self.manual_hours))
+        manager.store = self
+        app.backup_store = self
+
+    # ----- layout -----
+
+    def _path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def _chunk_path(self, digest):
+        return self._path('chunks', digest[:2], digest)
+
+    def _manifest_path(self, snapshot_id):
+        return self._path('snapshots', f"{snapshot_id}.json")
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path('lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self._path('index.json'), encoding='utf-8') as index_file:
+                return json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        temp_path = self._path('index.json.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as index_file:
+            json.dump(index, index_file)
+        os.replace(temp_path, self._path('index.json'))
+
+    def _write_json(self, path, document):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w', encoding='utf-8') as output:
+            json.dump(document, output)
+        os.replace(path + '.tmp', path)
+
+    # ----- snapshots -----
+
+    def _put_chunk(self, data):
+        """Store a chunk unless present; returns (digest, bytes written)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        with open(path + '.tmp', 'wb') as chunk_file:
+            chunk_file.write(compressed)
+        os.replace(path + '.tmp', path)
+        return digest, len(compressed)
+
+    def ingest(self, source_dir, snapshot_id, backup_type, meta=None, progress=None):
+        """Chunk every file of a directory-format dump into a new snapshot"""
+        progress = progress or (lambda *args: None)
+        started = time.time()
+        files = {}
+        logical = new_bytes = chunk_count = new_chunks = 0
+        total = sum(os.path.getsize(os.path.join(source_dir, name)) for name in os.listdir(source_dir))
+
+        with self._locked():
+            for name in sorted(os.listdir(source_dir)):
+                chunks = []
+                for data in iter_chunks(os.path.join(source_dir, name)):
+                    digest, written = self._put_chunk(data)
+                    chunks.append([digest, len(data)])
+                    logical += len(data)
+                    new_bytes += written
+                    chunk_count += 1
+                    new_chunks += 1 if written else 0
+                    progress('store', logical, total, None)
+                files[name] = chunks
+
+            created = datetime.now()
+            summary = {
+                'id': snapshot_id,
+                'type': backup_type,
+                'created': created.isoformat(),
+                'size': logical,
+                'new_bytes': new_bytes,
+                'chunks': chunk_count,
+                'new_chunks': new_chunks,
+                'files': len(files),
+                'seconds': round(time.time() - started, 2),
+            }
+            summary.update(meta or {})
+            self._write_json(self._manifest_path(snapshot_id), dict(summary, file_chunks=files))
+            index = self._read_index()
+            index[snapshot_id] = summary
+            self._write_index(index)
+
+        print(f"✅ Snapshot {snapshot_id}: {logical / (1024 * 1024):.1f} MB logical, "
+              f"{new_bytes / (1024 * 1024):.2f} MB new ({new_chunks}/{chunk_count} chunks)")
+        return summary
+
+    def update_meta(self, snapshot_id, fields):
+        """Merge fields (e.g. a verification result) into a snapshot's manifest and index entry"""
+        with self._locked():
+            manifest = self.get_manifest(snapshot_id)
+            manifest.update(fields)
+            self._write_json(self._manifest_path(snapshot_id), manifest)
+            index = self._read_index()
+            if snapshot_id in index:
+                index[snapshot_id].update(fields)
+                self._write_index(index)
+
+    def list_snapshots(self):
+        """Snapshot summaries, newest first - reads only the index"""
+        return sorted(self._read_index().values(), key=lambda snapshot: snapshot['created'], reverse=True)
+
+    def get_manifest(self, snapshot_id):
+        with open(self._manifest_path(snapshot_id), encoding='utf-8') as manifest_file:
+            return json.load(manifest_file)
+
+    def exists(self, snapshot_id):
+        return snapshot_id in self._read_index()
+
+    def materialize(self, snapshot_id, destination):
+        """Rebuild the dump directory of a snapshot, checking every chunk's hash"""
+        manifest = self.get_manifest(snapshot_id)
+        os.makedirs(destination, exist_ok=True)
+        for name, chunks in manifest['file_chunks'].items():
+            if os.path.basename(name) != name:
+                raise ValueError(f"Unsafe file name in snapshot: {name}")
+            with open(os.path.join(destination, name), 'wb') as output:
+                for digest, length in chunks:
+                    output.write(self._read_chunk(digest, length))
+        return destination
+
+    def _read_chunk(self, digest, length):
+        with open(self._chunk_path(digest), 'rb') as chunk_file:
+            data = zlib.decompress(chunk_file.read())
+        if len(data) != length or hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} is corrupt")
+        return data
+
+    def stream_tar(self, snapshot_id):
+        """The archive export_tar writes, generated chunk by chunk without a copy on disk"""
+        manifest = self.get_manifest(snapshot_id)
+        mtime = time.time()
+        directory = tarfile.TarInfo('dump')
+        directory.type, directory.mode, directory.mtime = tarfile.DIRTYPE, 0o755, mtime
+        header = directory.tobuf(tarfile.DEFAULT_FORMAT)
+        written = len(header)
+        yield header
+        for name, chunks in manifest['file_chunks'].items():
+            if os.path.basename(name) != name:
+                raise ValueError(f"Unsafe file name in snapshot: {name}")
+            member = tarfile.TarInfo(f"dump/{name}")
+            member.size, member.mode, member.mtime = sum(length for _digest, length in chunks), 0o644, mtime
+            header = member.tobuf(tarfile.DEFAULT_FORMAT)
+            written += len(header)
+            yield header
+            for digest, length in chunks:
+                written += length
+                yield self._read_chunk(digest, length)
+            padding = -member.size % tarfile.BLOCKSIZE
+            written += padding
+            yield b'\0' * padding
+        # End-of-archive marker, padded to a full record like tarfile writes it
+        end = 2 * tarfile.BLOCKSIZE
+        yield b'\0' * (end + -(written + end) % tarfile.RECORDSIZE)
+
+    def export_tar(self, snapshot_id, tar_path):
+        """Single-file copy of a snapshot (a tarred directory-format dump, as .dir.tar backups)"""
+        staging = tar_path + '.staging'
+        try:
+            self.materialize(snapshot_id, staging)
+            with tarfile.open(tar_path + '.tmp', 'w') as archive:
+                archive.add(staging, arcname='dump')
+            os.replace(tar_path + '.tmp', tar_path)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return tar_path
+
+    def delete_snapshot(self, snapshot_id):
+        """Drop a snapshot; its chunks are reclaimed by the next sweep"""
+        with self._locked():
+            index = self._read_index()
+            index.pop(snapshot_id, None)
+            self._write_index(index)
+            if os.path.exists(self._manifest_path(snapshot_id)):
+                os.remove(self._manifest_path(snapshot_id))
+
+    # ----- retention and integrity -----
+
+    def prune(self, now=None, dry_run=False):
+        """Apply the GFS tiers, then sweep unreferenced chunks"""
+        with self._locked():
+            index = self._read_index()
+            items = [(snapshot_id, datetime.fromisoformat(summary['created']), summary.get('type'))
+                     for snapshot_id, summary in index.items()]
+            keep = retention_keep(items, now, self.tiers, self.manual_hours)
+            expired = [snapshot_id for snapshot_id in index if snapshot_id not in keep]
+            if dry_run:
+                return {'keep': keep, 'expired': expired}
+
+            for snapshot_id in expired:
+                index.pop(snapshot_id)
+                if os.path.exists(self._manifest_path(snapshot_id)):
+                    os.remove(self._manifest_path(snapshot_id))
+            self._write_index(index)
+            swept, freed = self._sweep(index)
+
+        if expired:
+            print(f"🗑️ Pruned {len(expired)} snapshots, {swept} chunks ({freed / (1024 * 1024):.1f} MB)")
+        return {'kept': len(keep), 'expired': expired, 'chunks_deleted': swept, 'bytes_freed': freed}
+
+    def _referenced(self, index):
+        referenced = set()
+        for snapshot_id in index:
+            for chunks in self.get_manifest(snapshot_id)['file_chunks'].values():
+                referenced.update(digest for digest, _length in chunks)
+        return referenced
+
+    def _sweep(self, index):
+        referenced = self._referenced(index)
+        swept = freed = 0
+        chunk_root = self._path('chunks')
+        if not os.path.isdir(chunk_root):
+            return swept, freed
+        for prefix in os.scandir(chunk_root):
+            for entry in os.scandir(prefix.path):
+                if entry.name not in referenced:
+                    freed += entry.stat().st_size
+                    os.remove(entry.path)
+                    swept += 1
+        return swept, freed
+
+    def verify(self, snapshot_id=None, full=False):
+        """
+        Check that every referenced chunk is present with a plausible size
+        (fast) or decompresses to its hash (full). Shared chunks are checked
+        once however many snapshots use them.
+        """
+        started = time.time()
+        index = self._read_index()
+        snapshot_ids = [snapshot_id] if snapshot_id else list(index)
+        users = {}
+        for current in snapshot_ids:
+            for chunks in self.get_manifest(current)['file_chunks'].values():
+                for digest, length in chunks:
+                    users.setdefault((digest, length), set()).add(current)
+
+        bad = {}
+        for (digest, length), snapshots in users.items():
+            path = self._chunk_path(digest)
+            try:
+                if full:
+                    with open(path, 'rb') as chunk_file:
+                        data = zlib.decompress(chunk_file.read())
+                    ok = len(data) == length and hashlib.sha256(data).hexdigest() == digest
+                else:
+                    ok = os.path.getsize(path) > 0
+            except (OSError, zlib.error):
+                ok = False
+            if not ok:
+                bad[digest] = sorted(snapshots)
+
+        damaged = sorted({snapshot for snapshots in bad.values() for snapshot in snapshots})
+        return {
+            'ok': not bad,
+            'mode': 'full' if full else 'fast',
+            'snapshots': len(snapshot_ids),
+            'chunks_checked': len(users),
+            'bad_chunks': bad,
+            'damaged_snapshots': damaged,
+            'seconds': round(time.time() - started, 2),
+        }
+
+    def stats(self):
+        snapshots = self.list_snapshots()
+        logical = sum(snapshot['size'] for snapshot in snapshots)
+        stored = 0
+        chunk_root = self._path('chunks')
+        if os.path.isdir(chunk_root):
+            for prefix in os.scandir(chunk_root):
+                stored += sum(entry.stat().st_size for entry in os.scandir(prefix.path))
+        return {
+            'snapshots': len(snapshots),
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'dedupe_ratio': round(logical / stored, 1) if stored else None,
+            'retention': {name: count for name, _period, count in self.tiers},
+        }
+
+# Global backup store instance
+backup_store = BackupStore()
@@ -0,0 +1,681 @@
+"""
+Off-site Backup Uploads for Hexashop
+Streams a backup in parts to each configured target (Telegram, S3-compatible
+storage, a local object directory), concurrently, with retries, resumable
+after an interruption and checksum-verified once uploaded
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import random
+import secrets
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from urllib.parse import quote, urlparse
+
+import requests
+
+from backup_catalog import EXPORT_SUFFIX
+
+DEFAULT_STATE_DIR = 'backups/uploads'
+READ_SIZE = 1024 * 1024         # Source read size; compressed output is cut into parts
+UPLOAD_RETRIES = 5              # Attempts per part before the upload is left for resume
+BACKOFF_BASE = 2.0              # Seconds; doubled per attempt, with jitter
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 120           # Seconds per HTTP request (one part)
+S3_NAMESPACE = '{http://s3.amazonaws.com/doc/2006-03-01/}'
+
+
+class UploadError(Exception):
+    """A part or request failed; `retry_after` is set when the target asked to slow down"""
+
+    def __init__(self, message, retry_after=None, retryable=True):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+
+def iter_parts(path, part_size, compress=False):
+    """
+    Yield (number, bytes) parts of `path`, numbered from 1. With `compress`
+    the file is streamed through gzip (mtime 0, so the output is the same
+    on every run and a resumed upload can skip parts it already sent).
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    buffer = bytearray()
+    number = 1
+    with open(path, 'rb') as source:
+        while True:
+            block = source.read(READ_SIZE)
+            if not block:
+                break
+            buffer += compressor.compress(block) if compressor else block
+            while len(buffer) >= part_size:
+                yield number, bytes(buffer[:part_size])
+                del buffer[:part_size]
+                number += 1
+    if compressor:
+        buffer += compressor.flush()
+    if buffer or number == 1:
+        yield number, bytes(buffer)
+
+
+def _s3_etag(md5_digests):
+    """ETag S3 gives a multipart object: md5 of the concatenated part md5s, '-' part count"""
+    return f"{hashlib.md5(b''.join(md5_digests)).hexdigest()}-{len(md5_digests)}"
+
+
+# ----- targets -----
+
+class UploadTarget:
+    """
+    One off-site destination. The pipeline calls begin() once per upload,
+    put_part() for every part not already stored (concurrently, up to
+    `max_workers`), then complete() and verify(). `state` is the JSON
+    document persisted between runs; targets keep their upload ids in it.
+    """
+    name = None
+    part_size = 16 * 1024 * 1024
+    max_workers = 4
+
+    def configured(self):
+        return True
+
+    def begin(self, state):
+        pass
+
+    def remote_parts(self, state):
+        """{part number: etag/ref} the destination already holds, or None to trust `state`"""
+        return None
+
+    def put_part(self, state, number, data, digests):
+        """Store one part; return the dict recorded for it in state['parts']"""
+        raise NotImplementedError
+
+    def complete(self, state, manifest):
+        raise NotImplementedError
+
+    def verify(self, state, manifest):
+        """Raise UploadError unless the stored object matches `manifest`"""
+        raise NotImplementedError
+
+    def abort(self, state):
+        pass
+
+
+class TelegramTarget(UploadTarget):
+    """
+    The admin chat: every part is one document (the Bot API caps uploads at
+    50 MB and downloads at 20 MB, so parts stay under 20 MB and each one is
+    downloaded again and hashed). Multi-part backups end with a manifest
+    document listing the parts and their sha256.
+    """
+    name = 'telegram'
+    part_size = 19 * 1024 * 1024
+    max_workers = 2             # Bot API rate limits are per chat
+
+    def __init__(self):
+        self.token = os.environ.get('TELEGRAM_BOT_TOKEN')
+        self.chat_id = os.environ.get('TELEGRAM_CHAT_ID')
+        self.api = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+        self.part_size = min(int(os.environ.get('TELEGRAM_PART_MB', 19)), 49) * 1024 * 1024
+
+    def configured(self):
+        return bool(self.token and self.chat_id)
+
+    def _call(self, method, **kwargs):
+        try:
+            response = requests.post(f"{self.api}/bot{self.token}/{method}", timeout=REQUEST_TIMEOUT, **kwargs)
+        except requests.exceptions.RequestException as e:
+            raise UploadError(f"Telegram connection error: {e}")
+        try:
+            payload = response.json()
+        except ValueError:
+            raise UploadError(f"Telegram HTTP {response.status_code}")
+        if not payload.get('ok'):
+            retry_after = (payload.get('parameters') or {}).get('retry_after')
+            raise UploadError(f"Telegram API error: {payload.get('description')}", retry_after=retry_after,
+                              retryable=response.status_code == 429 or response.status_code >= 500)
+        return payload['result']
+
+    def _caption(self, state, number=None):
+        size_mb = state['source_size'] / (1024 * 1024)
+        caption = (
+            f"🔐 Hexashop Database Backup\n"
+            f"📅 {state['started_at'][:19].replace('T', ' ')}\n"
+            f"📁 Type: {state['backup_type']}\n"
+            f"📊 Size: {size_mb:.2f} MB"
+        )
+        if number is not None:
+            caption += f"\n🧩 Part {number}"
+        return caption
+
+    def put_part(self, state, number, data, digests):
+        single = state.get('single_part')
+        name = os.path.basename(state['object_key'])
+        filename = name if single else f"{name}.part{number:03d}"
+        document = self._call(
+            'sendDocument',
+            data={'chat_id': self.chat_id, 'caption': self._caption(state, None if single else number)},
+            files={'document': (filename, data)},
+        )['document']
+        if document.get('file_size') not in (None, len(data)):
+            raise UploadError(f"Telegram stored {document.get('file_size')} bytes for part {number}, sent {len(data)}")
+        if len(data) <= 20 * 1024 * 1024:
+            # Read it back: the Bot API only serves files up to 20 MB
+            file_path = self._call('getFile', data={'file_id': document['file_id']})['file_path']
+            try:
+                stored = requests.get(f"{self.api}/file/bot{self.token}/{file_path}", timeout=REQUEST_TIMEOUT)
+                stored.raise_for_status()
+            except requests.exceptions.RequestException as e:
+                raise UploadError(f"Telegram download error: {e}")
+            if hashlib.sha256(stored.content).hexdigest() != digests['sha256']:
+                raise UploadError(f"Telegram part {number} checksum mismatch")
+        return {'file_id': document['file_id'], 'verified': len(data) <= 20 * 1024 * 1024}
+
+    def complete(self, state, manifest):
+        if len(manifest['parts']) > 1:
+            body = json.dumps(manifest, indent=2).encode()
+            self._call(
+                'sendDocument',
+                data={'chat_id': self.chat_id, 'caption': f"🧾 {state['object_key']}: {len(manifest['parts'])} parts, "
+                                                           f"sha256 {manifest['sha256'][:16]}…"},
+                files={'document': (f"{os.path.basename(state['object_key'])}.manifest.json", body)},
+            )
+        return {'parts': len(manifest['parts'])}
+
+    def verify(self, state, manifest):
+        # Each part was hashed on the way in; only size is checked for parts over 20 MB
+        missing = [part['number'] for part in manifest['parts'] if str(part['number']) not in state['parts']]
+        if missing:
+            raise UploadError(f"Telegram parts missing: {missing}", retryable=False)
+
+
+class S3Target(UploadTarget):
+    """
+    S3-compatible object storage (AWS, MinIO, R2, ...) through multipart
+    uploads signed with SigV4. Parts carry Content-MD5 so the server rejects
+    corrupted parts; the finished object's ETag and size are checked against
+    the part digests, and a .manifest.json object records the sha256.
+    """
+    name = 's3'
+    part_size = 16 * 1024 * 1024        # S3 minimum is 5 MB (except the last), maximum 10,000 parts
+    max_workers = 4
+
+    def __init__(self):
+        self.endpoint = (os.environ.get('S3_ENDPOINT') or '').rstrip('/')
+        self.bucket = os.environ.get('S3_BUCKET')
+        self.access_key = os.environ.get('S3_ACCESS_KEY')
+        self.secret_key = os.environ.get('S3_SECRET_KEY')
+        self.region = os.environ.get('S3_REGION', 'us-east-1')
+        self.part_size = max(5, int(os.environ.get('S3_PART_MB', 16))) * 1024 * 1024
+        self.max_workers = int(os.environ.get('S3_UPLOAD_WORKERS', self.max_workers))
+
+    def configured(self):
+        return bool(self.endpoint and self.bucket and self.access_key and self.secret_key)
+
+    def sign(self, method, key, query, headers, payload_hash, now=None):
+        """SigV4 headers for a path-style request (returns headers and the canonical query string)"""
+        now = now or datetime.utcnow()
+        amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+        date = now.strftime('%Y%m%d')
+        headers = {name.lower(): str(value).strip() for name, value in headers.items()}
+        headers.update({'host': urlparse(self.endpoint).netloc, 'x-amz-date': amz_date,
+                        'x-amz-content-sha256': payload_hash})
+        canonical_uri = quote(f"/{self.bucket}/{key}" if key is not None else f"/{self.bucket}", safe='/-_.~')
+        canonical_query = '&'.join(f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+                                   for name, value in sorted(query.items()))
+        signed_headers = ';'.join(sorted(headers))
+        canonical_request = '\n'.join([
+            method, canonical_uri, canonical_query,
+            ''.join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed_headers, payload_hash,
+        ])
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical_request.encode()).hexdigest()])
+        signing_key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, 's3', 'aws4_request'):
+            signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={signed_headers}, Signature={signature}")
+        del headers['host']     # requests sets it from the URL
+        return headers, f"{self.endpoint}{canonical_uri}" + (f"?{canonical_query}" if canonical_query else "")
+
+    def _request(self, method, key, query=None, body=b'', headers=None, ok=(200,)):
+        payload_hash = hashlib.sha256(body).hexdigest()
+        signed, url = self.sign(method, key, query or {}, headers or {}, payload_hash)
+        try:
+            response = requests.request(method, url, data=body, headers=signed, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            raise UploadError(f"S3 connection error: {e}")
+        if response.status_code not in ok:
+            retry_after = response.headers.get('Retry-After')
+            raise UploadError(f"S3 {method} {key}: HTTP {response.status_code} {response.text[:200]}",
+                              retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+                              retryable=response.status_code in (408, 429) or response.status_code >= 500)
+        return response
+
+    def begin(self, state):
+        if state.get('upload_id'):
+            return
+        response = self._request('POST', state['object_key'], {'uploads': ''},
+                                 headers={'content-type': 'application/octet-stream'})
+        state['upload_id'] = ElementTree.fromstring(response.content).findtext(f'{S3_NAMESPACE}UploadId')
+
+    def remote_parts(self, state):
+        parts, marker = {}, None
+        while True:
+            query = {'uploadId': state['upload_id']}
+            if marker:
+                query['part-number-marker'] = marker
+            try:
+                response = self._request('GET', state['object_key'], query)
+            except UploadError as e:
+                if not e.retryable:
+                    # Upload expired or aborted server-side: start a new one
+                    state.pop('upload_id', None)
+                    state['parts'] = {}
+                    self.begin(state)
+                    return {}
+                raise
+            root = ElementTree.fromstring(response.content)
+            for part in root.iter(f'{S3_NAMESPACE}Part'):
+                parts[int(part.findtext(f'{S3_NAMESPACE}PartNumber'))] = part.findtext(f'{S3_NAMESPACE}ETag').strip('"')
+            if root.findtext(f'{S3_NAMESPACE}IsTruncated') != 'true':
+                return parts
+            marker = root.findtext(f'{S3_NAMESPACE}NextPartNumberMarker')
+
+    def put_part(self, state, number, data, digests):
+        response = self._request(
+            'PUT', state['object_key'], {'partNumber': number, 'uploadId': state['upload_id']}, body=data,
+            headers={'content-md5': base64.b64encode(bytes.fromhex(digests['md5'])).decode()},
+        )
+        etag = response.headers.get('ETag', '').strip('"')
+        if etag and etag != digests['md5']:
+            raise UploadError(f"S3 part {number} ETag {etag} != md5 {digests['md5']}")
+        return {'etag': etag or digests['md5']}
+
+    def complete(self, state, manifest):
+        body = ''.join(
+            f"<Part><PartNumber>{part['number']}</PartNumber><ETag>\"{state['parts'][str(part['number'])]['etag']}\"</ETag></Part>"
+            for part in manifest['parts']
+        )
+        response = self._request('POST', state['object_key'], {'uploadId': state['upload_id']},
+                                 body=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode())
+        # Errors after the 200 status line come back in the body
+        root = ElementTree.fromstring(response.content)
+        if root.tag in ('Error', f'{S3_NAMESPACE}Error'):
+            raise UploadError(f"S3 complete failed: {root.findtext('Message') or root.findtext(f'{S3_NAMESPACE}Message')}")
+        self._request('PUT', state['object_key'] + '.manifest.json', body=json.dumps(manifest, indent=2).encode(),
+                      headers={'content-type': 'application/json'})
+        return {'etag': _s3_etag([bytes.fromhex(part['md5']) for part in manifest['parts']])}
+
+    def verify(self, state, manifest):
+        response = self._request('HEAD', state['object_key'])
+        size = int(response.headers.get('Content-Length', -1))
+        etag = response.headers.get('ETag', '').strip('"')
+        expected = _s3_etag([bytes.fromhex(part['md5']) for part in manifest['parts']])
+        if size != manifest['size']:
+            raise UploadError(f"S3 object is {size} bytes, uploaded {manifest['size']}", retryable=False)
+        if etag != expected and '-' in etag:
+            raise UploadError(f"S3 object ETag {etag} != {expected}", retryable=False)
+
+    def abort(self, state):
+        if state.get('upload_id'):
+            try:
+                self._request('DELETE', state['object_key'], {'uploadId': state['upload_id']}, ok=(200, 204, 404))
+            except UploadError as e:
+                print(f"⚠️ Could not abort S3 upload {state['upload_id']}: {e}")
+
+
+class LocalTarget(UploadTarget):
+    """
+    MinIO-style stand-in: a directory holding objects, with the same
+    multipart semantics as S3 (parts under .uploads/<id>/, assembled on
+    complete). Used for tests and for a second disk or network mount.
+    """
+    name = 'local'
+    part_size = 8 * 1024 * 1024
+
+    def __init__(self, root=None):
+        self.root = root or os.environ.get('BACKUP_UPLOAD_LOCAL_DIR')
+        self.part_size = max(1, int(os.environ.get('BACKUP_UPLOAD_LOCAL_PART_MB', 8))) * 1024 * 1024
+
+    def configured(self):
+        return bool(self.root)
+
+    def _upload_dir(self, state):
+        return os.path.join(self.root, '.uploads', state['upload_id'])
+
+    def begin(self, state):
+        if not state.get('upload_id'):
+            state['upload_id'] = secrets.token_hex(12)
+        os.makedirs(self._upload_dir(state), exist_ok=True)
+
+    def remote_parts(self, state):
+        parts = {}
+        for filename in os.listdir(self._upload_dir(state)):
+            if filename.endswith('.part'):
+                with open(os.path.join(self._upload_dir(state), filename), 'rb') as part:
+                    parts[int(filename[:-5])] = hashlib.md5(part.read()).hexdigest()
+        return parts
+
+    def put_part(self, state, number, data, digests):
+        path = os.path.join(self._upload_dir(state), f"{number:05d}.part")
+        with open(path + '.tmp', 'wb') as part:
+            part.write(data)
+        os.replace(path + '.tmp', path)
+        return {'etag': digests['md5']}
+
+    def complete(self, state, manifest):
+        target = os.path.join(self.root, state['object_key'])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target + '.tmp', 'wb') as output:
+            for part in manifest['parts']:
+                with open(os.path.join(self._upload_dir(state), f"{part['number']:05d}.part"), 'rb') as source:
+                    output.write(source.read())
+        os.replace(target + '.tmp', target)
+        with open(target + '.manifest.json', 'w', encoding='utf-8') as output:
+            json.dump(manifest, output, indent=2)
+        self.abort(state)
+        return {'path': target}
+
+    def verify(self, state, manifest):
+        digest = hashlib.sha256()
+        with open(os.path.join(self.root, state['object_key']), 'rb') as stored:
+            for block in iter(lambda: stored.read(READ_SIZE), b''):
+                digest.update(block)
+        if digest.hexdigest() != manifest['sha256']:
+            raise UploadError(f"Local copy checksum mismatch for {state['object_key']}", retryable=False)
+
+    def abort(self, state):
+        if state.get('upload_id'):
+            upload_dir = self._upload_dir(state)
+            for filename in os.listdir(upload_dir) if os.path.isdir(upload_dir) else []:
+                os.remove(os.path.join(upload_dir, filename))
+            if os.path.isdir(upload_dir):
+                os.rmdir(upload_dir)
+
+
+# BACKUP_UPLOAD_TARGETS names -> target classes; register_target() adds more
+TARGET_CLASSES = {
+    'telegram': TelegramTarget,
+    's3': S3Target,
+    'local': LocalTarget,
+}
+
+
+def register_target(name, target_class):
+    TARGET_CLASSES[name] = target_class
+
+
+# ----- pipeline -----
+
+class BackupUploader:
+    """
+    Uploads each new backup to every configured target. Progress per target
+    is saved to backups/uploads/<object>.<target>.json after every part, so
+    an interrupted upload (crash, deploy, network outage) resumes where it
+    stopped: parts are regenerated deterministically and only those the
+    destination does not already hold are sent.
+    """
+
+    def __init__(self, app=None, manager=None):
+        self.app = app
+        self.manager = manager
+        self.targets = []
+        self.state_dir = DEFAULT_STATE_DIR
+        self.prefix = ''
+        self.compress = True
+        self._state_lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app, manager)
+
+    def init_app(self, app, manager):
+        self.app = app
+        self.manager = manager
+        self.state_dir = os.environ.get('BACKUP_UPLOAD_STATE_DIR', DEFAULT_STATE_DIR)
+        self.prefix = os.environ.get('BACKUP_UPLOAD_PREFIX', 'hexashop/')
+        # Plain SQL is gzipped on the way out; custom/directory dumps are already compressed
+        self.compress = os.environ.get('BACKUP_UPLOAD_COMPRESS', 'gzip').lower() != 'none'
+        names = os.environ.get('BACKUP_UPLOAD_TARGETS', 'telegram,s3,local')
+        self.targets = []
+        for name in (name.strip() for name in names.split(',') if name.strip()):
+            if name not in TARGET_CLASSES:
+                print(f"⚠️ Unknown upload target '{name}'")
+                continue
+            target = TARGET_CLASSES[name]()
+            if target.configured():
+                self.targets.append(target)
+        os.makedirs(self.state_dir, exist_ok=True)
+        manager.uploader = self
+        app.backup_uploader = self
+
+    def enabled(self):
+        return bool(self.targets)
+
+    # ----- state -----
+
+    def _state_path(self, object_key, target_name):
+        return os.path.join(self.state_dir, f"{object_key.replace('/', '_')}.{target_name}.json")
+
+    def _load_state(self, path):
+        try:
+            with open(path, encoding='utf-8') as state_file:
+                return json.load(state_file)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, state):
+        path = self._state_path(state['object_key'], state['target'])
+        with self._state_lock:
+            with open(path + '.tmp', 'w', encoding='utf-8') as state_file:
+                json.dump(state, state_file, indent=2)
+            os.replace(path + '.tmp', path)
+
+    def _record(self, source, target, status):
+        """Mirror a target's status into the backup catalog; never fails the upload"""
+        if self.manager is None or self.manager.catalog is None:
+            return
+        try:
+            self.manager.record_upload(source, target.name, status)
+        except Exception as e:
+            print(f"⚠️ Could not record upload status in the catalog: {e}")
+
+    def forget(self, source):
+        """Drop the upload states of a deleted backup, aborting uploads it never finished"""
+        targets = {target.name: target for target in self.targets}
+        source = os.path.abspath(source)
+        for filename in os.listdir(self.state_dir) if os.path.isdir(self.state_dir) else []:
+            path = os.path.join(self.state_dir, filename)
+            state = self._load_state(path) if filename.endswith('.json') else None
+            if state is None or os.path.abspath(state['source']) != source:
+                continue
+            if state['status'] != 'complete' and state['target'] in targets:
+                try:
+                    targets[state['target']].abort(state)
+                except Exception as e:
+                    print(f"⚠️ Could not abort upload of {state['object_key']} to {state['target']}: {e}")
+            os.remove(path)
+
+    def list_uploads(self):
+        states = []
+        for filename in sorted(os.listdir(self.state_dir)) if os.path.isdir(self.state_dir) else []:
+            if filename.endswith('.json'):
+                state = self._load_state(os.path.join(self.state_dir, filename))
+                if state:
+                    states.append({key: value for key, value in state.items() if key != 'parts'}
+                                  | {'parts_done': len(state.get('parts', {}))})
+        return sorted(states, key=lambda state: state['started_at'], reverse=True)
+
+    def pending(self):
+        return [state for state in self.list_uploads() if state['status'] != 'complete']
+
+    # ----- upload -----
+
+    def upload(self, source, backup_type, progress=None, object_name=None):
+        """Upload `source` to every target; returns {target: 'complete' | 'failed: ...'}"""
+        results = {}
+        compress = self.compress and source.endswith('.sql')
+        object_key = self.prefix + (object_name or os.path.basename(source)) + ('.gz' if compress else '')
+        for target in self.targets:
+            try:
+                self._upload_to(target, source, object_key, backup_type, compress, progress)
+                results[target.name] = 'complete'
+            except Exception as e:
+                print(f"❌ Upload of {os.path.basename(source)} to {target.name} failed: {e}")
+                results[target.name] = f"failed: {e}"
+        return results
+
+    def resume_pending(self, progress=None):
+        """Finish uploads an earlier run left incomplete"""
+        results = {}
+        targets = {target.name: target for target in self.targets}
+        for summary in self.pending():
+            state = self._load_state(self._state_path(summary['object_key'], summary['target']))
+            target = targets.get(summary['target'])
+            if state is None or target is None:
+                continue
+            if not os.path.exists(state['source']):
+                print(f"⚠️ Dropping upload of {state['object_key']} to {target.name}: source is gone")
+                target.abort(state)
+                os.remove(self._state_path(state['object_key'], target.name))
+                continue
+            try:
+                self._upload_to(target, state['source'], state['object_key'], state['backup_type'],
+                                state['compress'], progress)
+                results[f"{state['object_key']}@{target.name}"] = 'complete'
+            except Exception as e:
+                results[f"{state['object_key']}@{target.name}"] = f"failed: {e}"
+
+        # A snapshot's export exists only to be uploaded: drop it once no target still needs it
+        waiting = {state['source'] for state in self.pending()}
+        for source in {summary['source'] for summary in self.list_uploads()}:
+            if source.endswith(EXPORT_SUFFIX) and source not in waiting and os.path.exists(source):
+                os.remove(source)
+                print(f"🗑️ Removed {os.path.basename(source)}: every upload target has it")
+        return results
+
+    def _upload_to(self, target, source, object_key, backup_type, compress, progress=None):
+        progress = progress or (lambda *args, **kwargs: None)
+        stats = os.stat(source)
+        state = self._load_state(self._state_path(object_key, target.name))
+        fingerprint = {'source_size': stats.st_size, 'source_mtime': int(stats.st_mtime),
+                       'part_size': target.part_size, 'compress': compress}
+        if state and state['status'] == 'complete' and all(state.get(key) == value for key, value in fingerprint.items()):
+            return state
+        if state and any(state.get(key) != value for key, value in fingerprint.items()):
+            # The file or the part size changed since: the stored parts are useless
+            target.abort(state)
+            state = None
+        if state is None:
+            state = {
+                'target': target.name,
+                'object_key': object_key,
+                'source': source,
+                'backup_type': backup_type,
+                'status': 'uploading',
+                'started_at': datetime.utcnow().isoformat(),
+                'attempts': 0,
+                'parts': {},
+                'single_part': stats.st_size <= target.part_size and not compress,
+                **fingerprint,
+            }
+        state['attempts'] += 1
+        state['status'] = 'uploading'
+        state['error'] = None
+        target.begin(state)
+        self._save_state(state)
+        self._record(source, target, 'uploading')
+
+        remote = target.remote_parts(state)
+        if remote is not None:
+            # Keep only parts the destination really holds
+            state['parts'] = {number: part for number, part in state['parts'].items()
+                              if remote.get(int(number)) == part.get('etag', part.get('md5'))}
+        started = time.time()
+        done_bytes = [0]
+        total_digest = hashlib.sha256()
+        manifest_parts = []
+        resumed = f" (resuming, {len(state['parts'])} parts already there)" if state['parts'] else ""
+        print(f"☁️ Uploading {object_key} to {target.name}{resumed}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=target.max_workers) as pool:
+                in_flight = set()
+                for number, data in iter_parts(source, target.part_size, compress):
+                    digests = {'sha256': hashlib.sha256(data).hexdigest(), 'md5': hashlib.md5(data).hexdigest()}
+                    total_digest.update(data)
+                    manifest_parts.append({'number': number, 'size': len(data), **digests})
+                    recorded = state['parts'].get(str(number))
+                    if recorded and recorded['sha256'] == digests['sha256']:
+                        done_bytes[0] += len(data)
+                        continue
+                    # Bound memory: at most max_workers parts queued behind the running ones
+                    while len(in_flight) >= target.max_workers * 2:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            future.result()
+                    in_flight.add(pool.submit(self._put_part, target, state, number, data, digests,
+                                              done_bytes, stats.st_size, progress))
+                for future in wait(in_flight).done:
+                    future.result()
+
+            manifest = {
+                'object_key': object_key,
+                'source': os.path.basename(source),
+                'backup_type': backup_type,
+                'compression': 'gzip' if compress else None,
+                'size': sum(part['size'] for part in manifest_parts),
+                'sha256': total_digest.hexdigest(),
+                'parts': manifest_parts,
+                'created_at': datetime.utcnow().isoformat(),
+            }
+            progress('upload', done_bytes[0], stats.st_size, f"Completing upload to {target.name}")
+            state['result'] = target.complete(state, manifest)
+            target.verify(state, manifest)
+        except Exception as e:
+            state['status'] = 'failed'
+            state['error'] = str(e)
+            self._save_state(state)
+            self._record(source, target, f"failed: {e}")
+            raise
+
+        state.update(status='complete', finished_at=datetime.utcnow().isoformat(),
+                     sha256=manifest['sha256'], size=manifest['size'])
+        self._save_state(state)
+        self._record(source, target, 'complete')
+        seconds = time.time() - started
+        print(f"✅ Uploaded {object_key} to {target.name}: {manifest['size'] / (1024 * 1024):.2f} MB "
+              f"in {len(manifest_parts)} parts, {seconds:.1f}s, sha256 verified")
+        progress('upload', stats.st_size, stats.st_size, f"Uploaded to {target.name}")
+        return state
+
+    def _put_part(self, target, state, number, data, digests, done_bytes, total, progress):
+        for attempt in range(1, UPLOAD_RETRIES + 1):
+            try:
+                part = target.put_part(state, number, data, digests)
+                break
+            except UploadError as e:
+                if not e.retryable or attempt == UPLOAD_RETRIES:
+                    raise
+                delay = e.retry_after or min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+                print(f"⚠️ {target.name} part {number} attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        with self._state_lock:
+            state['parts'][str(number)] = {**part, 'size': len(data), **digests}
+            done_bytes[0] += len(data)
+        self._save_state(state)
+        progress('upload', min(done_bytes[0], total), total)
+
+# Global backup uploader instance
+backup_uploader = BackupUploader()
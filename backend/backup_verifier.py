@@ -0,0 +1,254 @@
+"""
+Backup Verification for Hexashop
+Restores a backup into a scratch database and compares per-table row counts
+and checksums with fingerprints taken in the same snapshot as the dump
+"""
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse, urlunparse
+
+import psycopg2
+from psycopg2 import sql
+
+from metrics import metrics_registry
+
+VERIFY_TABLES = ('product', 'order', 'order_item', 'promo_code')
+SCRATCH_PREFIX = 'hexashop_verify_'
+DEFAULT_VERIFY_TIME = '03:30'   # Off-peak, after the 02:00/02:30 daily jobs
+
+# Heap + TOAST bytes of the user tables (no indexes): what a dump holds,
+# read from the catalog in the dump's snapshot, so it costs nothing
+TABLE_BYTES_SQL = """
+    SELECT coalesce(sum(pg_table_size(c.oid)), 0)::bigint
+    FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'm') AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+      AND n.nspname NOT LIKE 'pg_toast%%'
+"""
+
+# Row count and an order-independent checksum: the sum of the first 64 bits
+# of every row's md5. Same rows in any physical order give the same value.
+FINGERPRINT_SQL = sql.SQL(
+    "SELECT count(*), coalesce(sum(('x' || substr(md5(t::text), 1, 16))::bit(64)::bigint), 0)::text FROM {} t"
+)
+
+
+def fingerprint_tables(cursor, tables=VERIFY_TABLES):
+    """{table: {'rows': n, 'checksum': str}} for the tables present in this database"""
+    cursor.execute("SELECT tablename FROM pg_tables WHERE schemaname = 'public'")
+    present = {row[0] for row in cursor.fetchall()}
+    fingerprints = {}
+    for table in tables:
+        if table not in present:
+            continue
+        cursor.execute(FINGERPRINT_SQL.format(sql.Identifier(table)))
+        rows, checksum = cursor.fetchone()
+        fingerprints[table] = {'rows': rows, 'checksum': checksum}
+    return fingerprints
+
+
+def compare_fingerprints(expected, restored, tables):
+    """
+    Compare restored fingerprints with the dump-time ones: ({table: entry},
+    mismatched tables, status). Without dump-time fingerprints (older backups)
+    only "it restores" is proven and the status is 'restored'.
+    """
+    entries, mismatches = {}, []
+    for table in tables:
+        got = restored.get(table)
+        want = (expected or {}).get(table)
+        entry = {'rows': got['rows'] if got else None}
+        if want is not None:
+            entry['expected_rows'] = want['rows']
+            entry['checksum_match'] = bool(got) and got['checksum'] == want['checksum']
+            if not got or got['rows'] != want['rows'] or not entry['checksum_match']:
+                mismatches.append(table)
+        elif got is None:
+            mismatches.append(table)
+        entries[table] = entry
+    status = 'failed' if mismatches else ('passed' if expected else 'restored')
+    return entries, mismatches, status
+
+
+class SourceSnapshot:
+    """
+    A REPEATABLE READ transaction whose snapshot is exported to pg_dump
+    (--snapshot), so the fingerprints taken here describe exactly the rows
+    in the dump. Fingerprinting runs in a thread alongside pg_dump.
+    """
+
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.name = name
+        self.fingerprints = None
+        self.table_bytes = None
+        self.error = None
+        self._thread = None
+
+    def start_fingerprints(self):
+        def run():
+            try:
+                with self.connection.cursor() as cursor:
+                    cursor.execute(TABLE_BYTES_SQL)
+                    self.table_bytes = cursor.fetchone()[0]
+                    self.fingerprints = fingerprint_tables(cursor)
+            except Exception as e:
+                self.error = str(e)
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        if self._thread is not None:
+            self._thread.join()
+        if self.error:
+            print(f"⚠️ Could not fingerprint source tables: {self.error}")
+        return self.fingerprints
+
+
+@contextmanager
+def source_snapshot(database_url):
+    """Yield a SourceSnapshot, or None when the server cannot export one"""
+    try:
+        connection = psycopg2.connect(database_url)
+        connection.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_export_snapshot()")
+            name = cursor.fetchone()[0]
+    except Exception as e:
+        print(f"⚠️ Could not export a snapshot, dumping without fingerprints: {e}")
+        yield None
+        return
+    try:
+        yield SourceSnapshot(connection, name)
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+class BackupVerifier:
+    """
+    Restore-tests backups. Each run creates a scratch database on
+    VERIFY_DATABASE_URL (default: the application's server), restores the
+    backup into it with pg_restore -j VERIFY_JOBS (psql for .sql), fingerprints
+    the restored tables in parallel, compares them with the fingerprints
+    recorded at dump time and drops the scratch database. The result is
+    stored in the backup's metadata and shows up in list_backups().
+
+    Runs go through the backup job queue, so they never overlap a dump or a
+    restore; point VERIFY_DATABASE_URL at a separate server to keep the
+    restore load off production entirely.
+    """
+
+    def __init__(self, app=None, manager=None):
+        self.app = app
+        self.manager = manager
+        self.enabled = True
+        self.server_url = None
+        self.jobs = 2
+        self.verify_time = DEFAULT_VERIFY_TIME
+
+        if app is not None:
+            self.init_app(app, manager)
+
+    def init_app(self, app, manager):
+        self.app = app
+        self.manager = manager
+        self.enabled = os.environ.get('BACKUP_VERIFY', 'on').lower() not in ('off', '0', 'false')
+        self.server_url = os.environ.get('VERIFY_DATABASE_URL')
+        self.jobs = max(1, int(os.environ.get('VERIFY_JOBS', self.jobs)))
+        self.verify_time = os.environ.get('VERIFY_TIME', DEFAULT_VERIFY_TIME)
+        manager.verifier = self
+        app.backup_verifier = self
+
+    def _scratch_urls(self, name):
+        """(maintenance database URL, scratch database URL) on the verification server"""
+        parsed = urlparse(self.server_url or self.manager.get_database_url())
+        return urlunparse(parsed._replace(path='/postgres')), urlunparse(parsed._replace(path=f'/{name}'))
+
+    def _admin(self, admin_url, statement):
+        connection = psycopg2.connect(admin_url)
+        try:
+            connection.autocommit = True     # CREATE/DROP DATABASE cannot run in a transaction
+            with connection.cursor() as cursor:
+                cursor.execute(statement)
+        finally:
+            connection.close()
+
+    def _fingerprint_parallel(self, database_url, tables):
+        def one(table):
+            with psycopg2.connect(database_url) as connection:
+                with connection.cursor() as cursor:
+                    return fingerprint_tables(cursor, (table,))
+        fingerprints = {}
+        with ThreadPoolExecutor(max_workers=min(len(tables), self.jobs * 2) or 1) as pool:
+            for result in pool.map(one, tables):
+                fingerprints.update(result)
+        return fingerprints
+
+    def check_restored(self, database_url, filename):
+        """Fingerprint a database restored from `filename` against its dump-time fingerprints"""
+        expected = self.manager.backup_meta(filename).get('fingerprints')
+        tables = list(expected) if expected else list(VERIFY_TABLES)
+        return compare_fingerprints(expected, self._fingerprint_parallel(database_url, tables), tables)
+
+    def latest_backup(self):
+        backups = self.manager.list_backups(limit=1)
+        return backups[0]['filename'] if backups else None
+
+    def verify_backup(self, filename=None, progress=None):
+        """Restore `filename` (default: the newest backup) into a scratch database and compare"""
+        progress = progress or (lambda *args, **kwargs: None)
+        filename = filename or self.latest_backup()
+        if filename is None:
+            return {"success": False, "error": "No backup to verify"}
+        if not self.manager.backup_exists(filename):
+            return {"success": False, "error": "Backup file not found"}
+
+        backup_file = os.path.join(self.manager.backup_dir, filename)
+        scratch = f"{SCRATCH_PREFIX}{datetime.now().strftime('%Y%m%d%H%M%S')}_{secrets.token_hex(2)}"
+        admin_url, scratch_url = self._scratch_urls(scratch)
+        started = time.time()
+        record = {'verified_at': datetime.utcnow().isoformat(), 'scratch_database': scratch}
+
+        try:
+            progress('verify', None, None, f"Creating scratch database {scratch}")
+            self._admin(admin_url, sql.SQL("CREATE DATABASE {}").format(sql.Identifier(scratch)))
+            try:
+                result = self.manager.restore_into(scratch_url, backup_file, progress, jobs=self.jobs, strict=True)
+                record['restore_seconds'] = round(time.time() - started, 2)
+                if result.returncode != 0:
+                    raise RuntimeError(f"Restore into scratch database failed: {result.stderr[-2000:]}")
+
+                progress('verify', None, None, "Comparing row counts and checksums")
+                checksum_started = time.time()
+                record['tables'], record['mismatches'], record['status'] = self.check_restored(scratch_url, filename)
+                record['checksum_seconds'] = round(time.time() - checksum_started, 2)
+            finally:
+                self._admin(admin_url, sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(scratch)))
+        except Exception as e:
+            record['status'] = 'error'
+            record['error'] = str(e)
+
+        record['total_seconds'] = round(time.time() - started, 2)
+        self.manager.update_meta(filename, {'verification': record})
+        metrics_registry.observe('hexashop_backup_verify_duration_seconds', record['total_seconds'], status=record['status'])
+
+        if record['status'] in ('passed', 'restored'):
+            print(f"✅ Backup verified ({record['status']}): {filename} in {record['total_seconds']:.1f}s")
+        else:
+            print(f"❌ Backup verification {record['status']} for {filename}: "
+                  f"{record.get('error') or ', '.join(record['mismatches'])}")
+        return {
+            "success": record['status'] in ('passed', 'restored'),
+            "filename": filename,
+            "verification": record,
+            "error": record.get('error') or (f"Mismatched tables: {', '.join(record['mismatches'])}"
+                                             if record.get('mismatches') else None)
+        }
+
+# Global backup verifier instance
+backup_verifier = BackupVerifier()
@@ -0,0 +1,106 @@
+"""
+Benchmark Baselines for Hexashop
+Save benchmark results and flag regressions against a stored run
+"""
+import json
+import os
+import platform
+import sys
+from datetime import datetime
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+DEFAULT_TOLERANCE = 0.20    # 20% worse than the baseline counts as a regression
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def environment():
+    """Where a result was measured - baselines only compare on similar machines"""
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_baseline(name, results, settings):
+    """Write {'results': {case: {metric: value}}, ...} to benchmarks/baselines/<name>.json"""
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    document = {
+        'name': name,
+        'created_at': datetime.utcnow().isoformat(),
+        'command': ' '.join(sys.argv),
+        'settings': settings,
+        'environment': environment(),
+        'results': results,
+    }
+    path = baseline_path(name)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as baseline_file:
+        json.dump(document, baseline_file, indent=2, sort_keys=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def load_baseline(name):
+    with open(baseline_path(name), encoding='utf-8') as baseline_file:
+        return json.load(baseline_file)
+
+
+def compare(results, baseline, metrics, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare {case: {metric: value}} against a loaded baseline.
+
+    metrics: {metric: (better, noise_floor)} where better is 'lower' or
+    'higher' and noise_floor is the smallest absolute change that counts
+    (so a 0.2 ms -> 0.3 ms p50 is not reported as a 50% regression).
+    Returns rows for every compared value, each flagged 'regression',
+    'improvement' or 'ok'.
+    """
+    rows = []
+    base_results = baseline['results']
+    for case, values in sorted(results.items()):
+        base_values = base_results.get(case)
+        if not base_values:
+            continue
+        for metric, (better, noise_floor) in metrics.items():
+            current, previous = values.get(metric), base_values.get(metric)
+            if current is None or previous is None:
+                continue
+
+            delta = current - previous
+            worse = delta > 0 if better == 'lower' else delta < 0
+            change = abs(delta) / previous if previous else (0.0 if not delta else float('inf'))
+            if abs(delta) < noise_floor or change <= tolerance:
+                verdict = 'ok'
+            else:
+                verdict = 'regression' if worse else 'improvement'
+            rows.append({
+                'case': case,
+                'metric': metric,
+                'baseline': previous,
+                'current': current,
+                'change_percent': round(delta / previous * 100, 1) if previous else None,
+                'verdict': verdict,
+            })
+    return rows
+
+
+def print_comparison(rows, baseline):
+    print(f"\n📏 Compared with baseline '{baseline['name']}' ({baseline['created_at']})")
+    if baseline.get('environment') != environment():
+        print("⚠️ Baseline was recorded on a different environment; expect noise")
+
+    flagged = [row for row in rows if row['verdict'] != 'ok']
+    if not flagged:
+        print(f"✅ No regressions ({len(rows)} values within tolerance)")
+        return False
+
+    for row in flagged:
+        icon = '❌' if row['verdict'] == 'regression' else '🚀'
+        print(f"{icon} {row['case']} {row['metric']}: {row['baseline']} -> {row['current']} "
+              f"({row['change_percent']:+}%)")
+    return any(row['verdict'] == 'regression' for row in flagged)
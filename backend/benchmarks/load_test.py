@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Load Test Harness for Hexashop
+Seeds a synthetic catalog and order history, drives a concurrent
+browse/search/checkout/tracking/admin mix and reports throughput and
+latency percentiles per endpoint.
+
+Run from backend/:
+
+    # Self-contained: SQLite + fakeredis stand-ins, app served by Waitress in-process
+    # (needs: pip install "fakeredis[lua]")
+    python benchmarks/load_test.py --products 2000 --orders 5000 --users 50 --duration 60
+
+    # Local Postgres and Redis (DATABASE_URL / REDIS_URL from the environment)
+    python benchmarks/load_test.py --real-services
+
+    # A server that is already running (no seeding; admin credentials optional)
+    python benchmarks/load_test.py --target http://127.0.0.1:5000 --admin-user ... --admin-password ...
+
+    # Baselines in benchmarks/baselines/ - compare exits 1 on regression
+    python benchmarks/load_test.py --save-baseline sqlite-50users
+    python benchmarks/load_test.py --compare sqlite-50users
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlsplit
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from baseline import DEFAULT_TOLERANCE, compare, load_baseline, print_comparison, save_baseline  # noqa: E402
+
+DEFAULT_MIX = {'browse': 55, 'search': 15, 'checkout': 8, 'tracking': 17, 'admin': 5}
+
+BRANDS = ['Ray-Ban', 'Oakley', 'Gucci', 'Prada', 'Persol', 'Carrera', 'Police', 'Vogue', 'Tom Ford', 'Hexa']
+MODELS = ['Men', 'Women', 'Kids']
+TYPES = ['sunglasses', 'eyeglasses']
+SHAPES = ['aviator', 'round', 'square', 'cat-eye', 'rectangle', 'wayfarer']
+COLORS = ['Black', 'Gold', 'Silver', 'Havana', 'Blue', 'Red']
+WILAYAS = ['Alger', 'Oran', 'Constantine', 'Annaba', 'Blida', 'Setif', 'Tlemcen', 'Bejaia']
+SEARCH_TERMS = ['ray', 'aviator', 'gold', 'kids', 'polarized', 'round', 'oak', 'hexa', 'nothing-matches']
+
+BENCH_ADMIN_USER = 'bench-admin'
+BENCH_ADMIN_PASSWORD = 'bench-admin-password'
+BENCH_PROMO = 'BENCH10'
+
+# Regression checks: metric -> (better, noise floor)
+BASELINE_METRICS = {
+    'p50_ms': ('lower', 2.0),
+    'p90_ms': ('lower', 5.0),
+    'p99_ms': ('lower', 10.0),
+    'throughput_rps': ('higher', 1.0),
+    'error_rate': ('lower', 0.005),
+}
+MIN_COMPARE_REQUESTS = 100  # Endpoints with fewer samples have unstable tail percentiles
+
+
+# ---------------------------------------------------------------- app setup
+
+def _use_stand_in_redis():
+    """Point every Redis tier at one in-process fakeredis server"""
+    import fakeredis
+    import redis_tiers
+
+    server = fakeredis.FakeServer()
+
+    class StandInPool(redis_tiers.BlockingConnectionPool):
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            return cls(connection_class=fakeredis.FakeConnection, server=server, **kwargs)
+
+    redis_tiers.BlockingConnectionPool = StandInPool
+
+
+def start_app(args, workdir):
+    """Import the app against the chosen services, seed it and serve it with Waitress"""
+    if not args.real_services:
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'hexashop-bench.sqlite3')}"
+        _use_stand_in_redis()
+    os.environ.setdefault('SECRET_KEY', 'hexashop-benchmark')
+    os.environ.setdefault('TRACE_EXPORT_PATH', os.path.join(workdir, 'traces.otlp.jsonl'))
+    os.environ['LOAD_SHEDDING_ENABLED'] = '1' if args.shedding else '0'
+
+    from app import app
+    from database import db, init_db
+    from rate_limiter import rate_limiter
+    from waitress import create_server
+
+    # Every virtual user shares one IP; per-IP limits would turn the run into a 429 benchmark
+    for name, (_max_hits, window) in list(rate_limiter.limits.items()):
+        rate_limiter.limits[name] = (10 ** 9, window)
+
+    with app.app_context():
+        init_db()
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql('PRAGMA journal_mode=WAL')
+        catalog = seed(db, args.products, args.orders, random.Random(args.seed))
+
+    server = create_server(app, host='127.0.0.1', port=0, threads=args.server_threads)
+    threading.Thread(target=server.run, daemon=True).start()
+    return f"http://127.0.0.1:{server.effective_port}", catalog, server
+
+
+def seed(db, product_count, order_count, rng):
+    """Insert a synthetic catalog, promo code, admin user and order history"""
+    from models import AdminUser, Order, OrderItem, Product, PromoCode
+
+    started = time.time()
+    now = datetime.utcnow()
+    prefix = f"B{int(started) % 100000:05d}"
+
+    products = []
+    for i in range(product_count):
+        colors = [{'name': name, 'hex': '#000000', 'stock': 10 ** 6}
+                  for name in rng.sample(COLORS, rng.randint(1, 3))]
+        brand = rng.choice(BRANDS)
+        shape = rng.choice(SHAPES)
+        discounted = rng.random() < 0.2
+        price = round(rng.uniform(2000, 45000), -2)
+        products.append({
+            'id': f"{prefix}-P{i:06d}",
+            'title': f"{brand} {shape.title()} {i}",
+            'price': price,
+            'brand': brand,
+            'description': f"{shape} frame, polarized lenses, UV400 protection. Model {i}.",
+            'model': rng.choice(MODELS),
+            'frame_shape': shape,
+            'frame_material': rng.choice(['metal', 'acetate', 'titanium']),
+            'frame_color': colors[0]['name'],
+            'lenses': 'polarized',
+            'protection': 'UV400',
+            'dimensions': '52-18-140',
+            'images': json.dumps({'main': f"/images/{i}.jpg", 'gallery': [f"/images/{i}-{n}.jpg" for n in range(3)]}),
+            'type': rng.choice(TYPES),
+            'discount_price': round(price * 0.8, -2) if discounted else None,
+            'discount_active': discounted,
+            'discount_start': now - timedelta(days=1) if discounted else None,
+            'discount_end': now + timedelta(days=30) if discounted else None,
+            'available_colors': json.dumps(colors),
+            'is_featured': i % 20 == 0,
+            'created_at': now - timedelta(minutes=i),
+        })
+    for start in range(0, len(products), 1000):
+        db.session.bulk_insert_mappings(Product, products[start:start + 1000])
+
+    orders, items, phones = [], [], []
+    for i in range(order_count):
+        phone = f"05{rng.randint(0, 99999999):08d}"
+        phones.append(phone)
+        order_id = f"{prefix}{i:07d}"
+        total = 0
+        for _ in range(rng.randint(1, 3)):
+            product = rng.choice(products)
+            quantity = rng.randint(1, 2)
+            total += product['price'] * quantity
+            items.append({
+                'order_id': order_id,
+                'product_id': product['id'],
+                'product_name': product['title'],
+                'quantity': quantity,
+                'price': product['price'],
+                'color': product['frame_color'],
+                'image': '',
+                'selected_color': product['frame_color'],
+            })
+        created = now - timedelta(minutes=rng.randint(0, 90 * 24 * 60))
+        orders.append({
+            'id': order_id,
+            'phone_number': phone,
+            'customer_name': f"Customer {i}",
+            'wilaya': rng.choice(WILAYAS),
+            'address': f"{i} rue des Benchmarks",
+            'status': rng.choice(['pending', 'confirmed', 'shipped', 'delivered', 'cancelled']),
+            'total': total,
+            'delivery_updates': json.dumps([{'date': created.isoformat(), 'status': 'ordered',
+                                             'message': 'Order received'}]),
+            'created_at': created,
+        })
+    for start in range(0, len(orders), 1000):
+        db.session.bulk_insert_mappings(Order, orders[start:start + 1000])
+    for start in range(0, len(items), 1000):
+        db.session.bulk_insert_mappings(OrderItem, items[start:start + 1000])
+
+    if not PromoCode.query.filter_by(code=BENCH_PROMO).first():
+        db.session.add(PromoCode(code=BENCH_PROMO, discount_type='percentage', discount_value=10,
+                                 valid_from=now - timedelta(days=1), valid_until=now + timedelta(days=365)))
+    if not AdminUser.query.filter_by(username=BENCH_ADMIN_USER).first():
+        admin = AdminUser(username=BENCH_ADMIN_USER)
+        admin.set_password(BENCH_ADMIN_PASSWORD)
+        db.session.add(admin)
+    db.session.commit()
+
+    print(f"🌱 Seeded {product_count} products, {order_count} orders ({len(items)} items) "
+          f"in {time.time() - started:.1f}s")
+    return {
+        'products': [(p['id'], json.loads(p['available_colors'])[0]['name']) for p in products],
+        'categories': MODELS,
+        'brands': BRANDS,
+        'orders': [order['id'] for order in orders],
+        'phones': phones,
+        'admin': (BENCH_ADMIN_USER, BENCH_ADMIN_PASSWORD),
+    }
+
+
+def discover_catalog(base_url, args):
+    """Catalog of an already running server, read through the public API"""
+    client = HttpClient(base_url, Recorder(0))
+    _status, products = client.request('GET', '/api/products/', name=None)
+    products = products if isinstance(products, list) else (products or {}).get('products', [])
+    catalog = {
+        'products': [(p['id'], (p.get('available_colors') or [{'name': ''}])[0]['name']) for p in products],
+        'categories': MODELS,
+        'brands': sorted({p['brand'] for p in products}) or BRANDS,
+        'orders': [],
+        'phones': [],
+        'admin': (args.admin_user, args.admin_password) if args.admin_user else None,
+    }
+    if not catalog['products']:
+        raise SystemExit("❌ Target has no products to browse")
+    return catalog
+
+
+# ---------------------------------------------------------------- client side
+
+class Recorder:
+    """Thread-safe latency samples per endpoint name, ignoring the warmup period"""
+
+    def __init__(self, record_after):
+        self.record_after = record_after
+        self.samples = {}
+        self.statuses = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, status, seconds):
+        if time.time() < self.record_after:
+            return
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+            statuses = self.statuses.setdefault(name, {})
+            statuses[status] = statuses.get(status, 0) + 1
+
+
+class HttpClient:
+    """One keep-alive connection per virtual user, with the admin session cookie"""
+
+    def __init__(self, base_url, recorder):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.recorder = recorder
+        self.cookie = None
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None, name=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+
+        start = time.perf_counter()
+        try:
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+            status = response.status
+            set_cookie = response.getheader('Set-Cookie')
+            if set_cookie:
+                self.cookie = set_cookie.split(';', 1)[0]
+        except (OSError, http.client.HTTPException):
+            self.connection = None
+            payload, status = b'', 599   # Connection-level failure
+        elapsed = time.perf_counter() - start
+
+        if name:
+            self.recorder.add(name, status, elapsed)
+        try:
+            return status, json.loads(payload) if payload else None
+        except ValueError:
+            return status, None
+
+
+class VirtualUser:
+    def __init__(self, client, catalog, rng, think_time):
+        self.client = client
+        self.catalog = catalog
+        self.rng = rng
+        self.think_time = think_time
+        self.csrf_token = None
+
+    def browse(self):
+        self.client.request('GET', '/api/products/', name='GET /api/products/')
+        category = self.rng.choice(self.catalog['categories'])
+        self.client.request('GET', f"/api/products/category/{quote(category)}",
+                            name='GET /api/products/category/<category>')
+        product_id, _color = self.rng.choice(self.catalog['products'])
+        self.client.request('GET', f"/api/products/{quote(product_id)}", name='GET /api/products/<id>')
+        if self.rng.random() < 0.3:
+            self.client.request('GET', '/api/products/featured', name='GET /api/products/featured')
+        if self.rng.random() < 0.2:
+            brand = self.rng.choice(self.catalog['brands'])
+            self.client.request('GET', f"/api/products/brand/{quote(brand)}", name='GET /api/products/brand/<brand>')
+
+    def search(self):
+        term = self.rng.choice(SEARCH_TERMS)
+        self.client.request('GET', f"/api/products/search?q={quote(term)}", name='GET /api/products/search')
+
+    def checkout(self):
+        lines = self.rng.sample(self.catalog['products'], min(len(self.catalog['products']), self.rng.randint(1, 3)))
+        use_promo = self.rng.random() < 0.3
+        if use_promo:
+            self.client.request('POST', '/api/cart/validate-promo',
+                                body={'promoCode': BENCH_PROMO, 'orderAmount': 10000},
+                                name='POST /api/cart/validate-promo')
+        phone = f"06{self.rng.randint(0, 99999999):08d}"
+        status, payload = self.client.request('POST', '/api/orders/', body={
+            'phoneNumber': phone,
+            'customerName': 'Load Test',
+            'wilaya': self.rng.choice(WILAYAS),
+            'address': '1 rue du Benchmark',
+            'promoCode': BENCH_PROMO if use_promo else None,
+            'items': [{'productId': product_id, 'quantity': 1, 'selected_color': color}
+                      for product_id, color in lines],
+        }, name='POST /api/orders/')
+        if status == 201 and payload:
+            self.catalog['orders'].append(payload['orderId'])
+            self.catalog['phones'].append(phone)
+
+    def tracking(self):
+        if not self.catalog['orders']:
+            return self.browse()
+        order_id = self.rng.choice(self.catalog['orders'])
+        self.client.request('GET', f"/api/tracking/{quote(order_id)}", name='GET /api/tracking/<id>')
+        if self.rng.random() < 0.3 and self.catalog['phones']:
+            phone = self.rng.choice(self.catalog['phones'])
+            self.client.request('GET', f"/api/orders/phone/{phone}", name='GET /api/orders/phone/<phone>')
+
+    def admin(self):
+        if not self.catalog.get('admin'):
+            return self.browse()
+        if self.csrf_token is None:
+            username, password = self.catalog['admin']
+            status, payload = self.client.request('POST', '/api/admin/login',
+                                                  body={'username': username, 'password': password},
+                                                  name='POST /api/admin/login')
+            if status != 200 or not payload:
+                return
+            self.csrf_token = payload.get('csrf_token')
+        self.client.request('GET', '/api/admin/stats', name='GET /api/admin/stats')
+        self.client.request('GET', '/api/admin/orders', name='GET /api/admin/orders')
+        if self.rng.random() < 0.2:
+            self.client.request('GET', '/api/performance/summary', name='GET /api/performance/summary')
+
+    def run(self, mix, stop_at):
+        scenarios = list(mix)
+        weights = [mix[name] for name in scenarios]
+        while time.time() < stop_at:
+            getattr(self, self.rng.choices(scenarios, weights)[0])()
+            if self.think_time:
+                time.sleep(self.rng.expovariate(1 / self.think_time))
+
+
+def run_load(base_url, catalog, args):
+    record_after = time.time() + args.warmup
+    stop_at = record_after + args.duration
+    recorder = Recorder(record_after)
+
+    users = []
+    for number in range(args.users):
+        user = VirtualUser(HttpClient(base_url, recorder), catalog, random.Random(args.seed + number),
+                           args.think_ms / 1000)
+        users.append(threading.Thread(target=user.run, args=(args.mix, stop_at), daemon=True))
+
+    print(f"🚦 {args.users} virtual users for {args.duration}s (+{args.warmup}s warmup) against {base_url}")
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    return recorder
+
+
+# ---------------------------------------------------------------- reporting
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, duration):
+    results = {}
+    everything = []
+    all_statuses = {}
+    for name, samples in recorder.samples.items():
+        samples.sort()
+        everything.extend(samples)
+        statuses = recorder.statuses[name]
+        for status, count in statuses.items():
+            all_statuses[status] = all_statuses.get(status, 0) + count
+        results[name] = _stats(samples, statuses, duration)
+    everything.sort()
+    results['ALL'] = _stats(everything, all_statuses, duration)
+    return results
+
+
+def _stats(samples, statuses, duration):
+    count = len(samples)
+    errors = sum(n for status, n in statuses.items() if status >= 500)
+    return {
+        'requests': count,
+        'throughput_rps': round(count / duration, 2),
+        'error_rate': round(errors / count, 4) if count else 0.0,
+        'non_2xx': sum(n for status, n in statuses.items() if not 200 <= status < 300),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'mean_ms': round(sum(samples) / count * 1000, 2) if count else 0.0,
+        'p50_ms': round(_percentile(samples, 0.50) * 1000, 2),
+        'p90_ms': round(_percentile(samples, 0.90) * 1000, 2),
+        'p99_ms': round(_percentile(samples, 0.99) * 1000, 2),
+        'max_ms': round(samples[-1] * 1000, 2) if samples else 0.0,
+    }
+
+
+def print_report(results):
+    header = f"{'endpoint':<42}{'reqs':>8}{'rps':>9}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+    print('\n' + header)
+    print('-' * len(header))
+    for name, stats in sorted(results.items(), key=lambda item: (item[0] == 'ALL', item[0])):
+        print(f"{name:<42}{stats['requests']:>8}{stats['throughput_rps']:>9.1f}"
+              f"{stats['error_rate'] * 100:>6.1f}%{stats['p50_ms']:>9.1f}{stats['p90_ms']:>9.1f}"
+              f"{stats['p99_ms']:>9.1f}{stats['max_ms']:>9.1f}")
+    print("(latencies in ms; errors are 5xx and connection failures)")
+
+
+# ---------------------------------------------------------------- entry point
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _sep, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario '{name}' (choose from {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hexashop load test")
+    parser.add_argument('--target', help="Base URL of a running server (skips app start and seeding)")
+    parser.add_argument('--real-services', action='store_true',
+                        help="Use DATABASE_URL/REDIS_URL instead of SQLite and fakeredis")
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--orders', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument('--duration', type=int, default=30, help="Measured seconds")
+    parser.add_argument('--warmup', type=int, default=5, help="Seconds excluded from the results")
+    parser.add_argument('--think-ms', type=float, default=0, help="Mean pause between scenarios")
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help="Scenario weights, e.g. browse=55,search=15,checkout=8,tracking=17,admin=5")
+    parser.add_argument('--server-threads', type=int, default=20, help="Waitress threads (production uses 20)")
+    parser.add_argument('--shedding', action='store_true', help="Keep SLO load shedding on during the run")
+    parser.add_argument('--admin-user')
+    parser.add_argument('--admin-password')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='hexashop-bench-') as workdir:
+        if args.target:
+            base_url, catalog, server = args.target.rstrip('/'), discover_catalog(args.target, args), None
+        else:
+            base_url, catalog, server = start_app(args, workdir)
+
+        recorder = run_load(base_url, catalog, args)
+        if server is not None:
+            server.close()
+
+    results = summarize(recorder, args.duration)
+    print_report(results)
+
+    settings = {key: value for key, value in vars(args).items()
+                if key not in ('json', 'save_baseline', 'compare', 'admin_password')}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'settings': settings, 'results': results}, output, indent=2)
+    if args.save_baseline:
+        print(f"💾 Baseline saved to {save_baseline(args.save_baseline, results, settings)}")
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        if baseline.get('settings', {}).get('mix') != settings['mix']:
+            print("⚠️ Baseline used a different scenario mix")
+        comparable = {name: stats for name, stats in results.items() if stats['requests'] >= MIN_COMPARE_REQUESTS}
+        if print_comparison(compare(comparable, baseline, BASELINE_METRICS, args.tolerance), baseline):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for Hexashop hot paths
+Times model serialization, JSON, stock/discount evaluation and cache
+round-trips over generated catalogs, with tracemalloc allocation figures.
+
+Run from backend/:
+
+    # (cache cases need: pip install fakeredis, or --redis-url for a local Redis)
+    python benchmarks/microbench.py                          # 100, 1k, 10k and 100k products
+    python benchmarks/microbench.py --sizes 100,1000 --cases product_to_dict,cache_roundtrip
+    python benchmarks/microbench.py --save-baseline laptop
+    python benchmarks/microbench.py --compare laptop         # exits 1 on regression
+
+Every case runs once over the whole generated catalog per iteration, so
+`median_ms` is the cost of serializing/evaluating/caching N products and
+`per_item_us` the cost of one.
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from baseline import DEFAULT_TOLERANCE, compare, load_baseline, print_comparison, save_baseline  # noqa: E402
+
+DEFAULT_SIZES = (100, 1000, 10000, 100000)
+ORDERS_PER_PRODUCT = 0.1        # 1k products -> 100 orders
+MIN_RUN_SECONDS = 0.2           # Each timed repeat runs at least this long
+
+BRANDS = ['Ray-Ban', 'Oakley', 'Gucci', 'Prada', 'Persol', 'Carrera', 'Police', 'Vogue', 'Tom Ford', 'Hexa']
+SHAPES = ['aviator', 'round', 'square', 'cat-eye', 'rectangle', 'wayfarer']
+COLORS = ['Black', 'Gold', 'Silver', 'Havana', 'Blue', 'Red']
+
+# metric -> (better, noise floor)
+BASELINE_METRICS = {
+    'median_ms': ('lower', 0.05),
+    'peak_kb': ('lower', 16),
+}
+
+
+def make_products(count, rng):
+    """Transient Product rows shaped like the production catalog"""
+    from models import Product
+
+    now = datetime.utcnow()
+    products = []
+    for i in range(count):
+        brand = rng.choice(BRANDS)
+        shape = rng.choice(SHAPES)
+        price = round(rng.uniform(2000, 45000), -2)
+        discounted = rng.random() < 0.2
+        colors = [{'name': name, 'hex': '#000000', 'stock': rng.randint(0, 40)}
+                  for name in rng.sample(COLORS, rng.randint(1, 4))]
+        products.append(Product(
+            id=f"P{i:07d}",
+            title=f"{brand} {shape.title()} {i}",
+            price=price,
+            brand=brand,
+            description=f"{shape} frame, polarized lenses, UV400 protection. Model {i}.",
+            model=rng.choice(['Men', 'Women', 'Kids']),
+            frame_shape=shape,
+            frame_material=rng.choice(['metal', 'acetate', 'titanium']),
+            frame_color=colors[0]['name'],
+            lenses='polarized',
+            protection='UV400',
+            dimensions='52-18-140',
+            images=json.dumps({'main': f"/images/{i}.jpg", 'gallery': [f"/images/{i}-{n}.jpg" for n in range(3)]}),
+            type=rng.choice(['sunglasses', 'eyeglasses']),
+            discount_price=round(price * 0.8, -2) if discounted else None,
+            discount_active=discounted,
+            discount_start=now - timedelta(days=1) if discounted else None,
+            discount_end=now + timedelta(days=30) if discounted else None,
+            available_colors=json.dumps(colors),
+            is_featured=i % 20 == 0,
+            created_at=now - timedelta(minutes=i),
+        ))
+    return products
+
+
+def make_orders(count, products, rng):
+    from models import Order, OrderItem
+
+    now = datetime.utcnow()
+    orders = []
+    for i in range(count):
+        items = []
+        for product in rng.sample(products, min(len(products), rng.randint(1, 3))):
+            items.append(OrderItem(product_id=product.id, product_name=product.title, quantity=1,
+                                   price=product.price, color=product.frame_color, image='',
+                                   selected_color=product.frame_color))
+        orders.append(Order(
+            id=f"O{i:08d}",
+            phone_number=f"05{rng.randint(0, 99999999):08d}",
+            customer_name=f"Customer {i}",
+            wilaya='Alger',
+            address=f"{i} rue des Benchmarks",
+            status='pending',
+            total=sum(item.price for item in items),
+            items=items,
+            delivery_updates=json.dumps([{'date': now.isoformat(), 'status': 'ordered', 'message': 'Order received'}]),
+            created_at=now,
+        ))
+    return orders
+
+
+def make_cache_app(redis_url):
+    """Bare Flask app carrying only what the product cache helpers read"""
+    from flask import Flask
+
+    app = Flask('hexashop-microbench')
+    if redis_url:
+        import redis
+        app.redis_client = redis.Redis.from_url(redis_url)
+    else:
+        import fakeredis
+        app.redis_client = fakeredis.FakeRedis()
+    return app
+
+
+def build_cases(size, rng, cache_app):
+    """name -> zero-argument callable processing the whole fixture once"""
+    from routes.products import _build_cache_key, _get_cached_payload, _set_cached_payload
+
+    products = make_products(size, rng)
+    orders = make_orders(max(1, int(size * ORDERS_PER_PRODUCT)), products, rng)
+    product_dicts = [product.to_dict() for product in products]
+    encoded = json.dumps(product_dicts)
+    searches = [(rng.choice(BRANDS), rng.choice(SHAPES), page) for page in range(size)]
+    cache_key = _build_cache_key('products', 'bench', size)
+
+    def cache_roundtrip():
+        with cache_app.app_context():
+            _set_cached_payload(cache_key, {'products': product_dicts})
+            return _get_cached_payload(cache_key)
+
+    return {
+        'product_to_dict': lambda: [product.to_dict() for product in products],
+        'order_to_dict': lambda: [order.to_dict() for order in orders],
+        'json_encode': lambda: json.dumps(product_dicts),
+        'json_decode': lambda: json.loads(encoded),
+        'stock_aggregation': lambda: [product.get_total_quantity() for product in products],
+        'discount_evaluation': lambda: [product.get_current_price() for product in products],
+        'build_cache_key': lambda: [_build_cache_key('search', *search) for search in searches],
+        'cache_roundtrip': cache_roundtrip,
+    }, len(orders)
+
+
+def measure_time(function, repeat):
+    """(number per repeat, [seconds per call]) - timeit with GC enabled like production"""
+    timer = timeit.Timer(function, setup='gc.enable()', globals={'gc': gc})
+    number, elapsed = timer.autorange()
+    if elapsed < MIN_RUN_SECONDS:
+        number = max(number, int(number * MIN_RUN_SECONDS / max(elapsed, 1e-9)))
+    return number, [total / number for total in timer.repeat(repeat=repeat, number=number)]
+
+
+def measure_memory(function):
+    """(peak KiB allocated during one call, KiB still held by its result)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = function()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return round((peak - before) / 1024, 1), round((current - before) / 1024, 1)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    cache_app = make_cache_app(args.redis_url)
+    results = {}
+
+    print(f"{'case':<34}{'runs':>8}{'median ms':>12}{'min ms':>10}{'per item µs':>13}{'peak KiB':>11}{'kept KiB':>10}")
+    for size in args.sizes:
+        cases, order_count = build_cases(size, rng, cache_app)
+        for name, function in cases.items():
+            if args.cases and name not in args.cases:
+                continue
+            number, timings = measure_time(function, args.repeat)
+            peak_kb, retained_kb = measure_memory(function)
+            items = order_count if name == 'order_to_dict' else size
+            median = statistics.median(timings)
+            case = f"{name}[{size}]"
+            results[case] = {
+                'items': items,
+                'runs': number * args.repeat,
+                'median_ms': round(median * 1000, 4),
+                'min_ms': round(min(timings) * 1000, 4),
+                'per_item_us': round(median / items * 1e6, 3),
+                'peak_kb': peak_kb,
+                'retained_kb': retained_kb,
+            }
+            stats = results[case]
+            print(f"{case:<34}{stats['runs']:>8}{stats['median_ms']:>12.3f}{stats['min_ms']:>10.3f}"
+                  f"{stats['per_item_us']:>13.3f}{peak_kb:>11.1f}{retained_kb:>10.1f}")
+        cache_app.redis_client.flushdb()
+        del cases
+        gc.collect()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hexashop micro-benchmarks")
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=list(DEFAULT_SIZES), help="Catalog sizes, e.g. 100,1000")
+    parser.add_argument('--cases', type=lambda value: value.split(','), help="Only these cases")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed repeats per case")
+    parser.add_argument('--redis-url', help="Use this Redis for cache cases instead of fakeredis")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--save-baseline', metavar='NAME')
+    parser.add_argument('--compare', metavar='NAME')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run(args)
+
+    settings = {'sizes': args.sizes, 'repeat': args.repeat, 'seed': args.seed,
+                'redis': 'external' if args.redis_url else 'fakeredis'}
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as output:
+            json.dump({'settings': settings, 'results': results}, output, indent=2)
+    if args.save_baseline:
+        print(f"💾 Baseline saved to {save_baseline(args.save_baseline, results, settings)}")
+    if args.compare:
+        baseline = load_baseline(args.compare)
+        if print_comparison(compare(results, baseline, BASELINE_METRICS, args.tolerance), baseline):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+"""
+Job Scheduler for Hexashop
+Clock-aligned periodic jobs that run once per cluster, with run state kept in Redis
+"""
+import hashlib
+import os
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+
+from metrics import metrics_registry
+
+TICK_SECONDS = 5                # How often the leader checks for due jobs
+LEADER_LEASE = 30               # Leader lease, renewed every tick
+DEFAULT_TIMEOUT = 3600          # Upper bound on a run's running lock
+
+# Renew the lease only if this scheduler still holds it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Claim occurrence ARGV[1] of a job: only if it is newer than the last one
+# claimed and no earlier run still holds the running lock (KEYS[2])
+CLAIM_SCRIPT = """
+local last = tonumber(redis.call('hget', KEYS[1], 'last_slot') or '0')
+if tonumber(ARGV[1]) <= last then
+    return 0
+end
+if not redis.call('set', KEYS[2], ARGV[2], 'NX', 'EX', ARGV[3]) then
+    return 0
+end
+redis.call('hset', KEYS[1], 'last_slot', ARGV[1], 'claimed_by', ARGV[2], 'claimed_at', ARGV[4])
+return 1
+"""
+
+
+class ScheduledJob:
+    """A named callable that runs `every` N seconds (aligned to the clock) or daily `at` HH:MM local time"""
+
+    def __init__(self, name, func, every=None, at=None, offset=0, jitter=0, grace=None, timeout=DEFAULT_TIMEOUT):
+        if (every is None) == (at is None):
+            raise ValueError(f"Job {name} needs exactly one of every= or at=")
+        self.name = name
+        self.func = func
+        self.every = every
+        self.at = None
+        if at is not None:
+            hour, minute = (int(part) for part in at.split(':'))
+            self.at = (hour, minute)
+        self.offset = offset
+        self.jitter = jitter
+        self.period = every or 86400
+        self.grace = self.period if grace is None else grace
+        self.timeout = timeout
+
+    def describe(self):
+        if self.every is not None:
+            return f"every {self.every}s" + (f" +{self.offset}s" if self.offset else "")
+        return f"daily at {self.at[0]:02d}:{self.at[1]:02d}"
+
+    def last_slot(self, now):
+        """Start time of the most recent occurrence at or before `now`"""
+        if self.every is not None:
+            return (now - self.offset) // self.every * self.every + self.offset
+        local = datetime.fromtimestamp(now)
+        slot = local.replace(hour=self.at[0], minute=self.at[1], second=0, microsecond=0)
+        if slot > local:
+            slot -= timedelta(days=1)
+        return slot.timestamp()
+
+    def delay(self, slot):
+        """Jitter for one occurrence - derived from the slot so every worker agrees on it"""
+        if not self.jitter:
+            return 0
+        digest = hashlib.sha1(f"{self.name}:{slot:.0f}".encode()).hexdigest()
+        return int(digest[:8], 16) % (self.jitter + 1)
+
+
+class JobScheduler:
+    """
+    Runs registered jobs exactly once per occurrence across all workers.
+
+    Every worker process runs a ticker thread, but only the holder of the
+    `leader` lease looks for due jobs. Each job keeps its state in the
+    hash hexashop:scheduler:job:<name> (last claimed occurrence, last
+    status, duration, error, run and failure counts); an occurrence is
+    claimed with a compare-and-set on last_slot plus a per-job running
+    lock, so a leader handover or an overlapping slow run can never start
+    the same occurrence twice.
+
+    Because the last claimed occurrence is persisted, a run missed while
+    the fleet was down is caught up once on startup if it is still within
+    the job's grace period (default: one period). Jobs seen for the first
+    time start from the next occurrence. Each occurrence is delayed by a
+    deterministic jitter of up to `jitter` seconds. Without Redis this
+    process is always the leader and state is kept in memory.
+    """
+
+    def __init__(self, app=None, redis_client=None):
+        self.app = app
+        self.redis = None
+        self.key_prefix = 'hexashop:scheduler:'
+        self.scheduler_id = secrets.token_hex(8)
+        self.jobs = {}
+        self._local_state = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._ticker_pid = None
+
+        if app is not None:
+            self.init_app(app, redis_client)
+
+    def init_app(self, app, redis_client=None):
+        self.app = app
+        self.redis = redis_client
+        if redis_client is not None:
+            self._renew = redis_client.register_script(RENEW_SCRIPT)
+            self._release = redis_client.register_script(RELEASE_SCRIPT)
+            self._claim = redis_client.register_script(CLAIM_SCRIPT)
+        app.job_scheduler = self
+        # Forked workers (gunicorn --preload) start their own ticker on first request
+        app.before_request(self._start_ticker)
+        self._start_ticker()
+
+    @property
+    def leader_key(self):
+        return f"{self.key_prefix}leader"
+
+    def _job_key(self, name):
+        return f"{self.key_prefix}job:{name}"
+
+    def _running_key(self, name):
+        return f"{self.key_prefix}running:{name}"
+
+    def add(self, name, func, **schedule):
+        """Register (or replace) a job; see ScheduledJob for the schedule arguments"""
+        job = ScheduledJob(name, func, **schedule)
+        with self._lock:
+            self.jobs[name] = job
+        return job
+
+    # ----- state -----
+
+    def _state(self, name):
+        if self.redis is None:
+            return dict(self._local_state.get(name, {}))
+        raw = self.redis.hgetall(self._job_key(name))
+        return {key.decode(): value.decode() for key, value in raw.items()}
+
+    def _update_state(self, name, fields, counter=None):
+        if self.redis is None:
+            with self._lock:
+                state = self._local_state.setdefault(name, {})
+                state.update({key: str(value) for key, value in fields.items()})
+                if counter:
+                    state[counter] = str(int(state.get(counter, 0)) + 1)
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(self._job_key(name), mapping=fields)
+        if counter:
+            pipe.hincrby(self._job_key(name), counter, 1)
+        pipe.execute()
+
+    def _try_claim(self, job, slot):
+        """Take occurrence `slot` of `job` and its running lock; False if already taken or still running"""
+        if self.redis is None:
+            with self._lock:
+                state = self._local_state.setdefault(job.name, {})
+                if slot <= float(state.get('last_slot', 0)) or job.name in self._running:
+                    return False
+                state.update({'last_slot': str(slot), 'claimed_by': self.scheduler_id,
+                              'claimed_at': str(time.time())})
+                self._running.add(job.name)
+            return True
+        claimed = self._claim(keys=[self._job_key(job.name), self._running_key(job.name)],
+                              args=[slot, self.scheduler_id, job.timeout, time.time()])
+        return bool(claimed)
+
+    def _release_running(self, name, token):
+        if self.redis is None:
+            with self._lock:
+                self._running.discard(name)
+            return
+        self._release(keys=[self._running_key(name)], args=[token])
+
+    # ----- leader and ticker -----
+
+    def _start_ticker(self):
+        # One ticker thread per (forked) worker process; only the leader acts on it
+        with self._lock:
+            if self._ticker_pid == os.getpid():
+                return
+            self._ticker_pid = os.getpid()
+        threading.Thread(target=self._tick_loop, daemon=True).start()
+
+    def _is_leader(self):
+        if self.redis is None:
+            return True
+        try:
+            if self.redis.set(self.leader_key, self.scheduler_id, nx=True, ex=LEADER_LEASE):
+                print(f"👑 Job scheduler {self.scheduler_id} (pid {os.getpid()}) is the leader")
+                return True
+            return bool(self._renew(keys=[self.leader_key], args=[self.scheduler_id, LEADER_LEASE]))
+        except Exception as e:
+            print(f"⚠️ Scheduler leader check failed: {e}")
+            return False
+
+    def _tick_loop(self):
+        while True:
+            try:
+                if self._is_leader():
+                    self.run_pending()
+            except Exception as e:
+                print(f"⚠️ Scheduler tick failed: {e}")
+            time.sleep(TICK_SECONDS)
+
+    def run_pending(self, now=None):
+        """Start every job whose latest occurrence (plus jitter) is due and not yet claimed"""
+        now = time.time() if now is None else now
+        with self._lock:
+            jobs = list(self.jobs.values())
+        started = []
+        for job in jobs:
+            slot = job.last_slot(now)
+            if now < slot + job.delay(slot):
+                continue
+            state = self._state(job.name)
+            last = float(state.get('last_slot', 0))
+            if slot <= last:
+                continue
+            if not last:
+                # First sighting: start from the next occurrence instead of firing immediately
+                self._update_state(job.name, {'last_slot': slot, 'registered_at': now})
+                continue
+            if now - slot > job.grace:
+                self._update_state(job.name, {'last_slot': slot, 'last_status': 'skipped',
+                                              'last_error': 'Missed its grace period'}, counter='skipped')
+                print(f"⏭️ Scheduled job {job.name} skipped an occurrence older than {job.grace}s")
+                continue
+            if self._try_claim(job, slot):
+                if slot - last > job.period:
+                    print(f"⏰ Catching up scheduled job {job.name} (last run {datetime.fromtimestamp(last):%Y-%m-%d %H:%M})")
+                threading.Thread(target=self._execute, args=(job, slot), daemon=True).start()
+                started.append(job.name)
+        return started
+
+    # ----- execution -----
+
+    def _execute(self, job, slot, token=None):
+        token = token or self.scheduler_id
+        started = time.time()
+        status, error = 'succeeded', ''
+        try:
+            with self.app.app_context():
+                job.func()
+        except Exception as e:
+            status, error = 'failed', str(e)
+            print(f"❌ Scheduled job {job.name} failed: {e}")
+        finally:
+            duration = time.time() - started
+            try:
+                self._update_state(job.name, {
+                    'last_run_at': started,
+                    'last_status': status,
+                    'last_duration': round(duration, 3),
+                    'last_error': error,
+                    'last_slot_run': slot
+                }, counter='failures' if status == 'failed' else 'runs')
+            finally:
+                self._release_running(job.name, token)
+        metrics_registry.observe('hexashop_scheduler_job_duration_seconds', duration, job=job.name, status=status)
+
+    def run_now(self, name):
+        """Run a job immediately on this worker, outside its schedule; False if it is already running"""
+        job = self.jobs.get(name)
+        if job is None:
+            raise KeyError(name)
+        token = secrets.token_hex(8)
+        if self.redis is None:
+            with self._lock:
+                if name in self._running:
+                    return False
+                self._running.add(name)
+        elif not self.redis.set(self._running_key(name), token, nx=True, ex=job.timeout):
+            return False
+        threading.Thread(target=self._execute, args=(job, time.time(), token), daemon=True).start()
+        return True
+
+    def status(self):
+        """Schedule, last outcome and next run of every registered job"""
+        now = time.time()
+        leader = None
+        if self.redis is not None:
+            try:
+                holder = self.redis.get(self.leader_key)
+                leader = holder.decode() if holder else None
+            except Exception:
+                leader = None
+        jobs = []
+        for name, job in sorted(self.jobs.items()):
+            state = self._state(name)
+            next_slot = job.last_slot(now) + job.period
+            if self.redis is None:
+                running = name in self._running
+            else:
+                running = bool(self.redis.exists(self._running_key(name)))
+            jobs.append({
+                'name': name,
+                'schedule': job.describe(),
+                'jitter': job.jitter,
+                'running': running,
+                'last_run_at': _iso(state.get('last_run_at')),
+                'last_status': state.get('last_status'),
+                'last_duration': float(state['last_duration']) if state.get('last_duration') else None,
+                'last_error': state.get('last_error') or None,
+                'next_run_at': _iso(next_slot + job.delay(next_slot)),
+                'runs': int(state.get('runs', 0)),
+                'failures': int(state.get('failures', 0)),
+                'skipped': int(state.get('skipped', 0))
+            })
+        return {
+            'scheduler_id': self.scheduler_id,
+            'leader': leader or (self.scheduler_id if self.redis is None else None),
+            'is_leader': self.redis is None or leader == self.scheduler_id,
+            'jobs': jobs
+        }
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(float(timestamp)).isoformat() if timestamp else None
+
+# Global job scheduler instance
+job_scheduler = JobScheduler()
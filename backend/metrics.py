@@ -0,0 +1,274 @@
+"""
+Metrics Registry for Hexashop
+Cross-worker counters, gauges and histograms exported in OpenMetrics text format
+"""
+import json
+import math
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+BACKUP_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+DEFAULT_FLUSH_INTERVAL = 10  # seconds
+
+
+class Metric:
+    __slots__ = ('name', 'kind', 'help', 'labelnames', 'buckets', 'callback')
+
+    def __init__(self, name, kind, help_text, labelnames=(), buckets=None):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets else None
+        self.callback = None
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, labels, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    """
+    Each worker accumulates counter and histogram deltas locally and a
+    background thread adds them to one Redis hash (HINCRBYFLOAT), so the
+    exporter sees fleet-wide totals whichever worker serves /metrics.
+    Gauges are per-worker snapshots, published with a TTL and summed over
+    the workers that are still alive.
+    """
+
+    def __init__(self):
+        self.redis = None
+        self.key_prefix = 'hexashop:metrics:'
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.metrics = {}
+        self._deltas = {}
+        self._lock = threading.Lock()
+        self._flush_hooks = []
+        self._flusher_pid = None
+
+    @property
+    def worker_id(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def init_app(self, app, redis_client=None, flush_interval=None):
+        self.redis = redis_client
+        self.flush_interval = flush_interval or int(os.environ.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        app.metrics_registry = self
+
+    # ----- registration -----
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Metric(name, 'counter', help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Metric(name, 'histogram', help_text, labels, buckets))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._register(Metric(name, 'gauge', help_text, labels))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def set_gauge_callback(self, name, callback):
+        """callback() -> {label_values_tuple: value}, evaluated at flush time"""
+        self.metrics[name].callback = callback
+
+    def add_flush_hook(self, hook):
+        """Run hook() on every flush cycle of the background thread"""
+        self._flush_hooks.append(hook)
+
+    # ----- recording -----
+
+    def _labels(self, metric, labels):
+        return tuple(str(labels.get(name, '')) for name in metric.labelnames)
+
+    def _add(self, field, amount):
+        with self._lock:
+            self._deltas[field] = self._deltas.get(field, 0) + amount
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def inc(self, name, amount=1, **labels):
+        metric = self.metrics[name]
+        self._add((name, self._labels(metric, labels), ''), amount)
+
+    def observe(self, name, value, **labels):
+        metric = self.metrics[name]
+        label_values = self._labels(metric, labels)
+        bucket = bisect_left(metric.buckets, value)
+        with self._lock:
+            deltas = self._deltas
+            for suffix, amount in ((f'bucket:{bucket}', 1), ('sum', value), ('count', 1)):
+                field = (name, label_values, suffix)
+                deltas[field] = deltas.get(field, 0) + amount
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    # ----- flushing -----
+
+    def _start_flusher(self):
+        # Started lazily so every forked gunicorn worker gets its own thread
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            for hook in list(self._flush_hooks):
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"⚠️ Metrics flush hook error: {e}")
+
+    def _gauge_values(self):
+        values = {}
+        for metric in self.metrics.values():
+            if metric.kind != 'gauge' or metric.callback is None:
+                continue
+            try:
+                for label_values, value in metric.callback().items():
+                    values[json.dumps([metric.name, list(label_values)])] = value
+            except Exception as e:
+                print(f"⚠️ Gauge {metric.name} unavailable: {e}")
+        return values
+
+    def flush(self):
+        """Push local deltas and gauge snapshots to Redis (one pipeline)"""
+        if self.redis is None:
+            return
+
+        with self._lock:
+            deltas, self._deltas = self._deltas, {}
+
+        now = time.time()
+        ttl = self.flush_interval * 3
+        gauges = self._gauge_values()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for (name, label_values, suffix), amount in deltas.items():
+                pipe.hincrbyfloat(self.key_prefix + 'values', json.dumps([name, list(label_values), suffix]), amount)
+            if gauges:
+                gauge_key = f"{self.key_prefix}gauges:{self.worker_id}"
+                pipe.delete(gauge_key)
+                pipe.hset(gauge_key, mapping=gauges)
+                pipe.expire(gauge_key, ttl)
+            pipe.zadd(self.key_prefix + 'workers', {self.worker_id: now})
+            pipe.zremrangebyscore(self.key_prefix + 'workers', '-inf', now - ttl)
+            pipe.execute()
+        except Exception as e:
+            # Keep the deltas for the next attempt instead of losing them
+            with self._lock:
+                for field, amount in deltas.items():
+                    self._deltas[field] = self._deltas.get(field, 0) + amount
+            print(f"⚠️ Metrics flush failed: {e}")
+
+    # ----- exposition -----
+
+    def _collect(self):
+        """Fleet-wide {(name, labels, suffix): value} and {(name, labels): gauge}"""
+        self.flush()
+        values = {}
+        gauges = {}
+
+        if self.redis is None:
+            with self._lock:
+                values = dict(self._deltas)
+            for field, value in self._gauge_values().items():
+                name, label_values = json.loads(field)
+                gauges[(name, tuple(label_values))] = value
+            return values, gauges
+
+        for field, value in self.redis.hgetall(self.key_prefix + 'values').items():
+            name, label_values, suffix = json.loads(field)
+            values[(name, tuple(label_values), suffix)] = float(value)
+
+        workers = self.redis.zrangebyscore(self.key_prefix + 'workers', time.time() - self.flush_interval * 3, '+inf')
+        if workers:
+            pipe = self.redis.pipeline(transaction=False)
+            for worker in workers:
+                worker = worker.decode('utf-8') if isinstance(worker, bytes) else worker
+                pipe.hgetall(f"{self.key_prefix}gauges:{worker}")
+            for worker_gauges in pipe.execute():
+                for field, value in worker_gauges.items():
+                    name, label_values = json.loads(field)
+                    key = (name, tuple(label_values))
+                    gauges[key] = gauges.get(key, 0) + float(value)
+        return values, gauges
+
+    def render(self):
+        """OpenMetrics text exposition of every registered metric"""
+        values, gauges = self._collect()
+        lines = []
+
+        for metric in self.metrics.values():
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.append(f"# HELP {metric.name} {metric.help}")
+
+            if metric.kind == 'gauge':
+                for (name, label_values), value in sorted(gauges.items()):
+                    if name == metric.name:
+                        lines.append(f"{name}{_format_labels(metric.labelnames, label_values)} {_format_value(value)}")
+                continue
+
+            series = {}
+            for (name, label_values, suffix), value in values.items():
+                if name == metric.name:
+                    series.setdefault(label_values, {})[suffix] = value
+
+            for label_values, fields in sorted(series.items()):
+                labels = _format_labels(metric.labelnames, label_values)
+                if metric.kind == 'counter':
+                    lines.append(f"{metric.name}_total{labels} {_format_value(fields.get('', 0))}")
+                    continue
+
+                cumulative = 0
+                for index, bound in enumerate(metric.buckets + (math.inf,)):
+                    cumulative += fields.get(f'bucket:{index}', 0)
+                    le = '+Inf' if bound == math.inf else repr(float(bound))
+                    lines.append(f"{metric.name}_bucket{_format_labels(metric.labelnames, label_values, ('le', le))} {_format_value(cumulative)}")
+                lines.append(f"{metric.name}_sum{labels} {_format_value(fields.get('sum', 0))}")
+                lines.append(f"{metric.name}_count{labels} {_format_value(fields.get('count', 0))}")
+
+        lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+# Global metrics registry with the metric families Hexashop exports
+metrics_registry = MetricsRegistry()
+metrics_registry.histogram('hexashop_http_request_duration_seconds', 'HTTP request latency',
+                           labels=('endpoint', 'method', 'status'))
+metrics_registry.counter('hexashop_cache_events', 'Product cache hits, misses and invalidated keys',
+                         labels=('namespace', 'event'))
+metrics_registry.gauge('hexashop_db_pool_connections', 'SQLAlchemy pool connections by state (summed over workers)',
+                       labels=('state',))
+metrics_registry.histogram('hexashop_redis_command_duration_seconds', 'Redis command round-trip time',
+                           labels=('tier',), buckets=REDIS_BUCKETS)
+metrics_registry.histogram('hexashop_backup_duration_seconds', 'Database backup job duration',
+                           labels=('type', 'status'), buckets=BACKUP_BUCKETS)
+metrics_registry.histogram('hexashop_backup_verify_duration_seconds', 'Backup restore-test duration',
+                           labels=('status',), buckets=BACKUP_BUCKETS)
+metrics_registry.histogram('hexashop_scheduler_job_duration_seconds', 'Scheduled job run duration',
+                           labels=('job', 'status'))
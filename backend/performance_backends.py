@@ -0,0 +1,383 @@
+"""
+Fleet-wide Performance Aggregation for Hexashop
+Merges every worker's PerformanceMonitor data through periodic Redis flushes
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from performance_monitor import BUCKET_COUNT, LatencyHistogram, LocalBackend
+
+REQUEST_SLOT_SECONDS = 60       # Fleet request and query histograms per minute
+ENDPOINT_SLOT_SECONDS = 300     # Per-endpoint histograms per 5 minutes
+WINDOW_SECONDS = 3600           # Summaries cover the last hour
+KEY_TTL = 7200                  # Slot hashes outlive the window they feed
+RECENT_REQUESTS = 1000          # Shared recent-requests list length
+MAX_PENDING_VISITORS = 10000    # Distinct clients buffered between flushes
+SYSTEM_TTL = 180                # Host samples (and the sampler lease) expire after 3 missed minutes
+
+# HSET each field only when the new value is larger (or the field is
+# missing). Minimums are stored negated so one script serves both.
+HASH_MAX_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local current = redis.call('HGET', KEYS[1], ARGV[i])
+    if not current or tonumber(ARGV[i + 1]) > tonumber(current) then
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 0
+"""
+
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _merge_histogram_fields(raw, into):
+    """
+    Fold one Redis slot hash into {prefix: [histogram, errors, slow]}.
+    Fields are '<prefix>|<name>' where name is b<bucket>, count, sum,
+    max, negmin, errors or slow; the prefix is empty for fleet totals.
+    """
+    for field, value in raw.items():
+        prefix, _sep, name = _text(field).rpartition('|')
+        entry = into.get(prefix)
+        if entry is None:
+            entry = into[prefix] = [LatencyHistogram(), 0, 0]
+        histogram = entry[0]
+
+        if name[:1] == 'b' and name[1:].isdigit():
+            index = int(name[1:])
+            if index < BUCKET_COUNT:
+                histogram.counts[index] += int(value)
+        elif name == 'count':
+            histogram.count += int(value)
+        elif name == 'sum':
+            histogram.total += float(value)
+        elif name == 'max':
+            histogram.max = max(histogram.max, float(value))
+        elif name == 'negmin':
+            minimum = -float(value)
+            histogram.min = minimum if histogram.min == 0 else min(histogram.min, minimum)
+        elif name == 'errors':
+            entry[1] += int(value)
+        elif name == 'slow':
+            entry[2] += int(value)
+    return into
+
+
+class RedisMonitorBackend(LocalBackend):
+    """
+    Each worker buffers histogram deltas, endpoint totals, recent requests
+    and visitor ids in memory; the metrics flush thread pushes them to
+    Redis in one pipeline every METRICS_FLUSH_INTERVAL seconds. Recording
+    is a couple of array increments under a lock - Redis is never touched
+    on the request path.
+
+    Summaries read the last hour of slot hashes back and merge them, so
+    /api/performance/* report the whole fleet whichever worker answers.
+    Unique visitors are counted with one HyperLogLog per day.
+    """
+    scope = 'fleet'
+
+    def __init__(self, redis, key_prefix='hexashop:perf:', flush_interval=10):
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.flush_interval = flush_interval
+        self.hostname = socket.gethostname()
+        self._hash_max = redis.register_script(HASH_MAX_SCRIPT)
+        self._lock = threading.Lock()
+        self._reset_pending()
+
+    @property
+    def worker_id(self):
+        return f"{self.hostname}:{os.getpid()}"
+
+    def _reset_pending(self):
+        self._histograms = {}   # (key, prefix) -> [histogram, errors, slow]
+        self._totals = {}       # field -> amount (lifetime endpoint totals)
+        self._maxima = {}       # field -> value
+        self._recent = deque(maxlen=RECENT_REQUESTS)
+        self._visitors = set()
+        self._n_plus_one = {}   # key -> suspects
+
+    def _histogram(self, key, prefix):
+        entry = self._histograms.get((key, prefix))
+        if entry is None:
+            entry = self._histograms[(key, prefix)] = [LatencyHistogram(), 0, 0]
+        return entry
+
+    def _record(self, key, prefix, seconds, is_error=False, is_slow=False):
+        entry = self._histogram(key, prefix)
+        entry[0].record(seconds)
+        if is_error:
+            entry[1] += 1
+        if is_slow:
+            entry[2] += 1
+
+    # ----- recording (request path) -----
+
+    def record_request(self, now, endpoint, method, duration, status_code,
+                       query_count, is_error, is_slow, client=None):
+        if endpoint.startswith('/'):
+            # Unmatched raw paths would grow the lifetime hash without bound
+            endpoint = 'unmatched'
+        minute_key = f"{self.key_prefix}req:{int(now // REQUEST_SLOT_SECONDS)}"
+        endpoint_key = f"{self.key_prefix}ep:{int(now // ENDPOINT_SLOT_SECONDS)}"
+
+        with self._lock:
+            # Fleet minutes feed the availability SLO: only 5xx count as errors there
+            self._record(minute_key, '', duration, status_code >= 500, is_slow)
+            self._record(endpoint_key, endpoint, duration, is_error, is_slow)
+
+            totals = self._totals
+            for name, amount in (('count', 1), ('time', duration), ('errors', int(is_error)),
+                                 ('slow', int(is_slow)), ('queries', query_count)):
+                field = f"{endpoint}|{name}"
+                totals[field] = totals.get(field, 0) + amount
+            field = f"{endpoint}|max_queries"
+            self._maxima[field] = max(self._maxima.get(field, 0), query_count)
+
+            self._recent.append((now, endpoint, method, round(duration, 6), status_code))
+            if client and len(self._visitors) < MAX_PENDING_VISITORS:
+                self._visitors.add(client)
+
+    def record_query(self, now, duration, is_slow):
+        with self._lock:
+            self._record(f"{self.key_prefix}db:{int(now // REQUEST_SLOT_SECONDS)}", 'q', duration,
+                         is_slow=is_slow)
+
+    def record_pool_wait(self, now, seconds):
+        with self._lock:
+            self._record(f"{self.key_prefix}db:{int(now // REQUEST_SLOT_SECONDS)}", 'w', seconds)
+
+    def record_n_plus_one(self, now):
+        key = f"{self.key_prefix}db:{int(now // REQUEST_SLOT_SECONDS)}"
+        with self._lock:
+            self._n_plus_one[key] = self._n_plus_one.get(key, 0) + 1
+
+    # ----- flushing (background thread) -----
+
+    def flush(self):
+        """Push buffered deltas to Redis in one pipeline"""
+        with self._lock:
+            histograms, totals, maxima = self._histograms, self._totals, self._maxima
+            recent, visitors, n_plus_one = self._recent, self._visitors, self._n_plus_one
+            self._reset_pending()
+
+        now = time.time()
+        pipe = self.redis.pipeline(transaction=False)
+        expiring = set()
+
+        for (key, prefix), (histogram, errors, slow) in histograms.items():
+            field = f"{prefix}|"
+            for index, value in enumerate(histogram.counts):
+                if value:
+                    pipe.hincrby(key, f"{field}b{index}", value)
+            pipe.hincrby(key, f"{field}count", histogram.count)
+            pipe.hincrbyfloat(key, f"{field}sum", histogram.total)
+            if errors:
+                pipe.hincrby(key, f"{field}errors", errors)
+            if slow:
+                pipe.hincrby(key, f"{field}slow", slow)
+            self._hash_max(keys=[key], args=[f"{field}max", histogram.max, f"{field}negmin", -histogram.min],
+                           client=pipe)
+            expiring.add(key)
+
+        for key, suspects in n_plus_one.items():
+            pipe.hincrby(key, 'n|count', suspects)
+            expiring.add(key)
+
+        for key in expiring:
+            pipe.expire(key, KEY_TTL)
+
+        endpoints_key = self.key_prefix + 'endpoints'
+        for field, amount in totals.items():
+            if isinstance(amount, float):
+                pipe.hincrbyfloat(endpoints_key, field, amount)
+            elif amount:
+                pipe.hincrby(endpoints_key, field, amount)
+        if maxima:
+            self._hash_max(keys=[endpoints_key], args=[item for pair in maxima.items() for item in pair],
+                           client=pipe)
+
+        if recent:
+            pipe.lpush(self.key_prefix + 'recent', *[json.dumps(entry) for entry in recent])
+            pipe.ltrim(self.key_prefix + 'recent', 0, RECENT_REQUESTS - 1)
+
+        if visitors:
+            visitors_key = f"{self.key_prefix}visitors:{datetime.utcfromtimestamp(now):%Y%m%d}"
+            pipe.pfadd(visitors_key, *visitors)
+            pipe.expire(visitors_key, 2 * 86400)
+
+        pipe.zadd(self.key_prefix + 'workers', {self.worker_id: now})
+        pipe.zremrangebyscore(self.key_prefix + 'workers', '-inf', now - self.flush_interval * 3)
+
+        try:
+            pipe.execute()
+        except Exception as e:
+            # Dropped rather than re-queued so a Redis outage cannot grow worker memory
+            print(f"⚠️ Performance flush failed: {e}")
+
+    # ----- system sampling -----
+
+    def should_sample_system(self):
+        """Hold the per-host lease so only one worker publishes host readings"""
+        key = f"{self.key_prefix}sampler:{self.hostname}"
+        try:
+            if self.redis.set(key, self.worker_id, nx=True, ex=SYSTEM_TTL):
+                return True
+            if _text(self.redis.get(key)) == self.worker_id:
+                self.redis.expire(key, SYSTEM_TTL)
+                return True
+            return False
+        except Exception:
+            return True
+
+    def publish_system(self, sample):
+        now = time.time()
+        key = f"{self.key_prefix}system:{self.hostname}"
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(key, mapping=sample)
+            pipe.expire(key, SYSTEM_TTL)
+            pipe.zadd(self.key_prefix + 'hosts', {self.hostname: now})
+            pipe.zremrangebyscore(self.key_prefix + 'hosts', '-inf', now - SYSTEM_TTL)
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Could not publish system metrics: {e}")
+
+    # ----- reading -----
+
+    def snapshot(self, now):
+        """Merge the fleet's last hour - O(slots * buckets) Redis reads in two round-trips"""
+        self.flush()
+
+        minute = int(now // REQUEST_SLOT_SECONDS)
+        slot = int(now // ENDPOINT_SLOT_SECONDS)
+        minutes = range(minute - WINDOW_SECONDS // REQUEST_SLOT_SECONDS + 1, minute + 1)
+        slots = range(slot - WINDOW_SECONDS // ENDPOINT_SLOT_SECONDS + 1, slot + 1)
+
+        pipe = self.redis.pipeline(transaction=False)
+        for m in minutes:
+            pipe.hgetall(f"{self.key_prefix}req:{m}")
+        for s in slots:
+            pipe.hgetall(f"{self.key_prefix}ep:{s}")
+        for m in minutes:
+            pipe.hgetall(f"{self.key_prefix}db:{m}")
+        pipe.hgetall(self.key_prefix + 'endpoints')
+        pipe.zcount(self.key_prefix + 'workers', now - self.flush_interval * 3, '+inf')
+        pipe.zrangebyscore(self.key_prefix + 'hosts', now - SYSTEM_TTL, '+inf')
+        pipe.pfcount(f"{self.key_prefix}visitors:{datetime.utcfromtimestamp(now):%Y%m%d}")
+        results = pipe.execute()
+
+        request_hashes = results[:len(minutes)]
+        endpoint_hashes = results[len(minutes):len(minutes) + len(slots)]
+        db_hashes = results[len(minutes) + len(slots):2 * len(minutes) + len(slots)]
+        lifetime, workers, hosts, visitors = results[2 * len(minutes) + len(slots):]
+
+        requests = {}
+        for raw in request_hashes[-5:]:
+            _merge_histogram_fields(raw, requests)
+        last_five, five_errors, five_slow = requests.get('', [LatencyHistogram(), 0, 0])
+        requests = {}
+        for raw in request_hashes:
+            _merge_histogram_fields(raw, requests)
+        last_hour, hour_errors, hour_slow = requests.get('', [LatencyHistogram(), 0, 0])
+        last_minute = _merge_histogram_fields(request_hashes[-1], {}).get('', [LatencyHistogram()])[0]
+
+        database = {}
+        for raw in db_hashes:
+            _merge_histogram_fields(raw, database)
+        queries, _errors, slow_query_count = database.get('q', [LatencyHistogram(), 0, 0])
+        pool_waits = database.get('w', [LatencyHistogram()])[0]
+        n_plus_one_count = database.get('n', [LatencyHistogram()])[0].count
+
+        totals = {}
+        for field, value in lifetime.items():
+            endpoint, _sep, name = _text(field).rpartition('|')
+            totals.setdefault(endpoint, {'count': 0, 'time': 0.0, 'errors': 0, 'slow': 0,
+                                         'queries': 0, 'max_queries': 0})[name] = float(value)
+        for endpoint_totals in totals.values():
+            for name in ('count', 'errors', 'slow', 'queries', 'max_queries'):
+                endpoint_totals[name] = int(endpoint_totals[name])
+
+        top = sorted(totals.items(), key=lambda item: item[1]['count'], reverse=True)[:10]
+        recent = {}
+        for raw in endpoint_hashes:
+            _merge_histogram_fields(raw, recent)
+        endpoints = [
+            (endpoint, endpoint_totals, recent.get(endpoint, [LatencyHistogram()])[0])
+            for endpoint, endpoint_totals in top
+        ]
+
+        return {
+            'scope': self.scope,
+            'workers': workers,
+            'last_hour': last_hour,
+            'last_minute': last_minute,
+            'total_requests': sum(t['count'] for t in totals.values()),
+            'total_errors': sum(t['errors'] for t in totals.values()),
+            'endpoints': endpoints,
+            'queries': queries,
+            'slow_query_count': slow_query_count,
+            'pool_waits': pool_waits,
+            'n_plus_one_count': n_plus_one_count,
+            'unique_visitors_today': visitors,
+            'slo_windows': {
+                '5m': (last_five.count, five_errors, five_slow),
+                '1h': (last_hour.count, hour_errors, hour_slow)
+            },
+            'system': self._fleet_system([_text(host) for host in hosts])
+        }
+
+    def _fleet_system(self, hosts):
+        """Busiest host's readings (health checks care about the worst one) plus per-host detail"""
+        system = {'cpu_percent': 0, 'memory_percent': 0, 'memory_used_gb': 0, 'memory_total_gb': 0,
+                  'hosts': {}}
+        if not hosts:
+            return system
+
+        pipe = self.redis.pipeline(transaction=False)
+        for host in hosts:
+            pipe.hgetall(f"{self.key_prefix}system:{host}")
+        for host, raw in zip(hosts, pipe.execute()):
+            if not raw:
+                continue
+            sample = {_text(field): float(value) for field, value in raw.items()}
+            system['hosts'][host] = sample
+            if sample.get('cpu_percent', 0) >= system['cpu_percent']:
+                system['cpu_percent'] = sample.get('cpu_percent', 0)
+            if sample.get('memory_percent', 0) >= system['memory_percent']:
+                system.update({name: sample.get(name, 0)
+                               for name in ('memory_percent', 'memory_used_gb', 'memory_total_gb')})
+        return system
+
+    def recent_requests(self, limit):
+        try:
+            self.flush()
+            entries = self.redis.lrange(self.key_prefix + 'recent', 0, limit - 1)
+        except Exception as e:
+            print(f"⚠️ Fleet recent requests unavailable: {e}")
+            return None
+
+        requests = []
+        for entry in reversed(entries):
+            ts, endpoint, method, duration, status = json.loads(entry)
+            requests.append({
+                'timestamp': datetime.utcfromtimestamp(ts).isoformat(),
+                'endpoint': endpoint,
+                'method': method,
+                'duration': duration,
+                'status': status
+            })
+        return requests
+
+    def recent_request_count(self):
+        try:
+            return self.redis.llen(self.key_prefix + 'recent')
+        except Exception:
+            return None
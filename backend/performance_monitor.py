@@ -2,29 +2,255 @@
 Performance Monitoring for Hexashop
 Real-time monitoring of API performance, database queries, and system health
 """
+import math
+import os
 import time
-import psutil
 import threading
-from datetime import datetime, timedelta
+from array import array
+from datetime import datetime
 from collections import deque
 import json
+from slo import evaluate_slos
+from system_sampler import DEFAULT_INTERVAL, SystemSampler
+
+# Log-bucketed latency histograms: bucket i (i >= 1) covers
+# [HISTOGRAM_MIN * GROWTH**(i-1), HISTOGRAM_MIN * GROWTH**i), bucket 0 holds
+# anything faster than HISTOGRAM_MIN and the last bucket anything slower
+# than HISTOGRAM_MAX. A 1.08 growth factor keeps quantiles within ~4%.
+HISTOGRAM_MIN = 0.0001      # 100 microseconds
+HISTOGRAM_MAX = 120.0       # 2 minutes
+HISTOGRAM_GROWTH = 1.08
+_LOG_GROWTH = math.log(HISTOGRAM_GROWTH)
+BUCKET_COUNT = int(math.ceil(math.log(HISTOGRAM_MAX / HISTOGRAM_MIN) / _LOG_GROWTH)) + 2
+
+SLOW_REQUEST_THRESHOLD = 1.0  # seconds
+SLOW_QUERY_THRESHOLD = 0.5    # seconds
+N_PLUS_ONE_THRESHOLD = 5      # Same statement this many times in one request
+MAX_QUERY_FINGERPRINTS = 500  # Distinct statements tracked before folding into '<other>'
+QUANTILES = (('p50', 0.50), ('p90', 0.90), ('p99', 0.99), ('p999', 0.999))
+
+
+def bucket_index(seconds):
+    """Histogram bucket for a duration in seconds"""
+    if seconds < HISTOGRAM_MIN:
+        return 0
+    index = int(math.log(seconds / HISTOGRAM_MIN) / _LOG_GROWTH) + 1
+    return min(index, BUCKET_COUNT - 1)
+
+
+def bucket_value(index):
+    """Representative duration (geometric midpoint) of a bucket"""
+    if index == 0:
+        return HISTOGRAM_MIN
+    return HISTOGRAM_MIN * HISTOGRAM_GROWTH ** (index - 1) * math.sqrt(HISTOGRAM_GROWTH)
+
+
+class LatencyHistogram:
+    """Fixed-size, array-backed latency histogram (not thread-safe on its own)"""
+    __slots__ = ('counts', 'count', 'total', 'max', 'min')
+
+    def __init__(self):
+        self.counts = array('Q', bytes(8 * BUCKET_COUNT))
+        self.reset()
+
+    def reset(self):
+        for i in range(BUCKET_COUNT):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.min = 0.0
+
+    def record(self, seconds):
+        self.counts[bucket_index(seconds)] += 1
+        if self.count == 0 or seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.count += 1
+        self.total += seconds
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        counts = self.counts
+        for i, value in enumerate(other.counts):
+            if value:
+                counts[i] += value
+        self.min = other.min if self.count == 0 else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile in seconds - O(buckets)"""
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(q * self.count)))
+        seen = 0
+        for i, value in enumerate(self.counts):
+            seen += value
+            if seen >= rank:
+                return min(max(bucket_value(i), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def quantiles_ms(self):
+        return {name: round(self.quantile(q) * 1000, 2) for name, q in QUANTILES}
+
+
+class RollingHistogram:
+    """Ring of per-slot histograms covering the last `slots * slot_seconds` seconds"""
+
+    def __init__(self, slots, slot_seconds):
+        self.slots = slots
+        self.slot_seconds = slot_seconds
+        self.slot_ids = [-1] * slots
+        self.histograms = [LatencyHistogram() for _ in range(slots)]
+        self.errors = array('Q', bytes(8 * slots))
+        self.slow = array('Q', bytes(8 * slots))
+
+    def _slot(self, now):
+        slot_id = int(now // self.slot_seconds)
+        position = slot_id % self.slots
+        if self.slot_ids[position] != slot_id:
+            self.slot_ids[position] = slot_id
+            self.histograms[position].reset()
+            self.errors[position] = 0
+            self.slow[position] = 0
+        return position
+
+    def record(self, now, seconds, is_error=False, is_slow=False):
+        position = self._slot(now)
+        self.histograms[position].record(seconds)
+        if is_error:
+            self.errors[position] += 1
+        if is_slow:
+            self.slow[position] += 1
+
+    def window(self, seconds, now):
+        """Merge the slots inside the last `seconds` into (histogram, errors, slow)"""
+        newest = int(now // self.slot_seconds)
+        oldest = newest - max(1, int(math.ceil(seconds / self.slot_seconds))) + 1
+        merged = LatencyHistogram()
+        errors = slow = 0
+        for position, slot_id in enumerate(self.slot_ids):
+            if oldest <= slot_id <= newest:
+                merged.merge(self.histograms[position])
+                errors += self.errors[position]
+                slow += self.slow[position]
+        return merged, errors, slow
+
+
+class EndpointStats:
+    __slots__ = ('count', 'total_time', 'errors', 'slow_count', 'queries', 'max_queries', 'recent')
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.errors = 0
+        self.slow_count = 0
+        self.queries = 0
+        self.max_queries = 0
+        # Last hour in 5-minute slots
+        self.recent = RollingHistogram(slots=12, slot_seconds=300)
+
+
+class QueryStats:
+    __slots__ = ('count', 'total_time', 'max_time', 'rows', 'sample')
+
+    def __init__(self, sample):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.sample = sample
+
+    def to_dict(self, fingerprint):
+        return {
+            'fingerprint': fingerprint,
+            'sample': self.sample,
+            'count': self.count,
+            'total_time_ms': round(self.total_time * 1000, 2),
+            'avg_time_ms': round(self.total_time / self.count * 1000, 2) if self.count else 0,
+            'max_time_ms': round(self.max_time * 1000, 2),
+            'rows': self.rows,
+            'avg_rows': round(self.rows / self.count, 1) if self.count else 0
+        }
+
+
+class LocalBackend:
+    """
+    Default backend: keeps nothing beyond the worker's own state, so
+    summaries describe the worker that answered the request.
+    """
+    scope = 'worker'
+
+    def record_request(self, now, endpoint, method, duration, status_code,
+                       query_count, is_error, is_slow, client=None):
+        pass
+
+    def record_query(self, now, duration, is_slow):
+        pass
+
+    def record_pool_wait(self, now, seconds):
+        pass
+
+    def record_n_plus_one(self, now):
+        pass
+
+    def should_sample_system(self):
+        """Whether this worker publishes the host's system readings"""
+        return True
+
+    def publish_system(self, sample):
+        pass
+
+    def snapshot(self, now):
+        """Fleet-wide snapshot, or None to summarize this worker only"""
+        return None
+
+    def recent_requests(self, limit):
+        """Fleet-wide recent requests (newest last), or None for this worker's"""
+        return None
+
+    def recent_request_count(self):
+        return None
+
 
 class PerformanceMonitor:
     def __init__(self, app=None):
         self.app = app
-        self.request_times = deque(maxlen=1000)  # Last 1000 requests
+        self._lock = threading.Lock()
+        self.backend = LocalBackend()
+
+        # Last 1000 requests as compact tuples: (epoch, endpoint, method, duration, status)
+        self.request_times = deque(maxlen=1000)
         self.endpoint_stats = {}
-        self.slow_requests = []  # Requests taking > 1 second
+        self.slow_requests = deque(maxlen=50)  # Requests taking > 1 second
         self.error_counts = {}
+
+        # Fleet of latency histograms: last hour in 1-minute slots
+        self.request_window = RollingHistogram(slots=60, slot_seconds=60)
         
-        # System metrics
-        self.cpu_usage = []
-        self.memory_usage = []
-        self.disk_io = []
+        # System metrics: 1s/10s/1m/1h ring buffers
+        self.system = SystemSampler(float(os.environ.get('SYSTEM_SAMPLE_INTERVAL', DEFAULT_INTERVAL)))
         
-        # Database metrics
-        self.query_times = []
-        self.slow_queries = []
+        # Database metrics (fed by query_instrumentation)
+        self.query_window = RollingHistogram(slots=60, slot_seconds=60)
+        self.pool_wait_window = RollingHistogram(slots=60, slot_seconds=60)
+        self.query_stats = {}
+        self.slow_queries = deque(maxlen=20)
+        self.n_plus_one = deque(maxlen=50)
+
+        # get_health_status() is public and probed often: serve one snapshot per interval
+        self.health_ttl = float(os.environ.get('PERFORMANCE_HEALTH_TTL', 5))
+        self._health_lock = threading.Lock()
+        self._health = None
+        self._health_at = 0.0
         
         # Start monitoring thread
         self.monitoring_active = True
@@ -33,219 +259,335 @@ class PerformanceMonitor:
     
     def init_app(self, app):
         self.app = app
+
+    def set_backend(self, backend):
+        """Aggregate across workers through `backend` (see performance_backends)"""
+        self.backend = backend
     
-    def record_request(self, endpoint, method, duration, status_code):
-        """Record API request performance"""
-        timestamp = datetime.utcnow()
-        
-        # Record request time
-        self.request_times.append({
-            'timestamp': timestamp.isoformat(),
-            'endpoint': endpoint,
-            'method': method,
-            'duration': duration,
-            'status': status_code
-        })
-        
-        # Track endpoint statistics
-        if endpoint not in self.endpoint_stats:
-            self.endpoint_stats[endpoint] = {
-                'count': 0,
-                'total_time': 0,
-                'avg_time': 0,
-                'errors': 0,
-                'slow_count': 0
-            }
-        
-        stats = self.endpoint_stats[endpoint]
-        stats['count'] += 1
-        stats['total_time'] += duration
-        stats['avg_time'] = stats['total_time'] / stats['count']
-        
-        if duration > 1.0:  # Slow request threshold (1 second)
-            stats['slow_count'] += 1
-            self.slow_requests.append({
-                'timestamp': timestamp.isoformat(),
+    def record_request(self, endpoint, method, duration, status_code, queries=None, client=None, queue_wait=0.0):
+        """
+        Record API request performance (queries: per-fingerprint counts for this request).
+        queue_wait is time spent waiting for an admission slot; it is left out of the
+        window behind pressure(), so queueing never reads as more overload.
+        """
+        now = time.time()
+        is_error = status_code >= 400
+        is_slow = duration > SLOW_REQUEST_THRESHOLD
+        service_time = duration - queue_wait
+        query_count = sum(queries.values()) if queries else 0
+        repeated = [(fp, n) for fp, n in queries.items() if n >= N_PLUS_ONE_THRESHOLD] if queries else []
+
+        with self._lock:
+            self.request_times.append((now, endpoint, method, duration, status_code))
+            # The fleet window feeds the availability SLO, so only 5xx count as errors there
+            self.request_window.record(now, service_time, status_code >= 500,
+                                       service_time > SLOW_REQUEST_THRESHOLD)
+
+            stats = self.endpoint_stats.get(endpoint)
+            if stats is None:
+                stats = self.endpoint_stats[endpoint] = EndpointStats()
+            stats.count += 1
+            stats.total_time += duration
+            stats.queries += query_count
+            stats.max_queries = max(stats.max_queries, query_count)
+            stats.recent.record(now, duration, is_error, is_slow)
+
+            for query_fingerprint, executions in repeated:
+                self.n_plus_one.append((now, endpoint, query_fingerprint, executions))
+
+            if is_slow:
+                stats.slow_count += 1
+                self.slow_requests.append((now, endpoint, method, duration))
+
+            if is_error:
+                stats.errors += 1
+
+        self.backend.record_request(now, endpoint, method, duration, status_code,
+                                    query_count, is_error, is_slow, client)
+        for _repeated in repeated:
+            self.backend.record_n_plus_one(now)
+
+    def recent_requests(self, limit=50):
+        """Most recent requests, newest last"""
+        fleet = self.backend.recent_requests(limit)
+        if fleet is not None:
+            return fleet
+
+        with self._lock:
+            recent = list(self.request_times)[-limit:]
+        return [
+            {
+                'timestamp': datetime.utcfromtimestamp(ts).isoformat(),
                 'endpoint': endpoint,
+                'method': method,
                 'duration': duration,
-                'method': method
-            })
-            # Keep only last 50 slow requests
-            if len(self.slow_requests) > 50:
-                self.slow_requests.pop(0)
-        
-        if status_code >= 400:
-            stats['errors'] += 1
+                'status': status
+            }
+            for ts, endpoint, method, duration, status in recent
+        ]
+
+    def recent_request_count(self):
+        """Requests held in the recent-requests buffer (at most 1000)"""
+        fleet = self.backend.recent_request_count()
+        if fleet is not None:
+            return fleet
+        with self._lock:
+            return len(self.request_times)
     
     def record_error(self, endpoint, error_type, error_message):
         """Record application errors"""
-        if endpoint not in self.error_counts:
-            self.error_counts[endpoint] = {}
-        
-        if error_type not in self.error_counts[endpoint]:
-            self.error_counts[endpoint][error_type] = 0
-        
-        self.error_counts[endpoint][error_type] += 1
+        with self._lock:
+            errors = self.error_counts.setdefault(endpoint, {})
+            errors[error_type] = errors.get(error_type, 0) + 1
     
-    def record_query(self, query, duration):
+    def record_query(self, query, duration, rows=None, query_fingerprint=None):
         """Record database query performance"""
-        self.query_times.append({
-            'timestamp': datetime.utcnow().isoformat(),
-            'duration': duration,
-            'query': query[:200]  # Store first 200 chars
-        })
-        
-        # Keep only last 100 queries
-        if len(self.query_times) > 100:
-            self.query_times.pop(0)
-        
-        # Track slow queries (> 0.5 seconds)
-        if duration > 0.5:
-            self.slow_queries.append({
-                'timestamp': datetime.utcnow().isoformat(),
-                'duration': duration,
-                'query': query[:200]
+        now = time.time()
+        key = query_fingerprint or query[:200]
+        is_slow = duration > SLOW_QUERY_THRESHOLD
+        self.backend.record_query(now, duration, is_slow)
+
+        with self._lock:
+            self.query_window.record(now, duration, is_slow=is_slow)
+
+            stats = self.query_stats.get(key)
+            if stats is None:
+                if len(self.query_stats) >= MAX_QUERY_FINGERPRINTS:
+                    key = '<other>'
+                    stats = self.query_stats.get(key)
+                if stats is None:
+                    stats = self.query_stats[key] = QueryStats(query[:200])
+            stats.count += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            if rows:
+                stats.rows += rows
+
+            # Track slow queries (> 0.5 seconds)
+            if is_slow:
+                self.slow_queries.append({
+                    'timestamp': datetime.utcfromtimestamp(now).isoformat(),
+                    'duration': duration,
+                    'query': query[:200],
+                    'fingerprint': key,
+                    'rows': rows
+                })
+
+    def record_pool_wait(self, seconds):
+        """Record how long a request waited for a database connection"""
+        now = time.time()
+        self.backend.record_pool_wait(now, seconds)
+        with self._lock:
+            self.pool_wait_window.record(now, seconds)
+
+    def pressure(self, now=None):
+        """This worker's last-minute latency and pool-wait p99, for admission control"""
+        now = now or time.time()
+        with self._lock:
+            recent, _errors, _slow = self.request_window.window(60, now)
+            pool_waits, _errors, _slow = self.pool_wait_window.window(60, now)
+        return {
+            'requests': recent.count,
+            'p99_ms': round(recent.quantile(0.99) * 1000, 2),
+            'pool_checkouts': pool_waits.count,
+            'pool_wait_p99_ms': round(pool_waits.quantile(0.99) * 1000, 2)
+        }
+
+    def get_query_report(self, limit=10):
+        """Slow queries, top statements by total time and N+1 suspects"""
+        with self._lock:
+            slow_queries = list(self.slow_queries)
+            top = sorted(self.query_stats.items(), key=lambda item: item[1].total_time, reverse=True)[:limit]
+            top_queries = [stats.to_dict(fp) for fp, stats in top]
+            n_plus_one = list(self.n_plus_one)
+
+        suspects = {}
+        for ts, endpoint, query_fingerprint, executions in n_plus_one:
+            suspect = suspects.setdefault((endpoint, query_fingerprint), {
+                'endpoint': endpoint,
+                'fingerprint': query_fingerprint,
+                'occurrences': 0,
+                'max_executions_per_request': 0,
+                'last_seen': None
             })
-            # Keep only last 20 slow queries
-            if len(self.slow_queries) > 20:
-                self.slow_queries.pop(0)
+            suspect['occurrences'] += 1
+            suspect['max_executions_per_request'] = max(suspect['max_executions_per_request'], executions)
+            suspect['last_seen'] = datetime.utcfromtimestamp(ts).isoformat()
+
+        return {
+            'slow_queries': slow_queries,
+            'total_slow_queries': len(slow_queries),
+            'top_queries': top_queries,
+            'n_plus_one': sorted(suspects.values(), key=lambda x: x['occurrences'], reverse=True)
+        }
     
     def _monitor_system(self):
-        """Background thread to monitor system resources"""
+        """Background thread sampling system resources without blocking"""
+        next_publish = 0
         while self.monitoring_active:
             try:
-                # CPU usage
-                cpu_percent = psutil.cpu_percent(interval=1)
-                self.cpu_usage.append({
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'percent': cpu_percent
-                })
-                
-                # Memory usage
-                memory = psutil.virtual_memory()
-                self.memory_usage.append({
-                    'timestamp': datetime.utcnow().isoformat(),
-                    'percent': memory.percent,
-                    'used_gb': memory.used / (1024**3),
-                    'total_gb': memory.total / (1024**3)
-                })
-                
-                # Disk I/O
-                disk_io = psutil.disk_io_counters()
-                if disk_io:
-                    self.disk_io.append({
-                        'timestamp': datetime.utcnow().isoformat(),
-                        'read_mb': disk_io.read_bytes / (1024**2),
-                        'write_mb': disk_io.write_bytes / (1024**2)
-                    })
-                
-                # Keep only last 60 data points (1 minute per point = 1 hour)
-                for metric_list in [self.cpu_usage, self.memory_usage, self.disk_io]:
-                    if len(metric_list) > 60:
-                        metric_list.pop(0)
-                
-                # Sleep for monitoring interval
-                time.sleep(60)  # Check every minute
-                
+                self.system.sample()
+
+                # Host readings go to the fleet view once a minute, from one worker per host
+                now = time.time()
+                if now >= next_publish:
+                    next_publish = now + 60
+                    if self.backend.should_sample_system():
+                        self.backend.publish_system(self._system_sample())
             except Exception as e:
                 print(f"⚠️ Performance monitoring error: {e}")
-                time.sleep(60)
+            time.sleep(self.system.interval)
+
+    def _system_sample(self):
+        """Latest system readings of this worker"""
+        latest = self.system.current or {}
+        return {
+            'cpu_percent': round(latest.get('cpu_percent', 0), 1),
+            'memory_percent': round(latest.get('memory_percent', 0), 1),
+            'memory_used_gb': latest.get('memory_used_gb', 0),
+            'memory_total_gb': latest.get('memory_total_gb', 0)
+        }
+
+    def _local_snapshot(self, now):
+        """This worker's windows and totals, in the shape _summarize expects"""
+        with self._lock:
+            last_hour, hour_errors, hour_slow = self.request_window.window(3600, now)
+            last_five, five_errors, five_slow = self.request_window.window(300, now)
+            last_minute, _errors, _slow = self.request_window.window(60, now)
+            queries, _errors, slow_query_count = self.query_window.window(3600, now)
+            pool_waits, _errors, _slow = self.pool_wait_window.window(3600, now)
+
+            # Only merge the windows of the endpoints we report (top 10 by volume)
+            endpoints = []
+            for endpoint, stats in sorted(self.endpoint_stats.items(),
+                                          key=lambda x: x[1].count, reverse=True)[:10]:
+                recent, _errors, _slow = stats.recent.window(3600, now)
+                endpoints.append((endpoint, {
+                    'count': stats.count,
+                    'time': stats.total_time,
+                    'errors': stats.errors,
+                    'slow': stats.slow_count,
+                    'queries': stats.queries,
+                    'max_queries': stats.max_queries
+                }, recent))
+
+            return {
+                'scope': 'worker',
+                'last_hour': last_hour,
+                'last_minute': last_minute,
+                'total_requests': sum(stats.count for stats in self.endpoint_stats.values()),
+                'total_errors': sum(stats.errors for stats in self.endpoint_stats.values()),
+                'endpoints': endpoints,
+                'queries': queries,
+                'slow_query_count': slow_query_count,
+                'pool_waits': pool_waits,
+                'n_plus_one_count': len(self.n_plus_one),
+                'slo_windows': {
+                    '5m': (last_five.count, five_errors, five_slow),
+                    '1h': (last_hour.count, hour_errors, hour_slow)
+                },
+                'system': self._system_sample()
+            }
     
     def get_summary(self):
-        """Get performance summary"""
-        # Calculate request statistics
-        if self.request_times:
-            durations = [req['duration'] for req in self.request_times]
-            avg_response_time = sum(durations) / len(durations)
-            max_response_time = max(durations)
-            min_response_time = min(durations)
-            
-            # Calculate requests per minute
-            recent_requests = [r for r in self.request_times 
-                             if datetime.fromisoformat(r['timestamp']) > datetime.utcnow() - timedelta(minutes=1)]
-            requests_per_minute = len(recent_requests)
-        else:
-            avg_response_time = max_response_time = min_response_time = 0
-            requests_per_minute = 0
-        
-        # System metrics
-        current_cpu = self.cpu_usage[-1]['percent'] if self.cpu_usage else 0
-        current_memory = self.memory_usage[-1]['percent'] if self.memory_usage else 0
+        """Get performance summary - O(endpoints * buckets), independent of traffic"""
+        now = time.time()
+        snapshot = None
+        try:
+            snapshot = self.backend.snapshot(now)
+        except Exception as e:
+            print(f"⚠️ Fleet performance snapshot unavailable: {e}")
+        return self._summarize(snapshot or self._local_snapshot(now))
+
+    def _summarize(self, snapshot):
+        last_hour = snapshot['last_hour']
+        queries = snapshot['queries']
+        pool_waits = snapshot['pool_waits']
+        total_requests = snapshot['total_requests']
+
+        top_endpoints = {}
+        for endpoint, totals, recent in snapshot['endpoints']:
+            count = totals['count']
+            top_endpoints[endpoint] = {
+                'count': count,
+                'avg_time_ms': round(totals['time'] / count * 1000, 2) if count else 0,
+                'error_count': totals['errors'],
+                'slow_count': totals['slow'],
+                'avg_queries': round(totals['queries'] / count, 2) if count else 0,
+                'max_queries': totals['max_queries']
+            }
+            top_endpoints[endpoint].update(
+                {f'{name}_ms': value for name, value in recent.quantiles_ms().items()}
+            )
         
         # Error rate
-        total_requests = sum(stats['count'] for stats in self.endpoint_stats.values())
-        total_errors = sum(stats['errors'] for stats in self.endpoint_stats.values())
-        error_rate = (total_errors / total_requests * 100) if total_requests > 0 else 0
+        error_rate = (snapshot['total_errors'] / total_requests * 100) if total_requests > 0 else 0
         
-        return {
-            'requests': {
-                'total_last_hour': len(self.request_times),
-                'per_minute': requests_per_minute,
-                'avg_response_time_ms': round(avg_response_time * 1000, 2),
-                'max_response_time_ms': round(max_response_time * 1000, 2),
-                'min_response_time_ms': round(min_response_time * 1000, 2),
-                'error_rate_percent': round(error_rate, 2)
-            },
-            'system': {
-                'cpu_percent': current_cpu,
-                'memory_percent': current_memory,
-                'memory_used_gb': self.memory_usage[-1]['used_gb'] if self.memory_usage else 0,
-                'memory_total_gb': self.memory_usage[-1]['total_gb'] if self.memory_usage else 0
-            },
+        requests_summary = {
+            'total_last_hour': last_hour.count,
+            'per_minute': snapshot['last_minute'].count,
+            'avg_response_time_ms': round(last_hour.mean() * 1000, 2),
+            'max_response_time_ms': round(last_hour.max * 1000, 2),
+            'min_response_time_ms': round(last_hour.min * 1000, 2),
+            'error_rate_percent': round(error_rate, 2)
+        }
+        requests_summary.update({f'{name}_ms': value for name, value in last_hour.quantiles_ms().items()})
+        if 'unique_visitors_today' in snapshot:
+            requests_summary['unique_visitors_today'] = snapshot['unique_visitors_today']
+        
+        summary = {
+            'scope': snapshot['scope'],
+            'requests': requests_summary,
+            'system': snapshot['system'],
             'database': {
-                'total_queries_tracked': len(self.query_times),
-                'slow_queries': len(self.slow_queries),
-                'avg_query_time_ms': round((sum(q['duration'] for q in self.query_times) / len(self.query_times) * 1000) if self.query_times else 0, 2)
+                'total_queries_tracked': queries.count,
+                'slow_queries': snapshot['slow_query_count'],
+                'avg_query_time_ms': round(queries.mean() * 1000, 2),
+                'p99_query_time_ms': round(queries.quantile(0.99) * 1000, 2),
+                'queries_per_request': round(queries.count / last_hour.count, 2) if last_hour.count else 0,
+                'n_plus_one_suspects': snapshot['n_plus_one_count'],
+                'pool_checkouts': pool_waits.count,
+                'pool_wait_avg_ms': round(pool_waits.mean() * 1000, 2),
+                'pool_wait_p99_ms': round(pool_waits.quantile(0.99) * 1000, 2)
             },
-            'endpoints': {
-                endpoint: {
-                    'count': stats['count'],
-                    'avg_time_ms': round(stats['avg_time'] * 1000, 2),
-                    'error_count': stats['errors'],
-                    'slow_count': stats['slow_count']
-                }
-                for endpoint, stats in sorted(self.endpoint_stats.items(), 
-                                            key=lambda x: x[1]['count'], 
-                                            reverse=True)[:10]  # Top 10 endpoints
-            }
+            'endpoints': top_endpoints,
+            'slo': evaluate_slos(snapshot['slo_windows'])
         }
+        if 'workers' in snapshot:
+            summary['workers'] = snapshot['workers']
+        return summary
     
     def get_health_status(self):
-        """Get overall health status"""
+        """Health snapshot, rebuilt at most once per health_ttl seconds per worker"""
+        with self._health_lock:
+            # Concurrent probes wait for the one rebuilding instead of each flushing and summarizing
+            if self._health is None or time.monotonic() - self._health_at >= self.health_ttl:
+                self._health = self._build_health_status()
+                self._health_at = time.monotonic()
+            return self._health
+
+    def _build_health_status(self):
+        """Health from SLO burn rates over the last 5 minutes and hour, plus host resources"""
         summary = self.get_summary()
+        slo = summary['slo']
         
         health_status = {
             'status': 'healthy',
             'timestamp': datetime.utcnow().isoformat(),
-            'checks': []
+            'scope': summary['scope'],
+            'checks': [],
+            'slo': slo
         }
         
-        # Check response times
-        if summary['requests']['avg_response_time_ms'] > 1000:  # > 1 second
-            health_status['checks'].append({
-                'name': 'response_time',
-                'status': 'warning',
-                'message': f"High average response time: {summary['requests']['avg_response_time_ms']}ms"
-            })
-        else:
-            health_status['checks'].append({
-                'name': 'response_time',
-                'status': 'healthy',
-                'message': f"Good response time: {summary['requests']['avg_response_time_ms']}ms"
-            })
-        
-        # Check error rate
-        if summary['requests']['error_rate_percent'] > 5:  # > 5% error rate
+        # Error budget burn (availability: non-5xx, latency: under 1 second)
+        for name, objective in slo['objectives'].items():
+            short = slo['windows']['5m'][f'{name}_burn_rate']
+            long = slo['windows']['1h'][f'{name}_burn_rate']
             health_status['checks'].append({
-                'name': 'error_rate',
-                'status': 'warning',
-                'message': f"High error rate: {summary['requests']['error_rate_percent']}%"
-            })
-        else:
-            health_status['checks'].append({
-                'name': 'error_rate',
-                'status': 'healthy',
-                'message': f"Low error rate: {summary['requests']['error_rate_percent']}%"
+                'name': f'{name}_slo',
+                'status': objective['status'],
+                'message': f"{name.capitalize()} SLO {objective['target'] * 100:g}%: "
+                           f"burn rate {short}x (5m), {long}x (1h)"
             })
         
         # Check system resources
@@ -275,8 +617,10 @@ class PerformanceMonitor:
                 'message': f"Memory usage: {summary['system']['memory_percent']}%"
             })
         
-        # Update overall status if any warnings
-        if any(check['status'] == 'warning' for check in health_status['checks']):
+        # A fast budget burn makes the service unhealthy, anything else degraded
+        if any(check['status'] == 'critical' for check in health_status['checks']):
+            health_status['status'] = 'unhealthy'
+        elif any(check['status'] == 'warning' for check in health_status['checks']):
             health_status['status'] = 'degraded'
         
         return health_status
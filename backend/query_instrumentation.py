@@ -0,0 +1,106 @@
+"""
+SQLAlchemy Query Instrumentation for Hexashop
+Feeds statement timings, per-request query counts and pool waits into PerformanceMonitor
+"""
+import re
+import time
+from collections import Counter
+from functools import lru_cache
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from performance_monitor import performance_monitor
+from tracing import KIND_CLIENT, tracer
+
+# Literal and placeholder patterns collapsed to '?' so equivalent statements
+# share one fingerprint
+_FINGERPRINT_RULES = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                       # string literals
+    (re.compile(r'%\(\w+\)s|%s|\$\d+|(?<!:):\w+'), '?'),        # bind placeholders
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),                    # numeric literals
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'), '(?+)'),        # IN (...) lists
+    (re.compile(r'\s+'), ' '),                                  # whitespace
+]
+
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement):
+    """Normalize a SQL statement into a parameter-free fingerprint"""
+    normalized = statement.strip()
+    for pattern, replacement in _FINGERPRINT_RULES:
+        normalized = pattern.sub(replacement, normalized)
+    return normalized[:500]
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that reports how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            performance_monitor.record_pool_wait(time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = tracer.start_span('db.query', KIND_CLIENT, {'db.system': 'postgresql'})
+    if span is not None:
+        span.set('db.statement', fingerprint(statement))
+    conn.info.setdefault('hexashop_query_span', []).append(span)
+    conn.info.setdefault('hexashop_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('hexashop_query_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    query_fingerprint = fingerprint(statement)
+
+    spans = conn.info.get('hexashop_query_span')
+    span = spans.pop() if spans else None
+    if span is not None:
+        if rows is not None:
+            span.set('db.rows', rows)
+        tracer.end_span(span)
+
+    performance_monitor.record_query(statement, duration, rows=rows, query_fingerprint=query_fingerprint)
+
+    if has_request_context():
+        request_queries = g.get('hexashop_queries')
+        if request_queries is None:
+            request_queries = g.hexashop_queries = Counter()
+        request_queries[query_fingerprint] += 1
+
+
+def pop_request_queries():
+    """Return and clear the per-fingerprint query counts of the current request"""
+    if not has_request_context():
+        return Counter()
+    return g.pop('hexashop_queries', None) or Counter()
+
+
+def _handle_error(exception_context):
+    """Close the timing and span of a statement that raised"""
+    conn = exception_context.connection
+    if conn is None:
+        return
+    starts = conn.info.get('hexashop_query_start')
+    if starts:
+        starts.pop()
+    spans = conn.info.get('hexashop_query_span')
+    span = spans.pop() if spans else None
+    if span is not None:
+        span.record_error(exception_context.original_exception)
+        tracer.end_span(span)
+
+
+def instrument_sqlalchemy():
+    """Attach cursor execution hooks to every SQLAlchemy engine (idempotent)"""
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
@@ -0,0 +1,110 @@
+"""
+Distributed Rate Limiting for Hexashop
+Redis sliding-window limits shared by every worker process
+"""
+import secrets
+from functools import wraps
+from flask import request, jsonify
+
+# Sliding-window log kept in a sorted set: one member per accepted hit,
+# scored by its timestamp in milliseconds. The set never holds more than
+# `limit` members and expires together with the window, so memory per
+# client is bounded. Redis TIME keeps all workers on the same clock.
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local window = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local member = ARGV[3]
+
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+local count = redis.call('ZCARD', key)
+
+if count >= limit then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local retry_after = window
+    if oldest[2] then
+        retry_after = tonumber(oldest[2]) + window - now
+    end
+    return {1, count, retry_after}
+end
+
+redis.call('ZADD', key, now, member)
+redis.call('PEXPIRE', key, window)
+return {0, count + 1, 0}
+"""
+
+# Route name -> (max hits, window in seconds)
+DEFAULT_RATE_LIMITS = {
+    'admin_login': (5, 300),        # 5 login attempts per 5 minutes
+    'admin_code': (5, 300),         # 5 access code checks per 5 minutes
+    'orders': (10, 60),             # 10 orders per minute
+    'promo': (30, 60),              # 30 promo validations per minute
+}
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.app = app
+        self.redis = None
+        self.key_prefix = 'hexashop:ratelimit:'
+        self.limits = dict(DEFAULT_RATE_LIMITS)
+        self._script = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, redis_client=None):
+        self.app = app
+        self.redis = redis_client if redis_client is not None else getattr(app, 'redis_client', None)
+        self.limits.update(app.config.get('RATE_LIMITS', {}))
+        self._script = self.redis.register_script(SLIDING_WINDOW_SCRIPT) if self.redis else None
+
+    def check(self, name, identifier):
+        """Record a hit and return (limited, retry_after_seconds) in one round-trip"""
+        if name not in self.limits or self._script is None:
+            return False, 0
+
+        max_hits, window_seconds = self.limits[name]
+        key = f"{self.key_prefix}{name}:{identifier}"
+
+        try:
+            limited, _count, retry_after_ms = self._script(
+                keys=[key],
+                args=[int(window_seconds * 1000), max_hits, secrets.token_hex(8)]
+            )
+        except Exception as e:
+            # Fail open: a Redis outage must not lock customers out of checkout
+            if self.app:
+                self.app.logger.warning(f"Rate limit check failed ({name}): {e}")
+            return False, 0
+
+        if not limited:
+            return False, 0
+        return True, max(1, -(-int(retry_after_ms) // 1000))  # round up to whole seconds
+
+    def is_limited(self, name, identifier):
+        """Return True when the identifier exceeded the named limit"""
+        limited, _retry_after = self.check(name, identifier)
+        return limited
+
+
+def rate_limit(name):
+    """Decorator limiting a view per client IP using the named limit"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            limited, retry_after = rate_limiter.check(name, request.remote_addr)
+            if limited:
+                response = jsonify({"error": "Too many requests. Please try again later."})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(retry_after)
+                return response
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# Global rate limiter instance
+rate_limiter = RateLimiter()
@@ -0,0 +1,253 @@
+"""
+Redis Topology for Hexashop
+Separate connection pools, logical databases and eviction policies per tier
+"""
+import os
+import threading
+import time
+from redis import BlockingConnectionPool, Redis
+from metrics import metrics_registry
+from tracing import KIND_CLIENT, tracer
+
+# Tier name -> defaults. Each tier gets its own logical database on the
+# shared REDIS_URL unless REDIS_<TIER>_URL points it somewhere else.
+TIER_DEFAULTS = {
+    'sessions': {
+        'db': 0,                        # Existing sessions already live in db 0
+        'max_connections': 10,
+        'maxmemory_policy': 'noeviction',   # Never evict an admin session
+        'persist': True,
+    },
+    'cache': {
+        'db': 1,
+        'max_connections': 30,          # Every storefront request may hit the cache
+        'maxmemory_policy': 'volatile-ttl', # Evict the entries closest to expiry first
+        'persist': False,
+    },
+    'ratelimit': {
+        'db': 2,
+        'max_connections': 10,
+        'maxmemory_policy': 'volatile-ttl',
+        'persist': False,
+    },
+    'metrics': {
+        'db': 3,
+        'max_connections': 5,           # Background flushes and /metrics scrapes only
+        'maxmemory_policy': 'volatile-ttl', # Counters carry no TTL, so they are never evicted
+        'persist': True,
+    },
+    'coordination': {
+        'db': 4,
+        'max_connections': 5,           # Background job runners and leases
+        'maxmemory_policy': 'noeviction',   # Queued jobs and leases must never disappear
+        'persist': True,
+    },
+}
+
+# When several tiers share one server only one policy can apply. Any evicting
+# policy can drop sessions, rate-limit windows and job leases, so a server that
+# hosts a noeviction tier stays noeviction: cache writes fail once it is full
+# rather than admin sessions or leases disappearing. Give the cache its own
+# server (REDIS_CACHE_URL) to keep it evicting; REDIS_SHARED_SERVER_POLICY
+# overrides this, at the noeviction tiers' risk.
+SHARED_SERVER_POLICY = 'noeviction'
+
+POOL_TIMEOUT = 5  # Seconds a thread waits for a free connection
+
+
+class TierRedis(Redis):
+    """Redis client that counts GET hits and misses and times commands for its tier"""
+
+    def __init__(self, *args, tier=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tier = tier
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        span = tracer.start_span(f'redis {args[0]}', KIND_CLIENT, {'db.system': 'redis'})
+        try:
+            return super().execute_command(*args, **options)
+        except Exception as e:
+            if span is not None:
+                span.record_error(e)
+            raise
+        finally:
+            if span is not None:
+                if self.tier is not None:
+                    span.set('db.redis.tier', self.tier.name)
+                tracer.end_span(span)
+            if self.tier is not None:
+                metrics_registry.observe('hexashop_redis_command_duration_seconds',
+                                         time.perf_counter() - start, tier=self.tier.name)
+
+    def get(self, name):
+        value = super().get(name)
+        if self.tier is not None:
+            self.tier.record_lookup(value is not None)
+        return value
+
+
+class RedisTier:
+    def __init__(self, name, url, db, max_connections, maxmemory_policy, persist):
+        self.name = name
+        self.db = db
+        self.maxmemory_policy = maxmemory_policy
+        self.persist = persist
+
+        self.pool = BlockingConnectionPool.from_url(
+            url, max_connections=max_connections, timeout=POOL_TIMEOUT
+        )
+        if db is None:
+            self.db = self.pool.connection_kwargs.get('db', 0)
+        else:
+            # URL options override from_url kwargs, so force the tier's database here
+            self.pool.connection_kwargs['db'] = db
+        self.client = TierRedis(connection_pool=self.pool, tier=self)
+
+        kwargs = self.pool.connection_kwargs
+        self.server = f"{kwargs.get('host', 'localhost')}:{kwargs.get('port', 6379)}"
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record_lookup(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def key_count(self):
+        """Keys in this tier's database - O(1)"""
+        return self.client.dbsize()
+
+    def pool_stats(self):
+        created = len(self.pool._connections)
+        idle = sum(1 for conn in list(self.pool.pool.queue) if conn is not None)
+        return {
+            'max_connections': self.pool.max_connections,
+            'created': created,
+            'in_use': created - idle,
+        }
+
+    def stats(self):
+        """Memory, key and hit statistics for this tier"""
+        memory = self.client.info('memory')
+        server_stats = self.client.info('stats')
+        keyspace = self.client.info('keyspace').get(f'db{self.db}', {})
+
+        lookups = self.hits + self.misses
+        return {
+            'db': self.db,
+            'server': self.server,
+            'keys': keyspace.get('keys', 0),
+            'keys_with_ttl': keyspace.get('expires', 0),
+            'eviction_policy': memory.get('maxmemory_policy', self.maxmemory_policy),
+            'memory': {
+                'used': memory.get('used_memory_human'),
+                'used_bytes': memory.get('used_memory', 0),
+                'peak': memory.get('used_memory_peak_human'),
+                'max_bytes': memory.get('maxmemory', 0),
+            },
+            'hits': {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': f"{(self.hits / lookups * 100):.1f}%" if lookups else "0%",
+                'server_keyspace_hits': server_stats.get('keyspace_hits', 0),
+                'server_keyspace_misses': server_stats.get('keyspace_misses', 0),
+                'evicted_keys': server_stats.get('evicted_keys', 0),
+            },
+            'pool': self.pool_stats(),
+        }
+
+
+class RedisTopology:
+    def __init__(self, app=None):
+        self.app = app
+        self.tiers = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        base_url = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+
+        for name, defaults in TIER_DEFAULTS.items():
+            env_name = name.upper()
+            tier_url = os.environ.get(f'REDIS_{env_name}_URL')
+            # A dedicated URL keeps its own database unless REDIS_<TIER>_DB overrides it
+            db = os.environ.get(f'REDIS_{env_name}_DB', None if tier_url else defaults['db'])
+            self.tiers[name] = RedisTier(
+                name,
+                url=tier_url or base_url,
+                db=int(db) if db is not None else None,
+                max_connections=int(os.environ.get(f'REDIS_{env_name}_POOL_SIZE', defaults['max_connections'])),
+                maxmemory_policy=defaults['maxmemory_policy'],
+                persist=defaults['persist'],
+            )
+
+        for tier in self.tiers.values():
+            tier.client.ping()
+
+        app.redis_topology = self
+
+    def client(self, name):
+        return self.tiers[name].client
+
+    def tier(self, name):
+        return self.tiers[name]
+
+    def _tiers_by_server(self):
+        servers = {}
+        for tier in self.tiers.values():
+            servers.setdefault(tier.server, []).append(tier)
+        return servers
+
+    def configure_servers(self, maxmemory='512mb'):
+        """Apply memory limit, eviction policy and persistence per Redis server"""
+        shared_policy = os.environ.get('REDIS_SHARED_SERVER_POLICY', SHARED_SERVER_POLICY)
+        for server, tiers in self._tiers_by_server().items():
+            policies = {tier.maxmemory_policy for tier in tiers}
+            policy = next(iter(policies)) if len(policies) == 1 else shared_policy
+            client = tiers[0].client
+            names = ', '.join(tier.name for tier in tiers)
+
+            if len(policies) > 1:
+                protected = ', '.join(tier.name for tier in tiers if tier.maxmemory_policy == 'noeviction')
+                evicting = ', '.join(tier.name for tier in tiers if tier.maxmemory_policy != 'noeviction')
+                if policy == 'noeviction':
+                    print(f"⚠️ Redis {server} hosts noeviction tiers ({protected}) and evicting ones "
+                          f"({evicting}): using noeviction, so {evicting} writes fail once {maxmemory} "
+                          f"is used. Set REDIS_<TIER>_URL to give them a server of their own")
+                elif protected:
+                    print(f"🚨 Redis {server} applies {policy} to noeviction tiers ({protected}): "
+                          f"their keys can be evicted under memory pressure")
+
+            try:
+                client.config_set('maxmemory', maxmemory)
+                client.config_set('maxmemory-policy', policy)
+                if any(tier.persist for tier in tiers):
+                    client.config_set('save', '900 1 300 10 60 10000')
+                print(f"✅ Redis {server} ({names}): {maxmemory} with {policy}")
+            except Exception as e:
+                print(f"⚠️ Could not configure Redis {server} ({names}): {e}")
+
+    def stats(self):
+        """Per-tier statistics, noting tiers that share a server's memory"""
+        servers = self._tiers_by_server()
+        result = {}
+        for name, tier in self.tiers.items():
+            try:
+                tier_stats = tier.stats()
+                tier_stats['memory']['shared_with'] = [
+                    other.name for other in servers[tier.server] if other is not tier
+                ]
+                result[name] = tier_stats
+            except Exception as e:
+                result[name] = {'error': str(e)}
+        return result
+
+# Global Redis topology instance
+redis_topology = RedisTopology()
@@ -0,0 +1,240 @@
+"""
+Request Profiler for Hexashop
+Opt-in stack sampling of single requests, exported as collapsed stacks or speedscope JSON
+"""
+import hmac
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+PROFILE_HEADER = 'X-Hexashop-Profile'
+DEFAULT_INTERVAL = 0.005    # 5 ms between stack samples
+MAX_PROFILES = 50           # Profiles kept for download
+MAX_STACK_DEPTH = 96        # Deeper stacks keep their innermost frames
+PROFILE_TTL = 86400         # Stored profiles expire after a day
+
+
+class ActiveProfile:
+    __slots__ = ('id', 'thread_id', 'endpoint', 'method', 'path', 'trigger', 'started', 'samples')
+
+    def __init__(self, thread_id, endpoint, method, path, trigger):
+        self.id = secrets.token_hex(8)
+        self.thread_id = thread_id
+        self.endpoint = endpoint
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.started = time.time()
+        self.samples = Counter()   # stack (tuple of code objects, root first) -> samples
+
+
+def _frame_info(code):
+    return [code.co_name, code.co_filename, code.co_firstlineno]
+
+
+class RequestProfiler:
+    """
+    Samples the stack of profiled request threads every `interval` seconds
+    from one background thread (sys._current_frames), so unprofiled
+    requests pay nothing and profiled ones pay no tracing overhead.
+
+    A request is profiled when it carries PROFILE_HEADER with the
+    PROFILER_TOKEN value, or at random with PROFILE_SAMPLE_RATE. Finished
+    profiles go to a bounded ring in Redis shared by all workers (or a
+    local deque without Redis).
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.redis = None
+        self.key_prefix = 'hexashop:profiles:'
+        self.token = None
+        self.sample_rate = 0.0
+        self.interval = DEFAULT_INTERVAL
+        self.profiles = deque(maxlen=MAX_PROFILES)
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._sampler_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, redis_client=None):
+        self.app = app
+        self.redis = redis_client
+        self.token = os.environ.get('PROFILER_TOKEN') or None
+        self.sample_rate = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+        self.interval = float(os.environ.get('PROFILE_INTERVAL_MS', DEFAULT_INTERVAL * 1000)) / 1000
+        app.request_profiler = self
+
+    # ----- request hooks -----
+
+    def trigger_for(self, request):
+        """'header', 'sampled' or None - cheap enough for every request"""
+        requested = request.headers.get(PROFILE_HEADER)
+        if requested and self.token and hmac.compare_digest(requested, self.token):
+            return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sampled'
+        return None
+
+    def start(self, endpoint, method, path, trigger):
+        profile = ActiveProfile(threading.get_ident(), endpoint, method, path, trigger)
+        with self._lock:
+            self._active[profile.thread_id] = profile
+        if self._sampler_pid != os.getpid():
+            self._start_sampler()
+        self._wakeup.set()
+        return profile
+
+    def stop(self, profile, status_code):
+        """Finish a profile and store it; returns the stored profile id"""
+        duration = time.time() - profile.started
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+        self._store(self._serialize(profile, duration, status_code))
+        return profile.id
+
+    def discard(self, profile):
+        with self._lock:
+            self._active.pop(profile.thread_id, None)
+
+    # ----- sampling -----
+
+    def _start_sampler(self):
+        # One sampler thread per (forked) worker process
+        with self._lock:
+            if self._sampler_pid == os.getpid():
+                return
+            self._sampler_pid = os.getpid()
+        threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def _sample_loop(self):
+        while True:
+            self._wakeup.clear()
+            if not self._active:
+                self._wakeup.wait()
+            time.sleep(self.interval)
+            self._sample()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        # Held while walking so stop() never serializes a profile mid-update
+        with self._lock:
+            for profile in self._active.values():
+                frame = frames.get(profile.thread_id)
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if stack:
+                    stack.reverse()
+                    profile.samples[tuple(stack)] += 1
+
+    # ----- storage -----
+
+    def _serialize(self, profile, duration, status_code):
+        """Compact form: a shared frame table and (frame indexes, samples) pairs"""
+        frame_index = {}
+        frames = []
+        stacks = []
+        for stack, count in profile.samples.items():
+            indexes = []
+            for code in stack:
+                index = frame_index.get(code)
+                if index is None:
+                    index = frame_index[code] = len(frames)
+                    frames.append(_frame_info(code))
+                indexes.append(index)
+            stacks.append([indexes, count])
+
+        return {
+            'id': profile.id,
+            'endpoint': profile.endpoint,
+            'method': profile.method,
+            'path': profile.path,
+            'trigger': profile.trigger,
+            'timestamp': datetime.utcfromtimestamp(profile.started).isoformat(),
+            'duration_ms': round(duration * 1000, 2),
+            'status': status_code,
+            'interval_ms': round(self.interval * 1000, 3),
+            'sample_count': sum(profile.samples.values()),
+            'frames': frames,
+            'stacks': stacks
+        }
+
+    def _store(self, data):
+        if self.redis is None:
+            self.profiles.append(data)
+            return
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self.key_prefix + data['id'], json.dumps(data, separators=(',', ':')), ex=PROFILE_TTL)
+            pipe.lpush(self.key_prefix + 'index', data['id'])
+            pipe.ltrim(self.key_prefix + 'index', 0, MAX_PROFILES - 1)
+            pipe.execute()
+        except Exception as e:
+            print(f"⚠️ Could not store profile {data['id']}: {e}")
+            self.profiles.append(data)
+
+    def get_profile(self, profile_id):
+        for data in self.profiles:
+            if data['id'] == profile_id:
+                return data
+        if self.redis is None:
+            return None
+        raw = self.redis.get(self.key_prefix + profile_id)
+        return json.loads(raw) if raw else None
+
+    def list_profiles(self):
+        """Newest first, without the stack data"""
+        profiles = list(reversed(self.profiles))
+        if self.redis is not None:
+            ids = self.redis.lrange(self.key_prefix + 'index', 0, MAX_PROFILES - 1)
+            if ids:
+                raw_profiles = self.redis.mget([self.key_prefix + profile_id.decode('utf-8') for profile_id in ids])
+                profiles = [json.loads(raw) for raw in raw_profiles if raw] + profiles
+        return [
+            {key: value for key, value in data.items() if key not in ('frames', 'stacks')}
+            for data in profiles
+        ]
+
+
+def to_collapsed(data):
+    """Brendan Gregg collapsed stacks ('root;child;leaf count'), for flamegraph.pl and speedscope"""
+    names = [f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in data['frames']]
+    lines = [';'.join(names[index] for index in indexes) + f" {count}" for indexes, count in data['stacks']]
+    return '\n'.join(sorted(lines)) + '\n'
+
+
+def to_speedscope(data):
+    """speedscope 'sampled' profile document (https://www.speedscope.app)"""
+    interval = data['interval_ms']
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': f"{data['method']} {data['path']} ({data['timestamp']})",
+        'exporter': 'hexashop-request-profiler',
+        'activeProfileIndex': 0,
+        'shared': {
+            'frames': [{'name': name, 'file': filename, 'line': line} for name, filename, line in data['frames']]
+        },
+        'profiles': [{
+            'type': 'sampled',
+            'name': data['endpoint'],
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': data['duration_ms'],
+            'samples': [indexes for indexes, _count in data['stacks']],
+            'weights': [count * interval for _indexes, count in data['stacks']]
+        }]
+    }
+
+# Global request profiler instance
+request_profiler = RequestProfiler()
@@ -1,10 +1,24 @@
 from flask import Blueprint, jsonify, request, session, current_app
 from models import Order, OrderItem, Product, db, AdminAccessCode, PromoCode
 from datetime import datetime
+from sqlalchemy import Text, cast, func, update
+from sqlalchemy.dialects.postgresql import JSONB
 import json
+from rate_limiter import rate_limit
 
 admin_bp = Blueprint('admin', __name__)
 
+VALID_ORDER_STATUSES = ['pending', 'confirmed', 'shipped', 'delivered']
+
+ORDER_STATUS_MESSAGES = {
+    'pending': 'Order received',
+    'confirmed': 'Order confirmed and processing',
+    'shipped': 'Order shipped to delivery service',
+    'delivered': 'Order delivered successfully'
+}
+
+MAX_BULK_ORDER_IDS = 1000
+
 # Authentication decorator
 def admin_required(f):
     def decorated_function(*args, **kwargs):
@@ -45,8 +59,7 @@ def update_order_status(order_id):
             return jsonify({"error": "Order not found"}), 404
         
         new_status = request.json.get('status')
-        valid_statuses = ['pending', 'confirmed', 'shipped', 'delivered']
-        if new_status not in valid_statuses:
+        if new_status not in VALID_ORDER_STATUSES:
             return jsonify({"error": "Invalid status"}), 400
         
         order.status = new_status
@@ -56,17 +69,10 @@ def update_order_status(order_id):
         if order.delivery_updates:
             updates = json.loads(order.delivery_updates)
         
-        status_messages = {
-            'pending': 'Order received',
-            'confirmed': 'Order confirmed and processing',
-            'shipped': 'Order shipped to delivery service', 
-            'delivered': 'Order delivered successfully'
-        }
-        
         updates.append({
             'date': datetime.utcnow().isoformat(),
             'status': new_status,
-            'message': status_messages.get(new_status, 'Status updated')
+            'message': ORDER_STATUS_MESSAGES.get(new_status, 'Status updated')
         })
         
         order.delivery_updates = json.dumps(updates)
@@ -77,6 +83,116 @@ def update_order_status(order_id):
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+def _bulk_order_condition(data):
+    """Build the WHERE clause for a bulk status update from ids or a filter"""
+    order_ids = data.get('order_ids')
+    order_filter = data.get('filter')
+
+    if order_ids is not None:
+        if not isinstance(order_ids, list) or not order_ids:
+            return None, "order_ids must be a non-empty array"
+        if len(order_ids) > MAX_BULK_ORDER_IDS:
+            return None, f"At most {MAX_BULK_ORDER_IDS} order IDs per request"
+        if any(not isinstance(order_id, str) or not order_id or len(order_id) > 20 for order_id in order_ids):
+            return None, "Invalid order ID in order_ids"
+        return Order.id.in_(set(order_ids)), None
+
+    if not isinstance(order_filter, dict) or not order_filter:
+        return None, "Either order_ids or a non-empty filter is required"
+
+    conditions = []
+    if 'status' in order_filter:
+        if order_filter['status'] not in VALID_ORDER_STATUSES:
+            return None, "Invalid filter status"
+        conditions.append(Order.status == order_filter['status'])
+    if 'wilaya' in order_filter:
+        conditions.append(Order.wilaya == str(order_filter['wilaya']).strip())
+    for field in ('created_after', 'created_before'):
+        if field not in order_filter:
+            continue
+        try:
+            value = datetime.fromisoformat(str(order_filter[field]).replace('Z', '+00:00'))
+        except ValueError:
+            return None, f"Invalid {field} date format"
+        if field == 'created_after':
+            conditions.append(Order.created_at >= value)
+        else:
+            conditions.append(Order.created_at < value)
+
+    if not conditions:
+        return None, "Filter must contain status, wilaya, created_after or created_before"
+    return db.and_(*conditions), None
+
+# Bulk update order status
+@admin_bp.route('/orders/bulk-status', methods=['PUT'])
+@admin_required
+def bulk_update_order_status():
+    """Move many orders to a new status in a single set-based UPDATE"""
+    try:
+        data = request.json or {}
+
+        new_status = data.get('status')
+        if new_status not in VALID_ORDER_STATUSES:
+            return jsonify({"error": "Invalid status"}), 400
+
+        condition, error = _bulk_order_condition(data)
+        if error:
+            return jsonify({"error": error}), 400
+
+        tracking_event = json.dumps([{
+            'date': datetime.utcnow().isoformat(),
+            'status': new_status,
+            'message': ORDER_STATUS_MESSAGES.get(new_status, 'Status updated')
+        }])
+
+        # Append the tracking event server-side so no order is loaded or re-serialized in Python
+        delivery_updates = cast(
+            cast(func.coalesce(func.nullif(Order.delivery_updates, ''), '[]'), JSONB).op('||')(
+                cast(tracking_event, JSONB)
+            ),
+            Text
+        )
+
+        by_ids = data.get('order_ids') is not None
+        if not by_ids and not data.get('confirm'):
+            # A filter can match any number of orders: above the id-list limit the caller must confirm
+            matched = db.session.query(func.count(Order.id)).filter(condition, Order.status != new_status).scalar()
+            if matched > MAX_BULK_ORDER_IDS:
+                return jsonify({
+                    "error": f"Filter matches {matched} orders (more than {MAX_BULK_ORDER_IDS}); "
+                             f"resend with \"confirm\": true to update them all",
+                    "matched_count": matched
+                }), 409
+
+        statement = (
+            update(Order)
+            .where(condition, Order.status != new_status)
+            .values(status=new_status, delivery_updates=delivery_updates)
+            .execution_options(synchronize_session=False)
+        )
+        if by_ids:
+            # Bounded by MAX_BULK_ORDER_IDS, so the ids can be returned
+            updated_ids = [row[0] for row in db.session.execute(statement.returning(Order.id))]
+            updated_count = len(updated_ids)
+        else:
+            updated_count = db.session.execute(statement).rowcount
+        db.session.commit()
+
+        summary = {
+            "message": f"{updated_count} orders updated to {new_status}",
+            "status": new_status,
+            "updated_count": updated_count
+        }
+        if by_ids:
+            updated = set(updated_ids)
+            summary["updated_ids"] = updated_ids
+            summary["skipped_ids"] = [order_id for order_id in dict.fromkeys(data['order_ids']) if order_id not in updated]
+
+        return jsonify(summary)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
 # Delete order
 @admin_bp.route('/orders/<order_id>', methods=['DELETE'])
 @admin_required
@@ -132,15 +248,18 @@ def get_system_stats():
         if not redis_client:
             return jsonify({"error": "Redis not available"}), 500
             
-        # Get Redis memory info
+        # Get Redis memory info (cache tier server)
         info = redis_client.info('memory')
-        keys_count = redis_client.dbsize()
-        session_count = len(list(redis_client.scan_iter("hexashop:session:*")))
-        cache_count = len(list(redis_client.scan_iter("products:*")))
-        
-        # Calculate memory usage percentage (512MB limit)
+        topology = current_app.redis_topology
+        tier_stats = topology.stats()
+        keys_count = sum(stats.get('keys', 0) for stats in tier_stats.values())
+        session_count = current_app.session_interface.active_session_count()
+        cache_count = topology.tier('cache').key_count()
+        
+        # Calculate memory usage percentage (512MB default limit)
+        max_memory_mb = (info.get('maxmemory') or 512 * 1024 * 1024) / (1024 * 1024)
         memory_used_mb = info['used_memory'] / (1024 * 1024)
-        memory_percentage = (memory_used_mb / 512) * 100
+        memory_percentage = (memory_used_mb / max_memory_mb) * 100
         
         return jsonify({
             'redis_memory': {
@@ -156,14 +275,16 @@ def get_system_stats():
             },
             'session_settings': {
                 'lifetime_hours': 2,
-                'max_memory': '512MB'
-            }
+                'max_memory': f"{max_memory_mb:.0f}MB"
+            },
+            'tiers': tier_stats
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Validate admin access code - REMOVE @admin_required for this endpoint
 @admin_bp.route('/validate-admin-code', methods=['POST'])
+@rate_limit('admin_code')
 def validate_admin_code():  # ← REMOVED THE @admin_required LINE
     try:
         data = request.json
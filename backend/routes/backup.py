@@ -1,9 +1,16 @@
 """
 Backup API Routes for Hexashop Admin
 """
-from flask import Blueprint, jsonify, request, send_file
+from flask import Blueprint, Response, jsonify, request, send_file
 import os
+from datetime import datetime
 from backup_manager import backup_manager
+from backup_catalog import backup_catalog
+from backup_jobs import backup_jobs
+from wal_backups import wal_archiver
+from backup_store import SNAPSHOT_SUFFIX, backup_store
+from backup_upload import backup_uploader
+from backup_export import EXPORT_FORMATS, EXPORT_PREFIX, EXPORT_TABLES, IMPORT_MODES, table_transfer
 
 backup_bp = Blueprint('backup', __name__)
 
@@ -27,10 +34,14 @@ def admin_required(f):
 @backup_bp.route('/create', methods=['POST'])
 @admin_required
 def create_backup():
-    """Create a manual database backup"""
+    """Queue a manual database backup; poll /jobs/<id> for progress"""
     try:
-        result = backup_manager.create_backup("manual")
-        return jsonify(result)
+        job, created = backup_jobs.enqueue_backup("manual")
+        return jsonify({
+            "success": True,
+            "job": job,
+            "created": created
+        }), 202
     except Exception as e:
         return jsonify({
             "success": False,
@@ -40,9 +51,14 @@ def create_backup():
 @backup_bp.route('/list', methods=['GET'])
 @admin_required
 def list_backups():
-    """List all available backups"""
+    """List backups, newest first; ?type=, format=, verification=, upload=, since=, until=, limit= filter the catalog"""
     try:
-        backups = backup_manager.list_backups()
+        filters = {key: request.args[key] for key in ('type', 'format', 'verification', 'upload', 'since', 'until')
+                   if request.args.get(key)}
+        limit = request.args.get('limit', type=int)
+        if limit:
+            filters['limit'] = limit
+        backups = backup_manager.list_backups(**filters)
         return jsonify({
             "success": True,
             "backups": backups,
@@ -54,6 +70,22 @@ def list_backups():
             "error": str(e)
         }), 500
 
+@backup_bp.route('/catalog/rebuild', methods=['POST'])
+@admin_required
+def rebuild_catalog():
+    """Rebuild the backup catalog from the backup directory, store index and upload state"""
+    try:
+        count = backup_catalog.rebuild()
+        return jsonify({
+            "success": True,
+            "backups": count
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
 @backup_bp.route('/restore', methods=['POST'])
 @admin_required
 def restore_backup():
@@ -68,35 +100,364 @@ def restore_backup():
                 "error": "Filename is required"
             }), 400
         
-        backup_file = os.path.join(backup_manager.backup_dir, filename)
-        result = backup_manager.restore_backup(backup_file)
+        if os.path.basename(filename) != filename or not backup_manager.backup_exists(filename):
+            return jsonify({
+                "success": False,
+                "error": "Backup file not found"
+            }), 404
         
-        return jsonify(result)
+        # 'shadow' restores into a new database and swaps it in; 'inplace' restores over the live one
+        mode = data.get('mode')
+        if mode not in (None, 'shadow', 'inplace'):
+            return jsonify({
+                "success": False,
+                "error": "mode must be 'shadow' or 'inplace'"
+            }), 400
         
+        job, created = backup_jobs.enqueue_restore(filename, mode)
+        if not created:
+            return jsonify({
+                "success": False,
+                "error": "Another restore is already queued or running",
+                "job": job
+            }), 409
+        
+        return jsonify({
+            "success": True,
+            "job": job
+        }), 202
+        
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@backup_bp.route('/jobs', methods=['GET'])
+@admin_required
+def list_jobs():
+    """Recent backup and restore jobs, newest first"""
+    try:
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        return jsonify({
+            "success": True,
+            "jobs": backup_jobs.list_jobs(limit),
+            "queued": backup_jobs.queue_length()
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@backup_bp.route('/jobs/<job_id>', methods=['GET'])
+@admin_required
+def get_job(job_id):
+    """Status, progress, byte counts and log of one job"""
+    job = backup_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({
+            "success": False,
+            "error": "Job not found"
+        }), 404
+    return jsonify({
+        "success": True,
+        "job": job
+    })
+
+@backup_bp.route('/wal/status', methods=['GET'])
+@admin_required
+def wal_status():
+    """WAL receiver, base backups and the point-in-time restore window"""
+    try:
+        return jsonify({
+            "success": True,
+            "mode": backup_manager.mode,
+            "wal": wal_archiver.status()
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@backup_bp.route('/base', methods=['POST'])
+@admin_required
+def create_base_backup():
+    """Queue a physical base backup (incremental mode)"""
+    if not wal_archiver.enabled:
+        return jsonify({
+            "success": False,
+            "error": "Incremental backups are not enabled (BACKUP_MODE=incremental)"
+        }), 400
+    job, created = backup_jobs.enqueue_base_backup()
+    return jsonify({
+        "success": True,
+        "job": job,
+        "created": created
+    }), 202
+
+@backup_bp.route('/pitr', methods=['POST'])
+@admin_required
+def prepare_pitr():
+    """Queue preparation of a data directory recovered to a point in time"""
+    if not wal_archiver.enabled:
+        return jsonify({
+            "success": False,
+            "error": "Incremental backups are not enabled (BACKUP_MODE=incremental)"
+        }), 400
+    
+    target_time = (request.json or {}).get('target_time')
+    try:
+        datetime.fromisoformat(target_time)
+    except (TypeError, ValueError):
+        return jsonify({
+            "success": False,
+            "error": "target_time must be an ISO 8601 timestamp"
+        }), 400
+    
+    job, created = backup_jobs.enqueue_pitr(target_time)
+    if not created:
+        return jsonify({
+            "success": False,
+            "error": "Another restore is already queued or running",
+            "job": job
+        }), 409
+    return jsonify({
+        "success": True,
+        "job": job
+    }), 202
+
+@backup_bp.route('/store', methods=['GET'])
+@admin_required
+def store_stats():
+    """Deduplicated store size, dedupe ratio and retention tiers"""
+    try:
+        return jsonify({
+            "success": True,
+            "store": backup_store.stats()
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@backup_bp.route('/store/verify', methods=['POST'])
+@admin_required
+def verify_store():
+    """Check store integrity: fast (chunks present) inline, full (re-hash) as a job"""
+    data = request.json or {}
+    snapshot = data.get('snapshot')
+    if snapshot and snapshot.endswith(SNAPSHOT_SUFFIX):
+        snapshot = snapshot[:-len(SNAPSHOT_SUFFIX)]
+    if snapshot and not backup_store.exists(snapshot):
+        return jsonify({
+            "success": False,
+            "error": "Snapshot not found"
+        }), 404
+    
+    if not data.get('full'):
+        return jsonify({
+            "success": True,
+            "verification": backup_store.verify(snapshot)
+        })
+    
+    job, created = backup_jobs.enqueue('store_verify', {'snapshot': snapshot}, dedupe_key='store_verify')
+    return jsonify({
+        "success": True,
+        "job": job,
+        "created": created
+    }), 202
+
+@backup_bp.route('/verify', methods=['POST'])
+@admin_required
+def verify_backup():
+    """Queue a restore test of a backup (default: the newest) into a scratch database"""
+    filename = (request.json or {}).get('filename')
+    if filename and (os.path.basename(filename) != filename or not backup_manager.backup_exists(filename)):
+        return jsonify({
+            "success": False,
+            "error": "Backup file not found"
+        }), 404
+    
+    job, created = backup_jobs.enqueue_verify(filename)
+    return jsonify({
+        "success": True,
+        "job": job,
+        "created": created
+    }), 202
+
+@backup_bp.route('/export', methods=['POST'])
+@admin_required
+def export_tables():
+    """Queue an export of selected tables, e.g. {"tables": ["product", "promo_code"], "format": "jsonl"}"""
+    data = request.json or {}
+    tables = data.get('tables') or list(EXPORT_TABLES)
+    export_format = data.get('format', 'jsonl')
+    if export_format not in EXPORT_FORMATS or not set(tables) <= set(EXPORT_TABLES):
+        return jsonify({
+            "success": False,
+            "error": f"Formats: {', '.join(EXPORT_FORMATS)}; tables: {', '.join(EXPORT_TABLES)}"
+        }), 400
+    
+    job, created = backup_jobs.enqueue_export(tables, export_format)
+    return jsonify({
+        "success": True,
+        "job": job,
+        "created": created
+    }), 202
+
+@backup_bp.route('/exports', methods=['GET'])
+@admin_required
+def list_exports():
+    try:
+        return jsonify({
+            "success": True,
+            "exports": table_transfer.list_exports()
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        }), 500
+
+@backup_bp.route('/exports/<filename>', methods=['GET'])
+@admin_required
+def download_export(filename):
+    export_file = os.path.join(table_transfer.export_dir, filename)
+    if os.path.basename(filename) != filename or not filename.startswith(EXPORT_PREFIX) \
+            or not os.path.exists(export_file):
+        return jsonify({
+            "success": False,
+            "error": "Export not found"
+        }), 404
+    return send_file(os.path.abspath(export_file), as_attachment=True, download_name=filename,
+                     mimetype='application/x-tar')
+
+@backup_bp.route('/import', methods=['POST'])
+@admin_required
+def import_tables():
+    """
+    Queue an import of an export archive: multipart `file` (an archive from
+    another environment) or JSON {"filename": ...} of one listed by /exports.
+    Optional `tables` subset and `mode` (upsert, insert, replace).
+    """
+    data = request.form if request.files else (request.json or {})
+    mode = data.get('mode', 'upsert')
+    tables = data.get('tables') or None
+    if isinstance(tables, str):
+        tables = [table for table in tables.split(',') if table]
+    if mode not in IMPORT_MODES or (tables and not set(tables) <= set(EXPORT_TABLES)):
+        return jsonify({
+            "success": False,
+            "error": f"Modes: {', '.join(IMPORT_MODES)}; tables: {', '.join(EXPORT_TABLES)}"
+        }), 400
+    
+    running = backup_jobs.active_job('import')
+    if running:
+        # Checked before an uploaded archive is written to disk
+        return jsonify({
+            "success": False,
+            "error": "Another import is already queued or running",
+            "job": running
+        }), 409
+    
+    uploaded = None
+    if 'file' in request.files:
+        filename = f"{EXPORT_PREFIX}upload_{datetime.now().strftime('%Y%m%d_%H%M%S')}.tar"
+        uploaded = os.path.join(table_transfer.export_dir, filename)
+        request.files['file'].save(uploaded)
+    else:
+        filename = data.get('filename') or ''
+        if os.path.basename(filename) != filename or not filename.startswith(EXPORT_PREFIX) \
+                or not os.path.exists(os.path.join(table_transfer.export_dir, filename)):
+            return jsonify({
+                "success": False,
+                "error": "Export not found"
+            }), 404
+    
+    job, created = backup_jobs.enqueue_import(filename, tables, mode)
+    if not created:
+        # Another import was queued while this archive was being received
+        if uploaded:
+            os.remove(uploaded)
+        return jsonify({
+            "success": False,
+            "error": "Another import is already queued or running",
+            "job": job
+        }), 409
+    return jsonify({
+        "success": True,
+        "job": job
+    }), 202
+
+@backup_bp.route('/uploads', methods=['GET'])
+@admin_required
+def list_uploads():
+    """Off-site upload state per backup and target"""
+    try:
+        return jsonify({
+            "success": True,
+            "targets": [target.name for target in backup_uploader.targets],
+            "uploads": backup_uploader.list_uploads()
+        })
     except Exception as e:
         return jsonify({
             "success": False,
             "error": str(e)
         }), 500
 
+@backup_bp.route('/upload/<filename>', methods=['POST'])
+@admin_required
+def upload_backup(filename):
+    """Queue an off-site upload of one backup file (resumes a partial upload)"""
+    if not backup_uploader.enabled():
+        return jsonify({
+            "success": False,
+            "error": "No off-site upload target configured"
+        }), 400
+    if os.path.basename(filename) != filename or filename.endswith(SNAPSHOT_SUFFIX) \
+            or not backup_manager.backup_exists(filename):
+        return jsonify({
+            "success": False,
+            "error": "Backup file not found"
+        }), 404
+    
+    job, created = backup_jobs.enqueue_upload(filename)
+    return jsonify({
+        "success": True,
+        "job": job,
+        "created": created
+    }), 202
+
 @backup_bp.route('/download/<filename>', methods=['GET'])
 @admin_required
 def download_backup(filename):
-    """Download a backup file"""
+    """Download a backup file (store snapshots are exported as a directory-format tar)"""
     try:
         backup_file = os.path.join(backup_manager.backup_dir, filename)
         
-        if not os.path.exists(backup_file):
+        if not backup_manager.backup_exists(filename):
             return jsonify({
                 "success": False,
                 "error": "Backup file not found"
             }), 404
         
+        if filename.endswith(SNAPSHOT_SUFFIX):
+            # Streamed from the store's chunks: no full-size copy is written for a download
+            snapshot_id = filename[:-len(SNAPSHOT_SUFFIX)]
+            return Response(
+                backup_store.stream_tar(snapshot_id),
+                mimetype='application/x-tar',
+                headers={'Content-Disposition': f'attachment; filename="{snapshot_id}.dir.tar"'}
+            )
+        
         return send_file(
             backup_file,
             as_attachment=True,
             download_name=filename,
-            mimetype='application/sql'
+            mimetype='application/sql' if filename.endswith('.sql') else 'application/octet-stream'
         )
         
     except Exception as e:
@@ -112,13 +473,13 @@ def delete_backup(filename):
     try:
         backup_file = os.path.join(backup_manager.backup_dir, filename)
         
-        if not os.path.exists(backup_file):
+        if not backup_manager.backup_exists(filename):
             return jsonify({
                 "success": False,
                 "error": "Backup file not found"
             }), 404
         
-        os.remove(backup_file)
+        backup_manager.delete_backup_file(backup_file)
         
         return jsonify({
             "success": True,
@@ -1,10 +1,12 @@
 from flask import Blueprint, jsonify, request
 from models import PromoCode, db
 from datetime import datetime
+from rate_limiter import rate_limit
 
 cart_bp = Blueprint('cart', __name__)
 
 @cart_bp.route('/validate-promo', methods=['POST'])
+@rate_limit('promo')
 def validate_promo_code():
     try:
         data = request.json
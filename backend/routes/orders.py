@@ -7,6 +7,7 @@ import string
 import time
 from sqlalchemy.exc import OperationalError
 from routes.products import invalidate_product_cache
+from rate_limiter import rate_limit
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -19,6 +20,7 @@ def validate_phone_number(phone):
     return re.match(pattern, phone.replace(' ', '')) is not None
 
 @orders_bp.route('/', methods=['POST'])
+@rate_limit('orders')
 def create_order():
     max_retries = 3
     retry_delay = 0.1
@@ -1,9 +1,12 @@
 from flask import Blueprint, jsonify, request, current_app
 from models import Product, db
 import json
+import threading
 from sqlalchemy.exc import OperationalError
 import time
 from datetime import datetime
+from metrics import metrics_registry
+from tracing import tracer
 
 products_bp = Blueprint('products', __name__)
 
@@ -16,24 +19,26 @@ ADMIN_CACHE_TTL = 30         # 30 seconds for admin data (frequent updates)
 ORDER_CACHE_TTL = 900        # 15 minutes for orders (less frequent changes)
 FEATURED_CACHE_TTL = 1800    # 30 minutes for featured products
 
-# Cache statistics tracking
+PRODUCT_CATEGORIES = ('men', 'women', 'kids')
+
+# Cache statistics tracking (per worker; fleet-wide totals are exported on /metrics)
 CACHE_STATS = {
     'hits': 0,
     'misses': 0,
     'invalidations': 0
 }
+_cache_stats_lock = threading.Lock()
+
+def _record_cache_event(event, cache_key, count=1):
+    """Count a cache hit/miss/invalidation locally and per namespace in the metrics registry"""
+    with _cache_stats_lock:
+        CACHE_STATS[event] += count
+    namespace = cache_key.split(':')[1] if ':' in cache_key else cache_key
+    metrics_registry.inc('hexashop_cache_events', count, namespace=namespace, event=event)
 
 def _get_redis_client():
-    """Get Redis client with connection check"""
-    client = getattr(current_app, 'redis_client', None)
-    if client:
-        try:
-            # Quick ping to verify connection
-            client.ping()
-            return client
-        except:
-            return None
-    return None
+    """Get the cache Redis client (callers already handle connection errors)"""
+    return getattr(current_app, 'redis_client', None)
 
 def _build_cache_key(category, *segments):
     """Build cache key with category prefix for better organization"""
@@ -44,18 +49,25 @@ def _build_cache_key(category, *segments):
 
 def _get_cached_payload(cache_key):
     """Get cached data with statistics tracking"""
+    with tracer.span('cache.get', attributes={'cache.key': cache_key}) as span:
+        data = _read_cached_payload(cache_key)
+        span.set('cache.hit', data is not None)
+        return data
+
+def _read_cached_payload(cache_key):
+    """Redis GET and decode, counting hits and misses"""
     client = _get_redis_client()
     if not client:
-        CACHE_STATS['misses'] += 1
+        _record_cache_event('misses', cache_key)
         return None
     
     try:
         cached = client.get(cache_key)
         if cached is None:
-            CACHE_STATS['misses'] += 1
+            _record_cache_event('misses', cache_key)
             return None
         
-        CACHE_STATS['hits'] += 1
+        _record_cache_event('hits', cache_key)
         
         if isinstance(cached, bytes):
             cached = cached.decode('utf-8')
@@ -72,11 +84,16 @@ def _get_cached_payload(cache_key):
         
     except Exception as e:
         current_app.logger.warning(f"Redis cache read failed ({cache_key}): {e}")
-        CACHE_STATS['misses'] += 1
+        _record_cache_event('misses', cache_key)
         return None
 
 def _set_cached_payload(cache_key, payload, ttl=DEFAULT_CACHE_TTL):
     """Set cached data with compression for large payloads"""
+    with tracer.span('cache.set', attributes={'cache.key': cache_key, 'cache.ttl': ttl}):
+        _write_cached_payload(cache_key, payload, ttl)
+
+def _write_cached_payload(cache_key, payload, ttl):
+    """Redis SETEX of the payload and its metadata"""
     client = _get_redis_client()
     if not client:
         return
@@ -102,9 +119,16 @@ def _set_cached_payload(cache_key, payload, ttl=DEFAULT_CACHE_TTL):
 
 def invalidate_cache_pattern(pattern):
     """Invalidate cache by pattern"""
+    with tracer.span('cache.invalidate', attributes={'cache.pattern': pattern}) as span:
+        deleted_count = _delete_cache_pattern(pattern)
+        span.set('cache.deleted', deleted_count or 0)
+        return deleted_count
+
+def _delete_cache_pattern(pattern):
+    """SCAN the pattern and delete every match"""
     client = _get_redis_client()
     if not client:
-        return
+        return 0
     
     try:
         deleted_count = 0
@@ -112,7 +136,8 @@ def invalidate_cache_pattern(pattern):
             client.delete(key)
             deleted_count += 1
         
-        CACHE_STATS['invalidations'] += deleted_count
+        if deleted_count:
+            _record_cache_event('invalidations', pattern, deleted_count)
         
         if deleted_count > 0:
             current_app.logger.info(f"🗑️ Cache invalidated: {deleted_count} keys for pattern {pattern}")
@@ -134,16 +159,50 @@ def invalidate_product_cache():
         print(f"✅ Product cache invalidated ({deleted} keys)")
     return deleted
 
+def warm_product_cache(refresh_within=PRODUCT_CACHE_TTL // 2):
+    """
+    Pre-populate the hot listing keys (all, per category, featured) so visitors
+    don't pay for the miss. Keys with more than `refresh_within` seconds of TTL
+    left are kept; returns the number of keys written.
+    """
+    client = _get_redis_client()
+    if not client:
+        return 0
+
+    targets = [(_build_cache_key('product', 'all'), lambda: Product.query.all(), PRODUCT_CACHE_TTL)]
+    for category in PRODUCT_CATEGORIES:
+        targets.append((_build_cache_key('category', category),
+                        lambda category=category: Product.query.filter_by(model=category.capitalize()).all(),
+                        PRODUCT_CACHE_TTL))
+    targets.append((_build_cache_key('featured', 'homepage'),
+                    lambda: Product.query.filter_by(is_featured=True).order_by(Product.created_at.desc()).all(),
+                    FEATURED_CACHE_TTL))
+
+    pipe = client.pipeline(transaction=False)
+    for cache_key, _query, _ttl in targets:
+        pipe.ttl(cache_key)
+    remaining = pipe.execute()
+
+    warmed = 0
+    for (cache_key, query, ttl), left in zip(targets, remaining):
+        if left is not None and left > refresh_within:
+            continue
+        _set_cached_payload(cache_key, [product.to_dict() for product in query()], ttl=ttl)
+        warmed += 1
+    return warmed
+
 def get_cache_stats():
     """Get cache statistics"""
-    return CACHE_STATS.copy()
+    with _cache_stats_lock:
+        return CACHE_STATS.copy()
 
 def clear_all_cache():
     """Clear ALL application cache (use with caution)"""
     deleted = invalidate_cache_pattern(f"{CACHE_PREFIX}:*")
-    CACHE_STATS['hits'] = 0
-    CACHE_STATS['misses'] = 0
-    CACHE_STATS['invalidations'] = 0
+    with _cache_stats_lock:
+        CACHE_STATS['hits'] = 0
+        CACHE_STATS['misses'] = 0
+        CACHE_STATS['invalidations'] = 0
     return deleted
 
 @products_bp.route('/')
@@ -166,9 +225,8 @@ def get_products_by_category(category):
     if not category or len(category) > 50:
         return jsonify({"error": "Invalid category"}), 400
 
-    valid_categories = ['men', 'women', 'kids']
     category_lower = category.lower()
-    if category_lower not in valid_categories:
+    if category_lower not in PRODUCT_CATEGORIES:
         return jsonify({"error": "Invalid category"}), 400
 
     cache_key = _build_cache_key('category', category_lower)
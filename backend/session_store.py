@@ -0,0 +1,192 @@
+"""
+Server-side Session Store for Hexashop
+Redis-backed sessions that are only created for the routes that need them
+"""
+import json
+import secrets
+import time
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer, want_bytes
+from werkzeug.datastructures import CallbackDict
+
+
+class RedisSession(CallbackDict, SessionMixin):
+    """Session dict that remembers its id and the TTL it had when loaded"""
+
+    def __init__(self, initial=None, sid=None, new=False, ttl=None):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.ttl = ttl
+        self.modified = False
+
+
+class RedisSessionInterface(SessionInterface):
+    """
+    Stores sessions as compact JSON in Redis.
+
+    Requests outside `route_prefixes` (storefront pages, static assets,
+    tracking) get a request-local empty session and never touch Redis.
+    Unmodified sessions only have their TTL extended once it has dropped
+    by more than `refresh_interval` seconds.
+
+    Every live session is also tracked in a sorted set scored by its
+    expiry time, so cleanup and counting never scan the keyspace.
+    """
+    session_class = RedisSession
+
+    def __init__(self, redis, key_prefix='hexashop:sess:', route_prefixes=('/api/admin',),
+                 refresh_interval=300, use_signer=True, registry_key='hexashop:sessions:registry'):
+        self.redis = redis
+        self.key_prefix = key_prefix
+        self.registry_key = registry_key
+        self.route_prefixes = tuple(route_prefixes)
+        self.refresh_interval = refresh_interval
+        self.use_signer = use_signer
+
+    def _uses_session(self, path):
+        return path.startswith(self.route_prefixes)
+
+    def _get_signer(self, app):
+        # Same signer settings as Flask-Session so existing cookies stay valid
+        return Signer(app.secret_key, salt='flask-session', key_derivation='hmac')
+
+    def _unsign(self, app, cookie_value):
+        if not self.use_signer:
+            return cookie_value
+        try:
+            return self._get_signer(app).unsign(cookie_value).decode('utf-8')
+        except BadSignature:
+            return None
+
+    def _sign(self, app, sid):
+        if not self.use_signer:
+            return sid
+        return self._get_signer(app).sign(want_bytes(sid)).decode('utf-8')
+
+    def _new_session(self):
+        return self.session_class(sid=secrets.token_urlsafe(32), new=True)
+
+    def sid_from_cookie(self, app, cookie_value):
+        """Return the session id carried by a (signed) session cookie"""
+        return self._unsign(app, cookie_value) if cookie_value else None
+
+    def open_session(self, app, request):
+        if not self._uses_session(request.path):
+            return self.session_class(sid=None)
+
+        sid = self.sid_from_cookie(app, request.cookies.get(app.config['SESSION_COOKIE_NAME']))
+        if not sid:
+            return self._new_session()
+
+        key = self.key_prefix + sid
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.ttl(key)
+            data, ttl = pipe.execute()
+        except Exception as e:
+            app.logger.warning(f"Session load failed: {e}")
+            return self._new_session()
+
+        if data is None:
+            # Never adopt a client-supplied id for a new session
+            return self._new_session()
+
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            # Legacy pickled session: start over, the admin logs in again
+            return self._new_session()
+
+        return self.session_class(payload, sid=sid, ttl=ttl)
+
+    def save_session(self, app, session, response):
+        if session.sid is None:
+            return
+
+        cookie_name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        key = self.key_prefix + session.sid
+
+        if not session:
+            if session.modified and not session.new:
+                pipe = self.redis.pipeline(transaction=False)
+                pipe.delete(key)
+                pipe.zrem(self.registry_key, session.sid)
+                pipe.execute()
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        pipe = self.redis.pipeline(transaction=False)
+
+        if session.modified or session.new:
+            payload = json.dumps(dict(session), separators=(',', ':'))
+            pipe.set(key, payload, ex=lifetime)
+        elif self._needs_refresh(app, session, lifetime):
+            pipe.expire(key, lifetime)
+        else:
+            return
+
+        pipe.zadd(self.registry_key, {session.sid: time.time() + lifetime})
+        pipe.execute()
+
+        response.set_cookie(
+            cookie_name,
+            self._sign(app, session.sid),
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def _needs_refresh(self, app, session, lifetime):
+        """Throttle TTL refreshes to one per refresh_interval"""
+        if not app.config.get('SESSION_REFRESH_EACH_REQUEST') or session.ttl is None:
+            return False
+        return lifetime - session.ttl >= self.refresh_interval
+
+    def prune_expired(self):
+        """Drop registry entries whose session has expired - O(log n + removed)"""
+        return self.redis.zremrangebyscore(self.registry_key, '-inf', time.time())
+
+    def reconcile_registry(self, batch=500):
+        """
+        Re-derive registry scores from the session keys' TTLs and drop ids whose
+        key is gone (evicted, flushed or deleted outside save_session), so that
+        active_session_count() matches the sessions that actually exist
+        """
+        removed = corrected = 0
+        cursor = 0
+        while True:
+            cursor, entries = self.redis.zscan(self.registry_key, cursor, count=batch)
+            if entries:
+                pipe = self.redis.pipeline(transaction=False)
+                for sid, _score in entries:
+                    pipe.pttl(self.key_prefix + (sid.decode() if isinstance(sid, bytes) else sid))
+                ttls = pipe.execute()
+                now = time.time()
+                gone, fixed = [], {}
+                for (sid, score), ttl in zip(entries, ttls):
+                    if ttl == -2:
+                        gone.append(sid)
+                    elif ttl >= 0 and abs(score - (now + ttl / 1000)) > self.refresh_interval:
+                        fixed[sid] = now + ttl / 1000
+                if gone:
+                    removed += self.redis.zrem(self.registry_key, *gone)
+                if fixed:
+                    self.redis.zadd(self.registry_key, fixed, xx=True)
+                    corrected += len(fixed)
+            if cursor == 0:
+                return removed, corrected
+
+    def active_session_count(self):
+        """Number of sessions that have not expired yet - O(log n)"""
+        return self.redis.zcount(self.registry_key, time.time(), '+inf')
@@ -0,0 +1,274 @@
+"""
+Shadow Restore for Hexashop
+Restores a backup into a shadow database, verifies it and swaps it in by
+renaming, so the live database is never half-restored
+"""
+import os
+import time
+from datetime import datetime
+from urllib.parse import urlparse, urlunparse
+
+import psycopg2
+from psycopg2 import errors, sql
+
+from database import db
+
+SHADOW_MARK = '_shadow_'
+RETIRED_MARK = '_retired_'
+NAME_PREFIX_LENGTH = 40             # Keeps <live>_retired_<timestamp> under PostgreSQL's 63-byte limit
+SWAP_ATTEMPTS = 50                  # x SWAP_RETRY_DELAY waiting for terminated sessions to exit
+SWAP_RETRY_DELAY = 0.1
+GENERATION_CHECK_INTERVAL = 1.0     # Seconds between a worker's checks for a swapped database
+
+
+class ShadowRestorer:
+    """
+    BACKUP_RESTORE_MODE=shadow (or mode=shadow on a restore request)
+    restores without serving half-restored tables:
+
+    1. CREATE DATABASE <live>_shadow_<ts> with the live database's encoding
+       and locale, and pg_restore -j into it (psql with ON_ERROR_STOP for .sql)
+    2. fingerprint the shadow and compare with the dump-time fingerprints;
+       a failed restore or a mismatch drops the shadow, live data is untouched
+    3. block new connections to the live database, terminate its sessions
+       and, in one transaction, rename live -> <live>_retired_<ts> and
+       shadow -> live. Only this step is downtime, typically milliseconds
+    4. bump hexashop:db:generation: every worker disposes its SQLAlchemy pool
+       on its next request (pool_pre_ping covers the rest), and the cache
+       tier is cleared
+
+    The newest SHADOW_KEEP_RETIRED (default 1) retired databases are kept for
+    rollback. The restoring role must be able to create databases, rename
+    the live one and terminate its sessions (its owner with
+    pg_signal_backend, or a superuser), which is why the default stays
+    inplace, the old restore-over-live behaviour.
+    """
+
+    def __init__(self, app=None, manager=None, redis_client=None):
+        self.app = app
+        self.manager = manager
+        self.redis = None
+        self.mode = 'inplace'
+        self.keep_retired = 1
+        self.jobs = None
+        self.generation_key = 'hexashop:db:generation'
+        self._generation = None
+        self._checked_at = 0.0
+
+        if app is not None:
+            self.init_app(app, manager, redis_client)
+
+    def init_app(self, app, manager, redis_client=None):
+        self.app = app
+        self.manager = manager
+        self.redis = redis_client
+        self.mode = os.environ.get('BACKUP_RESTORE_MODE', 'inplace').lower()
+        self.keep_retired = max(0, int(os.environ.get('SHADOW_KEEP_RETIRED', self.keep_retired)))
+        self.jobs = max(1, int(os.environ.get('SHADOW_RESTORE_JOBS', manager.jobs)))
+        manager.shadow = self
+        app.shadow_restorer = self
+        app.before_request(self._check_generation)
+
+    # ----- connections -----
+
+    def _urls(self, shadow):
+        """(live database name, maintenance URL, shadow URL) on the live server"""
+        parsed = urlparse(self.manager.get_database_url())
+        live = parsed.path.lstrip('/')
+        return live, urlunparse(parsed._replace(path='/postgres')), urlunparse(parsed._replace(path=f'/{shadow}'))
+
+    def _admin(self, admin_url, statement, params=None):
+        connection = psycopg2.connect(admin_url)
+        try:
+            connection.autocommit = True     # CREATE/DROP DATABASE cannot run in a transaction
+            with connection.cursor() as cursor:
+                cursor.execute(statement, params)
+                return cursor.fetchall() if cursor.description else None
+        finally:
+            connection.close()
+
+    def _databases(self, admin_url, prefix):
+        rows = self._admin(admin_url, "SELECT datname FROM pg_database WHERE starts_with(datname, %s) "
+                                      "ORDER BY datname DESC", (prefix,))
+        return [row[0] for row in rows]
+
+    # ----- restore -----
+
+    def restore(self, backup_file, progress):
+        filename = os.path.basename(backup_file)
+        started = time.time()
+        stamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        live, admin_url, _ = self._urls('')
+        shadow = f"{live[:NAME_PREFIX_LENGTH]}{SHADOW_MARK}{stamp}"
+        _, _, shadow_url = self._urls(shadow)
+
+        # Restores are serialized by the job queue, so any shadow left behind is from a crashed run
+        for stale in self._databases(admin_url, f"{live[:NAME_PREFIX_LENGTH]}{SHADOW_MARK}"):
+            print(f"🧹 Dropping stale shadow database {stale}")
+            self._admin(admin_url, sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(stale)))
+
+        progress('shadow', None, None, f"Creating shadow database {shadow}")
+        encoding, collate, ctype = self._admin(
+            admin_url,
+            "SELECT pg_encoding_to_char(encoding), datcollate, datctype FROM pg_database WHERE datname = %s",
+            (live,)
+        )[0]
+        self._admin(admin_url, sql.SQL("CREATE DATABASE {} TEMPLATE template0 ENCODING {} LC_COLLATE {} LC_CTYPE {}").format(
+            sql.Identifier(shadow), sql.Literal(encoding), sql.Literal(collate), sql.Literal(ctype)))
+
+        swapped = False
+        try:
+            result = self.manager.restore_into(shadow_url, backup_file, progress, jobs=self.jobs, strict=True)
+            if result.returncode != 0:
+                return {"success": False, "error": f"Restore into shadow database failed: {result.stderr[-2000:]}"}
+            restore_seconds = time.time() - started
+
+            status = 'restored'
+            if self.manager.verifier is not None:
+                progress('verify', None, None, "Comparing shadow row counts and checksums")
+                _tables, mismatches, status = self.manager.verifier.check_restored(shadow_url, filename)
+                if status == 'failed':
+                    return {"success": False,
+                            "error": f"Shadow database does not match the backup: {', '.join(mismatches)}"}
+
+            self._copy_settings(admin_url, live, shadow)
+            progress('swap', None, None, "Swapping the shadow database in")
+            retired, swap_seconds = self._swap(admin_url, live, shadow, stamp)
+            swapped = True
+        finally:
+            if not swapped:
+                self._admin(admin_url, sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(shadow)))
+
+        cleared = self._after_swap()
+        self._drop_retired(admin_url, live)
+        seconds = time.time() - started
+        print(f"✅ Database restored from {filename} via shadow swap in {seconds:.1f}s "
+              f"(swap {swap_seconds * 1000:.0f} ms, previous database kept as {retired})")
+        return {
+            "success": True,
+            "message": "Database restored into a shadow database and swapped in",
+            "mode": "shadow",
+            "seconds": round(seconds, 2),
+            "restore_seconds": round(restore_seconds, 2),
+            "swap_seconds": swap_seconds,
+            "verification": status,
+            "retired_database": retired,
+            "cache_keys_cleared": cleared
+        }
+
+    def _copy_settings(self, admin_url, live, shadow):
+        """Carry ALTER DATABASE ... SET values over; pg_dump does not include them"""
+        rows = self._admin(admin_url, """
+            SELECT unnest(setconfig) FROM pg_db_role_setting
+            WHERE setrole = 0 AND setdatabase = (SELECT oid FROM pg_database WHERE datname = %s)
+        """, (live,))
+        for (setting,) in rows or []:
+            name, _, value = setting.partition('=')
+            self._admin(admin_url, sql.SQL("ALTER DATABASE {} SET {} TO {}").format(
+                sql.Identifier(shadow), sql.Identifier(*name.split('.')), sql.Literal(value)))
+
+    def _swap(self, admin_url, live, shadow, stamp):
+        """Rename live -> retired and shadow -> live atomically; returns (retired name, seconds)"""
+        retired = f"{live[:NAME_PREFIX_LENGTH]}{RETIRED_MARK}{stamp}"
+        connection = psycopg2.connect(admin_url)
+        connection.autocommit = True
+        started = time.time()
+        swapped = False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL("ALTER DATABASE {} WITH ALLOW_CONNECTIONS false").format(sql.Identifier(live)))
+                try:
+                    for _attempt in range(SWAP_ATTEMPTS):
+                        cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+                                       "WHERE datname IN (%s, %s) AND pid <> pg_backend_pid()", (live, shadow))
+                        try:
+                            cursor.execute("BEGIN")
+                            cursor.execute(sql.SQL("ALTER DATABASE {} RENAME TO {}").format(
+                                sql.Identifier(live), sql.Identifier(retired)))
+                            cursor.execute(sql.SQL("ALTER DATABASE {} RENAME TO {}").format(
+                                sql.Identifier(shadow), sql.Identifier(live)))
+                            cursor.execute("COMMIT")
+                            swapped = True
+                            break
+                        except Exception as e:
+                            # Never leave the admin connection in an aborted transaction
+                            self._rollback(cursor)
+                            if not isinstance(e, errors.ObjectInUse):
+                                raise
+                            time.sleep(SWAP_RETRY_DELAY)     # Terminated sessions exit asynchronously
+                    if not swapped:
+                        raise RuntimeError("Sessions on the live database did not exit; nothing was swapped")
+                finally:
+                    # The retired database after a swap. Otherwise the untouched live one, plus the
+                    # retired name in case a failed COMMIT went through after all
+                    self._allow_connections(connection, admin_url, [retired] if swapped else [live, retired])
+        finally:
+            connection.close()
+        return retired, round(time.time() - started, 3)
+
+    def _rollback(self, cursor):
+        try:
+            cursor.execute("ROLLBACK")
+        except Exception as e:
+            print(f"⚠️ Rollback after a failed swap failed: {e}")
+
+    def _allow_connections(self, connection, admin_url, names):
+        """Re-enable connections, on a fresh admin connection if the swap's one is unusable"""
+        for name in names:
+            statement = sql.SQL("ALTER DATABASE {} WITH ALLOW_CONNECTIONS true").format(sql.Identifier(name))
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(statement)
+                continue
+            except errors.InvalidCatalogName:
+                continue    # No database by that name: nothing to re-enable
+            except Exception as e:
+                print(f"⚠️ Swap connection unusable ({e}), re-enabling {name} on a new one")
+            try:
+                self._admin(admin_url, statement)
+            except errors.InvalidCatalogName:
+                pass
+            except Exception as e:
+                print(f"❌ Could not re-enable connections to {name}: {e}")
+
+    def _after_swap(self):
+        """Tell every worker to drop its pooled connections and clear the product cache"""
+        if self.redis is not None:
+            try:
+                self._generation = self.redis.incr(self.generation_key)
+            except Exception as e:
+                print(f"⚠️ Could not bump the database generation: {e}")
+        from routes.products import clear_all_cache
+        with self.app.app_context():
+            db.engine.dispose()
+            return clear_all_cache()
+
+    def _drop_retired(self, admin_url, live):
+        for name in self._databases(admin_url, f"{live[:NAME_PREFIX_LENGTH]}{RETIRED_MARK}")[self.keep_retired:]:
+            try:
+                self._admin(admin_url, sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(name)))
+                print(f"🗑️ Dropped retired database {name}")
+            except Exception as e:
+                print(f"⚠️ Could not drop retired database {name}: {e}")
+
+    def _check_generation(self):
+        # Once a second per worker: after a swap elsewhere, reconnect to the new database
+        if self.redis is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < GENERATION_CHECK_INTERVAL:
+            return
+        self._checked_at = now
+        try:
+            generation = int(self.redis.get(self.generation_key) or 0)
+        except Exception:
+            return
+        if self._generation is None:
+            self._generation = generation
+        elif generation != self._generation:
+            self._generation = generation
+            db.engine.dispose()
+            print(f"🔄 Database swapped (generation {generation}): connection pool drained")
+
+# Global shadow restorer instance
+shadow_restorer = ShadowRestorer()
@@ -0,0 +1,203 @@
+"""
+Service Level Objectives for Hexashop
+Error-budget burn rates and adaptive admission control under load
+"""
+import os
+import threading
+import time
+from flask import jsonify
+
+# Objectives over a 30-day period
+AVAILABILITY_TARGET = 0.995     # Requests answered without a 5xx
+LATENCY_TARGET = 0.99           # Requests faster than SLOW_REQUEST_THRESHOLD
+
+# Multi-window burn-rate alerts: both the 5-minute and the 1-hour rate must
+# exceed the threshold, so a short spike alone never pages and a past
+# incident stops alerting once the short window recovers.
+FAST_BURN_RATE = 14.4           # 2% of the monthly budget in one hour
+SLOW_BURN_RATE = 6.0            # 5% of the monthly budget in six hours
+MIN_WINDOW_REQUESTS = 50        # Below this a window carries no signal
+
+# Admission control
+SHED_P99_MS = 2000              # Local p99 latency that marks the worker as overloaded
+SHED_POOL_WAIT_MS = 250         # Local DB pool checkout wait p99 that marks it as overloaded
+MIN_PRESSURE_SAMPLES = 20       # Requests (or pool checkouts) in the last minute before they count
+LOW_PRIORITY_CONCURRENCY = 2    # Low-priority requests served at once while overloaded
+QUEUE_TIMEOUT = 1.0             # Seconds a low-priority request waits for a slot
+RETRY_AFTER = 5                 # Seconds, sent with 503 responses
+
+# Path prefix -> priority. Anything unlisted is 'normal' (storefront browsing).
+PRIORITY_RULES = (
+    ('/api/performance/health', 'critical'),    # Load balancer health checks
+    ('/api/orders', 'critical'),                # Checkout
+    ('/api/tracking', 'critical'),
+    ('/api/cart', 'critical'),
+    ('/api/admin', 'low'),
+    ('/api/performance', 'low'),
+    ('/api/debug', 'low'),
+    ('/api/products/search', 'low'),
+    ('/metrics', 'low'),
+)
+
+
+def _burn(bad, total, target):
+    """Observed bad fraction divided by the allowed one"""
+    if not total:
+        return 0.0
+    return (bad / total) / (1 - target)
+
+
+def _slo_status(short, long, burn_key):
+    if short['requests'] < MIN_WINDOW_REQUESTS:
+        return 'healthy'
+    if short[burn_key] >= FAST_BURN_RATE and long[burn_key] >= FAST_BURN_RATE:
+        return 'critical'
+    if short[burn_key] >= SLOW_BURN_RATE and long[burn_key] >= SLOW_BURN_RATE:
+        return 'warning'
+    return 'healthy'
+
+
+def evaluate_slos(windows):
+    """
+    windows: {'5m': (requests, server_errors, slow), '1h': (...)}
+    Returns per-window burn rates and a status per objective.
+    """
+    rates = {}
+    for name, (total, errors, slow) in windows.items():
+        rates[name] = {
+            'requests': total,
+            'availability': round(1 - errors / total, 5) if total else 1.0,
+            'availability_burn_rate': round(_burn(errors, total, AVAILABILITY_TARGET), 2),
+            'latency_ok': round(1 - slow / total, 5) if total else 1.0,
+            'latency_burn_rate': round(_burn(slow, total, LATENCY_TARGET), 2),
+        }
+
+    short, long = rates['5m'], rates['1h']
+    return {
+        'objectives': {
+            'availability': {
+                'target': AVAILABILITY_TARGET,
+                'status': _slo_status(short, long, 'availability_burn_rate'),
+            },
+            'latency': {
+                'target': LATENCY_TARGET,
+                'status': _slo_status(short, long, 'latency_burn_rate'),
+            },
+        },
+        'windows': rates,
+    }
+
+
+class AdmissionController:
+    """
+    Sheds low-priority traffic before it competes with checkout for
+    threads and DB connections. Once a second it reads this worker's
+    last-minute p99 latency and pool-wait p99 from PerformanceMonitor:
+
+    level 0  below thresholds - everything is admitted
+    level 1  a threshold crossed - low priority queues for one of
+             LOW_PRIORITY_CONCURRENCY slots, 503 after QUEUE_TIMEOUT
+    level 2  twice a threshold - low and normal priority get 503
+
+    Critical routes (checkout, cart, tracking, health) are never shed.
+    """
+
+    def __init__(self, app=None, monitor=None):
+        self.monitor = monitor
+        self.enabled = True
+        self.p99_ms = SHED_P99_MS
+        self.pool_wait_ms = SHED_POOL_WAIT_MS
+        self._low_priority_slots = threading.BoundedSemaphore(LOW_PRIORITY_CONCURRENCY)
+        self._lock = threading.Lock()
+        self._level = 0
+        self._checked_at = 0.0
+        self._pressure = {}
+        self.shed = {'low': 0, 'normal': 0}
+        self.queued = 0
+
+        if app is not None:
+            self.init_app(app, monitor)
+
+    def init_app(self, app, monitor):
+        self.monitor = monitor
+        self.enabled = os.environ.get('LOAD_SHEDDING_ENABLED', '1') == '1'
+        self.p99_ms = float(os.environ.get('SHED_P99_MS', SHED_P99_MS))
+        self.pool_wait_ms = float(os.environ.get('SHED_POOL_WAIT_MS', SHED_POOL_WAIT_MS))
+        app.admission_controller = self
+
+    def classify(self, path):
+        for prefix, priority in PRIORITY_RULES:
+            if path.startswith(prefix):
+                return priority
+        return 'normal'
+
+    def level(self, now=None):
+        """Overload level, re-evaluated at most once a second"""
+        now = now or time.time()
+        if now - self._checked_at < 1.0:
+            return self._level
+
+        with self._lock:
+            if now - self._checked_at < 1.0:
+                return self._level
+            pressure = self.monitor.pressure(now)
+            ratio = 0.0
+            if pressure['requests'] >= MIN_PRESSURE_SAMPLES:
+                ratio = pressure['p99_ms'] / self.p99_ms
+            if pressure['pool_checkouts'] >= MIN_PRESSURE_SAMPLES:
+                ratio = max(ratio, pressure['pool_wait_p99_ms'] / self.pool_wait_ms)
+            self._level = 2 if ratio >= 2 else 1 if ratio >= 1 else 0
+            self._pressure = pressure
+            self._checked_at = now
+            return self._level
+
+    def admit(self, path):
+        """(admitted, holds_slot) for a request to `path`"""
+        if not self.enabled:
+            return True, False
+        priority = self.classify(path)
+        if priority == 'critical':
+            return True, False
+
+        level = self.level()
+        if level == 0:
+            return True, False
+        if priority == 'normal':
+            if level < 2:
+                return True, False
+            self._count_shed('normal')
+            return False, False
+
+        if level < 2:
+            with self._lock:
+                self.queued += 1
+            if self._low_priority_slots.acquire(timeout=QUEUE_TIMEOUT):
+                return True, True
+        self._count_shed('low')
+        return False, False
+
+    def release(self):
+        self._low_priority_slots.release()
+
+    def _count_shed(self, priority):
+        with self._lock:
+            self.shed[priority] += 1
+
+    def reject(self):
+        response = jsonify({"error": "Service is under heavy load. Please try again shortly."})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(RETRY_AFTER)
+        return response
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'level': self._level,
+            'pressure': self._pressure,
+            'thresholds': {'p99_ms': self.p99_ms, 'pool_wait_p99_ms': self.pool_wait_ms},
+            'queued': self.queued,
+            'shed': dict(self.shed),
+        }
+
+# Global admission controller instance
+admission_controller = AdmissionController()
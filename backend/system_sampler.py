@@ -0,0 +1,221 @@
+"""
+System Sampler for Hexashop
+Host and process metrics in fixed-size ring buffers at several resolutions
+"""
+import gc
+import os
+import threading
+import time
+from array import array
+from datetime import datetime
+import psutil
+
+SERIES = (
+    'cpu_percent',
+    'memory_percent',
+    'memory_used_gb',
+    'memory_total_gb',
+    'disk_read_mb_s',
+    'disk_write_mb_s',
+    'process_cpu_percent',
+    'process_rss_mb',
+    'open_fds',
+    'threads',
+    'gc_collections',
+    'gc_pause_ms',
+)
+
+# name -> (seconds per point, points kept)
+RESOLUTIONS = {
+    '1s': (1, 300),         # last 5 minutes
+    '10s': (10, 360),       # last hour
+    '1m': (60, 1440),       # last day
+    '1h': (3600, 168),      # last week
+}
+
+DEFAULT_INTERVAL = 1.0  # seconds between raw samples
+
+
+class RingSeries:
+    """
+    One array('d') per series plus a timestamp array, written in place.
+    Points are appended when a `step`-second slot closes, holding the
+    mean of the raw samples that fell into it.
+    """
+
+    def __init__(self, step, capacity):
+        self.step = step
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = {name: array('d', bytes(8 * capacity)) for name in SERIES}
+        self.head = 0       # Next write position
+        self.size = 0
+
+        self._slot = None
+        self._count = 0
+        self._sums = array('d', bytes(8 * len(SERIES)))
+
+    def add(self, now, sample):
+        slot = int(now // self.step)
+        if slot != self._slot:
+            if self._count:
+                self._append(self._slot * self.step)
+            self._slot = slot
+            self._count = 0
+            for i in range(len(SERIES)):
+                self._sums[i] = 0.0
+
+        self._count += 1
+        sums = self._sums
+        for i, name in enumerate(SERIES):
+            sums[i] += sample[name]
+
+    def _append(self, timestamp):
+        position = self.head
+        self.timestamps[position] = timestamp
+        for i, name in enumerate(SERIES):
+            self.values[name][position] = self._sums[i] / self._count
+        self.head = (position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def _ranges(self, points):
+        """Buffer index ranges of the newest `points` points, oldest first"""
+        points = min(points, self.size)
+        start = (self.head - points) % self.capacity
+        if start + points <= self.capacity:
+            return [(start, start + points)]
+        return [(start, self.capacity), (0, self.head)]
+
+    def window(self, seconds, now):
+        """(timestamps, {series: values}) for the last `seconds` - copies only the points returned"""
+        # Binary search for the oldest point inside the window (timestamps grow in ring order)
+        oldest = now - seconds
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamps[(self.head - self.size + middle) % self.capacity] < oldest:
+                low = middle + 1
+            else:
+                high = middle
+        ranges = self._ranges(self.size - low)
+
+        timestamps = []
+        values = {name: [] for name in SERIES}
+        for start, end in ranges:
+            timestamps.extend(self.timestamps[start:end])
+            for name in SERIES:
+                values[name].extend(self.values[name][start:end])
+        return timestamps, values
+
+    def latest(self):
+        if not self.size:
+            return None
+        position = (self.head - 1) % self.capacity
+        return {name: self.values[name][position] for name in SERIES}
+
+
+class SystemSampler:
+    """
+    Samples once per interval without blocking (cpu_percent(None) measures
+    since the previous call) and feeds every resolution, so 10s/1m/1h
+    points are downsampled means of the 1s samples. GC pauses come from
+    gc.callbacks and are summed per sample.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL):
+        self.interval = interval
+        self.resolutions = {name: RingSeries(step, capacity) for name, (step, capacity) in RESOLUTIONS.items()}
+        self.current = None
+        self._lock = threading.Lock()
+        self._process = psutil.Process(os.getpid())
+        self._last_disk = None
+        self._gc_start = None
+        self._gc_collections = 0
+        self._gc_pause = 0.0
+        gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            self._gc_pause += time.perf_counter() - self._gc_start
+            self._gc_collections += 1
+            self._gc_start = None
+
+    def _open_fds(self):
+        try:
+            return self._process.num_fds()
+        except AttributeError:
+            return self._process.num_handles()  # Windows
+
+    def _disk_rates(self, now):
+        disk_io = psutil.disk_io_counters()
+        if disk_io is None:
+            return 0.0, 0.0
+        last, self._last_disk = self._last_disk, (now, disk_io.read_bytes, disk_io.write_bytes)
+        if last is None or now <= last[0]:
+            return 0.0, 0.0
+        elapsed = now - last[0]
+        return ((disk_io.read_bytes - last[1]) / elapsed / (1024**2),
+                (disk_io.write_bytes - last[2]) / elapsed / (1024**2))
+
+    def sample(self, now=None):
+        """Take one sample and record it at every resolution"""
+        now = now or time.time()
+        if self._process.pid != os.getpid():
+            # Forked worker: measure this process, not the parent
+            self._process = psutil.Process(os.getpid())
+
+        memory = psutil.virtual_memory()
+        read_rate, write_rate = self._disk_rates(now)
+        gc_collections, gc_pause = self._gc_collections, self._gc_pause
+        self._gc_collections, self._gc_pause = 0, 0.0
+
+        with self._process.oneshot():
+            rss = self._process.memory_info().rss
+            process_cpu = self._process.cpu_percent(None)
+            threads = self._process.num_threads()
+            open_fds = self._open_fds()
+
+        sample = {
+            'cpu_percent': psutil.cpu_percent(None),
+            'memory_percent': memory.percent,
+            'memory_used_gb': memory.used / (1024**3),
+            'memory_total_gb': memory.total / (1024**3),
+            'disk_read_mb_s': read_rate,
+            'disk_write_mb_s': write_rate,
+            'process_cpu_percent': process_cpu,
+            'process_rss_mb': rss / (1024**2),
+            'open_fds': open_fds,
+            'threads': threads,
+            'gc_collections': gc_collections,
+            'gc_pause_ms': gc_pause * 1000,
+        }
+
+        with self._lock:
+            for series in self.resolutions.values():
+                series.add(now, sample)
+            self.current = sample
+        return sample
+
+    def window(self, resolution='1m', seconds=None, now=None):
+        """Points of one resolution covering the last `seconds` (default: the whole ring)"""
+        series = self.resolutions[resolution]
+        seconds = seconds or series.step * series.capacity
+        with self._lock:
+            return series.window(seconds, now or time.time())
+
+    def latest(self, resolution='1m'):
+        """Newest downsampled point, falling back to the last raw sample"""
+        with self._lock:
+            return self.resolutions[resolution].latest() or self.current
+
+    def to_json(self, resolution='1m', seconds=None):
+        timestamps, values = self.window(resolution, seconds)
+        return {
+            'resolution': resolution,
+            'step_seconds': self.resolutions[resolution].step,
+            'points': len(timestamps),
+            'timestamps': [datetime.utcfromtimestamp(ts).isoformat() for ts in timestamps],
+            'series': {name: [round(value, 3) for value in series] for name, series in values.items()}
+        }
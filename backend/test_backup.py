@@ -1,6 +1,7 @@
 import requests
 import json
 import os
+import time
 
 # Configuration
 BASE_URL = "http://localhost:5000"
@@ -54,11 +55,21 @@ def test_backup_system():
         }
     )
     
-    if backup_response.status_code == 200:
-        backup_data = backup_response.json()
-        print(f"✅ Backup created successfully!")
-        print(f"📁 File: {backup_data.get('file', 'Unknown')}")
-        print(f"💾 Size: {backup_data.get('size', 0)} bytes")
+    if backup_response.status_code == 202:
+        job = backup_response.json()['job']
+        print(f"⏳ Backup job {job['id']} queued, waiting...")
+        while job['status'] in ('queued', 'running'):
+            time.sleep(2)
+            job = session.get(f"{BASE_URL}/api/admin/backup/jobs/{job['id']}").json()['job']
+            print(f"  ... {job['status']} {job.get('stage') or ''} {job.get('progress') or ''}")
+        
+        if job['status'] == 'succeeded':
+            backup_data = job['result']
+            print(f"✅ Backup created successfully!")
+            print(f"📁 File: {backup_data.get('file', 'Unknown')}")
+            print(f"💾 Size: {backup_data.get('size', 0)} bytes")
+        else:
+            print(f"❌ Backup job failed: {job['error']}")
     else:
         print(f"❌ Backup failed with status {backup_response.status_code}: {backup_response.text}")
     
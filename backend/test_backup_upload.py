@@ -0,0 +1,159 @@
+"""
+Off-site upload pipeline against LocalTarget: part splitting, resume after
+an interrupted part, checksum verification and state cleanup.
+
+    python -m pytest test_backup_upload.py
+"""
+import os
+
+import pytest
+
+from backup_upload import BackupUploader, LocalTarget, UploadError, iter_parts
+
+PART_SIZE = 64 * 1024
+
+
+class FlakyTarget(LocalTarget):
+    """LocalTarget whose put_part fails (not retryable) for the part numbers in `fail_parts`"""
+
+    def __init__(self, root, fail_parts=()):
+        super().__init__(root)
+        self.part_size = PART_SIZE
+        self.fail_parts = set(fail_parts)
+        self.sent = []
+
+    def put_part(self, state, number, data, digests):
+        if number in self.fail_parts:
+            raise UploadError(f"part {number} interrupted", retryable=False)
+        self.sent.append(number)
+        return super().put_part(state, number, data, digests)
+
+
+class CorruptingTarget(FlakyTarget):
+    """Flips a byte of the assembled object, as a bad disk or truncated copy would"""
+
+    def complete(self, state, manifest):
+        result = super().complete(state, manifest)
+        with open(result['path'], 'r+b') as stored:
+            first = stored.read(1)
+            stored.seek(0)
+            stored.write(bytes([first[0] ^ 0xFF]))
+        return result
+
+
+@pytest.fixture
+def backup_file(tmp_path):
+    path = tmp_path / 'hexashop_backup_manual_20261019_120000.dump'
+    path.write_bytes(os.urandom(PART_SIZE * 2 + PART_SIZE // 2))    # Two and a half parts
+    return str(path)
+
+
+def make_uploader(tmp_path, target):
+    uploader = BackupUploader()
+    uploader.state_dir = str(tmp_path / 'uploads')
+    uploader.prefix = 'hexashop/'
+    uploader.compress = False
+    uploader.targets = [target]
+    os.makedirs(uploader.state_dir)
+    return uploader
+
+
+def stored_object(target, backup_file):
+    with open(os.path.join(target.root, 'hexashop', os.path.basename(backup_file)), 'rb') as stored:
+        return stored.read()
+
+
+def test_iter_parts_splits_at_part_size(backup_file):
+    parts = list(iter_parts(backup_file, PART_SIZE))
+    assert [number for number, _data in parts] == [1, 2, 3]
+    assert [len(data) for _number, data in parts] == [PART_SIZE, PART_SIZE, PART_SIZE // 2]
+    with open(backup_file, 'rb') as source:
+        assert b''.join(data for _number, data in parts) == source.read()
+
+
+def test_upload_splits_into_parts_and_assembles(tmp_path, backup_file):
+    target = FlakyTarget(str(tmp_path / 'remote'))
+    uploader = make_uploader(tmp_path, target)
+
+    assert uploader.upload(backup_file, 'manual') == {'local': 'complete'}
+    assert sorted(target.sent) == [1, 2, 3]
+    with open(backup_file, 'rb') as source:
+        assert stored_object(target, backup_file) == source.read()
+    state = uploader._load_state(uploader._state_path(f"hexashop/{os.path.basename(backup_file)}", 'local'))
+    assert state['status'] == 'complete' and sorted(state['parts']) == ['1', '2', '3']
+    # Parts are assembled and cleaned up
+    assert not os.listdir(os.path.join(target.root, '.uploads'))
+
+
+def test_resume_sends_only_missing_parts(tmp_path, backup_file):
+    target = FlakyTarget(str(tmp_path / 'remote'), fail_parts={2})
+    uploader = make_uploader(tmp_path, target)
+
+    result = uploader.upload(backup_file, 'manual')
+    assert result['local'].startswith('failed: part 2 interrupted')
+    assert [state['status'] for state in uploader.pending()] == ['failed']
+    sent_before = set(target.sent)
+    assert 2 not in sent_before
+
+    target.fail_parts.clear()
+    target.sent.clear()
+    resumed = uploader.resume_pending()
+    assert list(resumed.values()) == ['complete']
+    assert set(target.sent) == {1, 2, 3} - sent_before
+    assert uploader.pending() == []
+    with open(backup_file, 'rb') as source:
+        assert stored_object(target, backup_file) == source.read()
+
+
+def test_resume_resends_parts_missing_at_the_destination(tmp_path, backup_file):
+    target = FlakyTarget(str(tmp_path / 'remote'), fail_parts={3})
+    uploader = make_uploader(tmp_path, target)
+    uploader.upload(backup_file, 'manual')
+
+    # A part recorded in the state but lost remotely is sent again
+    state = uploader.pending()[0]
+    upload_dir = os.path.join(target.root, '.uploads', state['upload_id'])
+    os.remove(os.path.join(upload_dir, '00001.part'))
+    target.fail_parts.clear()
+    target.sent.clear()
+
+    assert list(uploader.resume_pending().values()) == ['complete']
+    assert 1 in target.sent
+    with open(backup_file, 'rb') as source:
+        assert stored_object(target, backup_file) == source.read()
+
+
+def test_checksum_mismatch_fails_the_upload(tmp_path, backup_file):
+    target = CorruptingTarget(str(tmp_path / 'remote'))
+    uploader = make_uploader(tmp_path, target)
+
+    result = uploader.upload(backup_file, 'manual')
+    assert result['local'].startswith('failed:')
+    assert 'checksum mismatch' in result['local']
+    state = uploader.pending()[0]
+    assert state['status'] == 'failed' and 'checksum mismatch' in state['error']
+
+
+def test_changed_source_restarts_the_upload(tmp_path, backup_file):
+    target = FlakyTarget(str(tmp_path / 'remote'), fail_parts={3})
+    uploader = make_uploader(tmp_path, target)
+    uploader.upload(backup_file, 'manual')
+
+    with open(backup_file, 'ab') as source:
+        source.write(b'appended')
+    target.fail_parts.clear()
+    target.sent.clear()
+    assert list(uploader.resume_pending().values()) == ['complete']
+    assert sorted(target.sent) == [1, 2, 3]
+
+
+def test_forget_removes_upload_states(tmp_path, backup_file):
+    target = FlakyTarget(str(tmp_path / 'remote'), fail_parts={2})
+    uploader = make_uploader(tmp_path, target)
+    uploader.upload(backup_file, 'manual')
+    upload_id = uploader.pending()[0]['upload_id']
+
+    uploader.forget(backup_file)
+    assert uploader.list_uploads() == []
+    # The unfinished multipart upload is aborted too
+    assert not os.path.exists(os.path.join(target.root, '.uploads', upload_id))
@@ -0,0 +1,323 @@
+"""
+Request Tracing for Hexashop
+Per-request traces with spans around SQL, Redis, cache and JSON work, exported as OTLP JSON
+"""
+import json
+import os
+import queue
+import random
+import re
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask.json.provider import DefaultJSONProvider
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+DEFAULT_SAMPLE_RATE = 0.01      # Fraction of fast, successful traces kept
+DEFAULT_SLOW_MS = 1000          # Traces at least this slow are always kept
+MAX_SPANS_PER_TRACE = 512       # Further spans are counted, not kept
+EXPORT_QUEUE_SIZE = 1000        # Traces waiting for export; more are dropped
+EXPORT_BATCH_SIZE = 50
+DEFAULT_EXPORT_MAX_MB = 100     # TRACE_EXPORT_PATH is rotated to <path>.1 past this size
+
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_current_trace = ContextVar('hexashop_trace', default=None)
+_current_span = ContextVar('hexashop_span', default=None)
+
+
+class Span:
+    __slots__ = ('span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name, kind, parent_id, attributes=None):
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes) if attributes else {}
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def record_error(self, exc):
+        self.error = f"{type(exc).__name__}: {exc}"
+
+
+class _NoopSpan:
+    """Returned when no trace is active so call sites never branch"""
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def record_error(self, exc):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ('trace_id', 'root', 'spans', 'dropped_spans', 'upstream_sampled', 'tokens')
+
+    def __init__(self, trace_id, root, upstream_sampled):
+        self.trace_id = trace_id
+        self.root = root
+        self.spans = [root]
+        self.dropped_spans = 0
+        self.upstream_sampled = upstream_sampled
+        self.tokens = None
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items()]
+
+
+class Tracer:
+    """
+    Every request gets a trace id (or continues an incoming W3C
+    traceparent); spans are buffered on the request and the keep/drop
+    decision is made when it finishes (tail sampling): errors and traces
+    slower than TRACE_SLOW_MS are always kept, the rest at
+    TRACE_SAMPLE_RATE. Kept traces are exported off the request path as
+    OTLP/JSON, POSTed to TRACE_COLLECTOR_URL or appended to
+    TRACE_EXPORT_PATH (one rotated generation of TRACE_EXPORT_MAX_MB).
+    With neither set, trace ids are still issued but nothing is exported.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self.enabled = False
+        self.service_name = 'hexashop-backend'
+        self.sample_rate = DEFAULT_SAMPLE_RATE
+        self.slow_ns = DEFAULT_SLOW_MS * 1_000_000
+        self.export_path = None
+        self.export_max_bytes = DEFAULT_EXPORT_MAX_MB * 1024 * 1024
+        self.collector_url = None
+        self.dropped_traces = 0
+        self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._exporter_pid = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = os.environ.get('TRACING_ENABLED', '1') == '1'
+        self.service_name = os.environ.get('TRACE_SERVICE_NAME', self.service_name)
+        self.sample_rate = float(os.environ.get('TRACE_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))
+        self.slow_ns = int(float(os.environ.get('TRACE_SLOW_MS', DEFAULT_SLOW_MS)) * 1_000_000)
+        self.collector_url = os.environ.get('TRACE_COLLECTOR_URL') or None
+        self.export_path = os.environ.get('TRACE_EXPORT_PATH') or None
+        self.export_max_bytes = int(float(os.environ.get('TRACE_EXPORT_MAX_MB', DEFAULT_EXPORT_MAX_MB)) * 1024 * 1024)
+        app.json = TracedJSONProvider(app)
+        app.tracer = self
+
+    # ----- traces -----
+
+    def start_trace(self, name, traceparent=None, attributes=None):
+        if not self.enabled:
+            return None
+
+        trace_id, parent_id, upstream_sampled = None, None, False
+        match = TRACEPARENT_RE.match(traceparent or '')
+        if match and match.group(1) != '0' * 32:
+            trace_id, parent_id = match.group(1), match.group(2)
+            upstream_sampled = bool(int(match.group(3), 16) & 1)
+
+        root = Span(name, KIND_SERVER, parent_id, attributes)
+        trace = Trace(trace_id or secrets.token_hex(16), root, upstream_sampled)
+        trace.tokens = (_current_trace.set(trace), _current_span.set(root))
+        return trace
+
+    def finish_trace(self, trace, status_code=None):
+        """End the root span and decide whether the trace is exported"""
+        root = trace.root
+        root.end_ns = time.time_ns()
+        if status_code is not None:
+            root.set('http.status_code', status_code)
+            if status_code >= 500:
+                root.error = root.error or f"HTTP {status_code}"
+
+        trace_token, span_token = trace.tokens
+        try:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+        except ValueError:
+            # Finished from another context (e.g. a copied one); just detach
+            _current_span.set(None)
+            _current_trace.set(None)
+
+        if self._keep(trace):
+            if trace.dropped_spans:
+                root.set('hexashop.dropped_spans', trace.dropped_spans)
+            self._enqueue(trace)
+
+    def _keep(self, trace):
+        if trace.upstream_sampled:
+            return True
+        if any(span.error for span in trace.spans):
+            return True
+        if trace.root.end_ns - trace.root.start_ns >= self.slow_ns:
+            return True
+        return random.random() < self.sample_rate
+
+    def current_trace_id(self):
+        trace = _current_trace.get()
+        return trace.trace_id if trace else None
+
+    # ----- spans -----
+
+    def start_span(self, name, kind=KIND_INTERNAL, attributes=None):
+        """Open a child of the current span; returns None outside a trace"""
+        trace = _current_trace.get()
+        if trace is None:
+            return None
+        if len(trace.spans) >= MAX_SPANS_PER_TRACE:
+            trace.dropped_spans += 1
+            return None
+        parent = _current_span.get()
+        span = Span(name, kind, parent.span_id if parent else trace.root.span_id, attributes)
+        trace.spans.append(span)
+        return span
+
+    def end_span(self, span):
+        if span is not None:
+            span.end_ns = time.time_ns()
+
+    @contextmanager
+    def span(self, name, kind=KIND_INTERNAL, attributes=None):
+        """Context manager for a child span that also becomes the current span"""
+        span = self.start_span(name, kind, attributes)
+        if span is None:
+            yield NOOP_SPAN
+            return
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.record_error(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+
+    # ----- export -----
+
+    def _enqueue(self, trace):
+        if not self.collector_url and not self.export_path:
+            return
+        if self._exporter_pid != os.getpid():
+            self._start_exporter()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped_traces += 1
+
+    def _start_exporter(self):
+        # One exporter thread per (forked) worker process
+        with self._lock:
+            if self._exporter_pid == os.getpid():
+                return
+            self._exporter_pid = os.getpid()
+        threading.Thread(target=self._export_loop, daemon=True).start()
+
+    def _export_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception as e:
+                print(f"⚠️ Trace export failed ({len(batch)} traces): {e}")
+
+    def to_otlp(self, traces):
+        """OTLP/JSON ExportTraceServiceRequest for a batch of traces"""
+        spans = []
+        for trace in traces:
+            for span in trace.spans:
+                otlp_span = {
+                    'traceId': trace.trace_id,
+                    'spanId': span.span_id,
+                    'name': span.name,
+                    'kind': span.kind,
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns or trace.root.end_ns),
+                    'attributes': _otlp_attributes(span.attributes),
+                    'status': {'code': 2, 'message': span.error} if span.error else {'code': 0}
+                }
+                if span.parent_id:
+                    otlp_span['parentSpanId'] = span.parent_id
+                spans.append(otlp_span)
+
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': _otlp_attributes({
+                    'service.name': self.service_name,
+                    'process.pid': os.getpid()
+                })},
+                'scopeSpans': [{'scope': {'name': 'hexashop.tracing'}, 'spans': spans}]
+            }]
+        }
+
+    def export(self, traces):
+        payload = json.dumps(self.to_otlp(traces), separators=(',', ':'))
+        if self.collector_url:
+            http_request = urllib.request.Request(
+                self.collector_url, data=payload.encode('utf-8'),
+                headers={'Content-Type': 'application/json'}, method='POST'
+            )
+            with urllib.request.urlopen(http_request, timeout=5) as response:
+                response.read()
+            return
+
+        directory = os.path.dirname(self.export_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            if os.path.getsize(self.export_path) >= self.export_max_bytes:
+                os.replace(self.export_path, self.export_path + '.1')
+        except FileNotFoundError:
+            pass
+        # One request per line, the layout of the OpenTelemetry collector file exporter
+        with open(self.export_path, 'a', encoding='utf-8') as export_file:
+            export_file.write(payload + '\n')
+
+
+class TracedJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that times response serialization"""
+
+    def dumps(self, obj, **kwargs):
+        with tracer.span('json.serialize') as span:
+            payload = super().dumps(obj, **kwargs)
+            span.set('json.bytes', len(payload))
+            return payload
+
+# Global tracer instance
+tracer = Tracer()
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+"""
+WAL Backups for Hexashop
+Continuous WAL archiving with periodic base backups and point-in-time restore (BACKUP_MODE=incremental)
+
+PostgreSQL needs wal_level=replica, max_wal_senders >= 3 and a role with
+REPLICATION for DATABASE_URL. Archives live on the host running the
+receiver, under backups/base and backups/wal; base backup and PITR jobs are
+routed to that host unless WAL_SHARED_STORAGE=1 says every host mounts them.
+
+The replication slot makes the server keep every WAL segment the receiver
+has not fetched. max_slot_wal_keep_size MUST be set on the server (e.g.
+ALTER SYSTEM SET max_slot_wal_keep_size = '20GB'): without it a receiver
+that is down long enough fills pg_wal and stops the database. Switching
+BACKUP_MODE back to full drops the slot on the next start; `drop-slot`
+drops it by hand.
+
+    python wal_backups.py status
+    python wal_backups.py base-backup
+    python wal_backups.py drop-slot
+    python wal_backups.py pitr --target-time 2026-10-19T12:34:56 --data-dir /var/lib/postgresql/pitr
+"""
+import fcntl
+import json
+import os
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import tarfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+
+DEFAULT_BASE_DIR = os.path.join('backups', 'base')
+DEFAULT_WAL_DIR = os.path.join('backups', 'wal')
+DEFAULT_PITR_DIR = os.path.join('backups', 'pitr')
+DEFAULT_SLOT = 'hexashop_wal'
+DEFAULT_BASE_KEEP = 7               # Base backups kept; WAL older than the oldest is removed
+WAL_SEGMENT_SIZE = 16 * 1024 * 1024 # PostgreSQL default (initdb --wal-segsize)
+RECEIVER_LEASE = 30                 # Seconds; renewed every RECEIVER_CHECK_INTERVAL
+RECEIVER_CHECK_INTERVAL = 10
+RECEIVER_RESTART_DELAY = 5
+
+BASE_META = 'hexashop_base.json'
+LEADER_LOCK = '.receiver.lock'      # flock held by the receiver when there is no Redis
+WAL_FILE_RE = re.compile(r'^([0-9A-F]{24})(\.partial)?$')
+PROGRESS_RE = re.compile(r'(\d+)/(\d+) kB')
+
+# Renew the receiver lease only if this process still holds it
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def lsn_to_int(lsn):
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def wal_segment_name(timeline, lsn):
+    """File name of the WAL segment holding `lsn` ("0/2000028" -> 000000010000000000000002)"""
+    segment = lsn_to_int(lsn) // WAL_SEGMENT_SIZE
+    segments_per_id = 0x100000000 // WAL_SEGMENT_SIZE
+    return f"{timeline:08X}{segment // segments_per_id:08X}{segment % segments_per_id:08X}"
+
+
+def _safe_extract(archive_path, destination):
+    """Extract a (compressed) tar, refusing links and paths outside the destination"""
+    root = os.path.realpath(destination)
+    with tarfile.open(archive_path, 'r:*') as archive:
+        members = archive.getmembers()
+        for member in members:
+            target = os.path.realpath(os.path.join(root, member.name))
+            if not (member.isfile() or member.isdir()) or os.path.commonpath([root, target]) != root:
+                raise ValueError(f"Unsafe entry in {os.path.basename(archive_path)}: {member.name}")
+        archive.extractall(root, members=members)
+
+
+def _dir_size(path):
+    total = 0
+    for directory, _subdirs, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(directory, filename))
+            except OSError:
+                pass
+    return total
+
+
+class WalArchiver:
+    """
+    pg_receivewal streams WAL into backups/wal through a replication slot
+    (so the server keeps WAL while no receiver runs), flushing every
+    record: RPO is seconds. Only one worker runs it, elected through a
+    lease in the coordination tier. pg_basebackup (tar, gzip) runs as a
+    backup job each night; restores replay WAL on top of the newest base
+    taken before the target time.
+    """
+
+    def __init__(self, app=None, manager=None, redis_client=None):
+        self.app = app
+        self.manager = manager
+        self.redis = None
+        self.enabled = False
+        self.base_dir = DEFAULT_BASE_DIR
+        self.wal_dir = DEFAULT_WAL_DIR
+        self.pitr_dir = DEFAULT_PITR_DIR
+        self.slot = DEFAULT_SLOT
+        self.base_keep = DEFAULT_BASE_KEEP
+        self.holder_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self.lease_key = 'hexashop:wal:receiver'
+        self.host_key = 'hexashop:wal:archive_host'   # Host holding the archive; outlives the lease
+        self.shared_storage = False
+        self._leader_lock = None
+        self.receiver = None
+        self.receiver_restarts = 0
+        self._receiver_pid = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app, manager, redis_client)
+
+    def init_app(self, app, manager, redis_client=None):
+        self.app = app
+        self.manager = manager
+        self.redis = redis_client
+        self.configure()
+        if redis_client is not None:
+            self._renew = redis_client.register_script(RENEW_SCRIPT)
+        if manager is not None:
+            manager.wal = self
+        app.wal_archiver = self
+
+        if self.enabled:
+            os.makedirs(self.base_dir, exist_ok=True)
+            os.makedirs(self.wal_dir, exist_ok=True)
+            self._start_supervisor()
+        else:
+            # A slot nobody reads from pins WAL on the primary until its disk fills
+            try:
+                self.drop_slot()
+            except Exception as e:
+                print(f"⚠️ Could not check for a leftover replication slot {self.slot}: {e}")
+
+    def configure(self):
+        self.enabled = os.environ.get('BACKUP_MODE', 'full') == 'incremental'
+        self.base_dir = os.environ.get('WAL_BASE_DIR', self.base_dir)
+        self.wal_dir = os.environ.get('WAL_ARCHIVE_DIR', self.wal_dir)
+        self.pitr_dir = os.environ.get('WAL_PITR_DIR', self.pitr_dir)
+        self.slot = os.environ.get('WAL_SLOT_NAME', self.slot)
+        self.base_keep = int(os.environ.get('WAL_BASE_KEEP', self.base_keep))
+        self.shared_storage = os.environ.get('WAL_SHARED_STORAGE', '0') == '1'
+
+    def database_url(self):
+        if self.manager is not None and self.manager.app is not None:
+            return self.manager.get_database_url()
+        return os.environ['DATABASE_URL']
+
+    # ----- continuous WAL receiver -----
+
+    def _start_supervisor(self):
+        # One supervisor per (forked) worker process; only the lease holder runs pg_receivewal
+        with self._lock:
+            if self._receiver_pid == os.getpid():
+                return
+            self._receiver_pid = os.getpid()
+        threading.Thread(target=self._supervise, daemon=True).start()
+
+    def _is_leader(self):
+        if self.redis is None:
+            return self._hold_local_lock()
+        try:
+            if self.redis.set(self.lease_key, self.holder_id, nx=True, ex=RECEIVER_LEASE):
+                self._claim_archive_host()
+                return True
+            return bool(self._renew(keys=[self.lease_key], args=[self.holder_id, RECEIVER_LEASE]))
+        except Exception as e:
+            print(f"⚠️ WAL receiver lease check failed: {e}")
+            return False
+
+    def _hold_local_lock(self):
+        """Without Redis, the worker holding an exclusive flock in the WAL directory is the leader"""
+        if self._leader_lock is not None:
+            return True
+        lock_file = open(os.path.join(self.wal_dir, LEADER_LOCK), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_lock = lock_file   # Released by the kernel when this process exits
+        return True
+
+    def _claim_archive_host(self):
+        host = socket.gethostname()
+        previous = self.redis.getset(self.host_key, host)
+        previous = previous.decode() if isinstance(previous, bytes) else previous
+        if previous and previous != host and not self.shared_storage:
+            print(f"⚠️ WAL receiver moved from {previous} to {host}: older WAL and base backups "
+                  f"stay on {previous}. Set WAL_SHARED_STORAGE=1 once the archive is on shared storage")
+
+    def archive_host(self):
+        """
+        Host whose backups/base and backups/wal hold the archive, so base
+        backup and PITR jobs run there. None when any host will do: shared
+        storage, no Redis (one host) or no receiver has run yet.
+        """
+        if self.shared_storage or self.redis is None:
+            return None
+        host = self.redis.get(self.host_key)
+        return host.decode() if isinstance(host, bytes) else host
+
+    def _supervise(self):
+        slot_ready = False
+        while True:
+            if not self._is_leader():
+                self._stop_receiver()
+                time.sleep(RECEIVER_CHECK_INTERVAL)
+                continue
+
+            if self.receiver is None or self.receiver.poll() is not None:
+                if self.receiver is not None:
+                    print(f"⚠️ pg_receivewal exited with {self.receiver.returncode}, restarting")
+                    self.receiver_restarts += 1
+                    time.sleep(RECEIVER_RESTART_DELAY)
+                try:
+                    if not slot_ready:
+                        self._create_slot()
+                        slot_ready = True
+                    self.receiver = subprocess.Popen([
+                        'pg_receivewal',
+                        '-d', self.database_url(),
+                        '-D', self.wal_dir,
+                        '-S', self.slot,
+                        '--synchronous',        # Flush every record: RPO is the network delay
+                        '--no-loop',            # Exit on connection loss; restarted here
+                        '--no-password',
+                    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                    print(f"📼 WAL receiver started (slot {self.slot}) -> {self.wal_dir}")
+                except Exception as e:
+                    print(f"❌ Could not start pg_receivewal: {e}")
+                    self.receiver = None
+            time.sleep(RECEIVER_CHECK_INTERVAL)
+
+    def _create_slot(self):
+        result = subprocess.run([
+            'pg_receivewal', '-d', self.database_url(), '-S', self.slot,
+            '--create-slot', '--if-not-exists', '--no-password'
+        ], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip())
+        slot = self.slot_info()
+        if slot is not None and slot['max_slot_wal_keep_size'] == '-1':
+            print(f"🚨 max_slot_wal_keep_size is unlimited: while no receiver reads slot {self.slot}, "
+                  f"pg_wal grows until the disk is full. Set it on the server")
+
+    def _query(self, statement, params=None):
+        with psycopg2.connect(self.database_url()) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute(statement, params)
+                return cursor.fetchall()
+
+    def slot_info(self):
+        """The replication slot's state and the WAL it holds back, or None if it does not exist"""
+        rows = self._query("""
+            SELECT active, wal_status, pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn)::bigint,
+                   safe_wal_size, current_setting('max_slot_wal_keep_size')
+            FROM pg_replication_slots WHERE slot_name = %s
+        """, (self.slot,))
+        if not rows:
+            return None
+        active, wal_status, retained, safe_wal_size, keep_size = rows[0]
+        return {
+            'name': self.slot,
+            'active': active,
+            'wal_status': wal_status,
+            'retained_bytes': retained,
+            'safe_wal_size': safe_wal_size,
+            'max_slot_wal_keep_size': keep_size,
+        }
+
+    def drop_slot(self):
+        """Drop the replication slot unless a receiver is streaming from it; True if dropped"""
+        rows = self._query("SELECT pg_drop_replication_slot(slot_name) FROM pg_replication_slots "
+                           "WHERE slot_name = %s AND NOT active", (self.slot,))
+        if rows:
+            print(f"🗑️ Dropped replication slot {self.slot}: the server no longer keeps WAL for it")
+        return bool(rows)
+
+    def _stop_receiver(self):
+        if self.receiver is not None and self.receiver.poll() is None:
+            self.receiver.terminate()
+            try:
+                self.receiver.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.receiver.kill()
+            print("📼 WAL receiver stopped (lease held elsewhere)")
+        self.receiver = None
+
+    # ----- base backups -----
+
+    def list_bases(self):
+        """Completed base backups, oldest first"""
+        bases = []
+        if not os.path.isdir(self.base_dir):
+            return bases
+        for name in os.listdir(self.base_dir):
+            if name.endswith('.partial'):
+                continue
+            meta_path = os.path.join(self.base_dir, name, BASE_META)
+            try:
+                with open(meta_path, encoding='utf-8') as meta_file:
+                    bases.append(json.load(meta_file))
+            except (OSError, ValueError):
+                continue    # In progress or not ours
+        bases.sort(key=lambda base: base['finished_at'])
+        return bases
+
+    def create_base_backup(self, progress=None):
+        """pg_basebackup into backups/base/<label>, then apply retention"""
+        progress = progress or (lambda *args: None)
+        label = f"hexashop_base_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        target = os.path.join(self.base_dir, label)
+        partial = target + '.partial'
+        started_at = datetime.now(timezone.utc)
+        started = time.time()
+
+        def measure(output):
+            for line in reversed(output['lines']):
+                match = PROGRESS_RE.search(line)
+                if match:
+                    return int(match.group(1)) * 1024, int(match.group(2)) * 1024
+            return None, None
+
+        progress('base_backup', 0, None, f"pg_basebackup {label} started")
+        result = self.manager._run_command([
+            'pg_basebackup',
+            '-d', self.database_url(),
+            '-D', partial,
+            '-F', 't', '-z',            # base.tar.gz + pg_wal.tar.gz
+            '-X', 'stream',             # Self-contained even without the archive
+            '-c', 'fast',               # Immediate checkpoint instead of waiting for the next one
+            '-l', label,
+            '--progress',
+            '--no-password',
+        ], os.environ.copy(), progress, 'base_backup', measure=measure)
+
+        if result.returncode != 0:
+            shutil.rmtree(partial, ignore_errors=True)
+            print(f"❌ Base backup failed: {result.stderr}")
+            return {"success": False, "error": result.stderr}
+
+        with open(os.path.join(partial, 'backup_manifest'), encoding='utf-8') as manifest_file:
+            wal_range = json.load(manifest_file)['WAL-Ranges'][0]
+        meta = {
+            'label': label,
+            'path': target,
+            'started_at': started_at.isoformat(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'seconds': round(time.time() - started, 1),
+            'timeline': wal_range['Timeline'],
+            'start_lsn': wal_range['Start-LSN'],
+            'end_lsn': wal_range['End-LSN'],
+            'start_wal': wal_segment_name(wal_range['Timeline'], wal_range['Start-LSN']),
+            'size': _dir_size(partial),
+        }
+        with open(os.path.join(partial, BASE_META), 'w', encoding='utf-8') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+        os.replace(partial, target)
+        print(f"✅ Base backup {label}: {meta['size'] / (1024 * 1024):.1f} MB in {meta['seconds']}s")
+
+        removed = self.apply_retention()
+        progress('base_backup', meta['size'], meta['size'], f"Base backup {label} complete")
+        return {"success": True, "file": target, "size": meta['size'], "label": label,
+                "start_wal": meta['start_wal'], "removed": removed}
+
+    def apply_retention(self):
+        """Keep the newest base_keep bases and the WAL needed to roll any of them forward"""
+        bases = self.list_bases()
+        removed = {'bases': 0, 'wal_files': 0}
+        for base in bases[:-self.base_keep] if len(bases) > self.base_keep else []:
+            shutil.rmtree(base['path'], ignore_errors=True)
+            removed['bases'] += 1
+            print(f"🗑️ Deleted old base backup: {base['label']}")
+
+        kept = bases[-self.base_keep:]
+        if not kept or not os.path.isdir(self.wal_dir):
+            return removed
+        # Segment names sort by position within a timeline; compare the log/segment part
+        oldest_needed = kept[0]['start_wal'][8:]
+        for name in os.listdir(self.wal_dir):
+            match = WAL_FILE_RE.match(name)
+            if match and not match.group(2) and match.group(1)[8:] < oldest_needed:
+                os.remove(os.path.join(self.wal_dir, name))
+                removed['wal_files'] += 1
+        return removed
+
+    # ----- status and point-in-time restore -----
+
+    def wal_files(self):
+        if not os.path.isdir(self.wal_dir):
+            return []
+        files = []
+        for name in sorted(os.listdir(self.wal_dir)):
+            if WAL_FILE_RE.match(name):
+                path = os.path.join(self.wal_dir, name)
+                stats = os.stat(path)
+                files.append({'name': name, 'size': stats.st_size, 'modified': stats.st_mtime})
+        return files
+
+    def status(self):
+        bases = self.list_bases()
+        wal = self.wal_files()
+        newest_wal = max((f['modified'] for f in wal), default=None)
+        try:
+            slot = self.slot_info()
+        except Exception as e:
+            slot = {'name': self.slot, 'error': str(e)}
+        leader = None
+        if self.redis is not None:
+            leader = self.redis.get(self.lease_key)
+            leader = leader.decode() if isinstance(leader, bytes) else leader
+        return {
+            'enabled': self.enabled,
+            'receiver': {
+                'leader': leader if self.redis is not None else (self.holder_id if self._leader_lock else None),
+                'archive_host': self.archive_host(),
+                'shared_storage': self.shared_storage,
+                'running_here': self.receiver is not None and self.receiver.poll() is None,
+                'restarts': self.receiver_restarts,
+                'slot': slot,
+                'last_wal_write': datetime.fromtimestamp(newest_wal, timezone.utc).isoformat() if newest_wal else None,
+                'seconds_since_wal_write': round(time.time() - newest_wal, 1) if newest_wal else None,
+            },
+            'bases': [{key: base[key] for key in ('label', 'finished_at', 'size', 'start_wal')} for base in bases],
+            'wal': {
+                'files': len(wal),
+                'bytes': sum(f['size'] for f in wal),
+                'oldest': wal[0]['name'] if wal else None,
+                'newest': wal[-1]['name'] if wal else None,
+            },
+            'restore_window': {
+                'earliest': bases[0]['finished_at'] if bases else None,
+                'latest': datetime.fromtimestamp(newest_wal, timezone.utc).isoformat() if newest_wal else None,
+            },
+        }
+
+    def prepare_pitr(self, target_time, data_dir=None, progress=None):
+        """
+        Build a data directory that recovers to `target_time` (ISO 8601,
+        UTC unless it carries an offset) when started with pg_ctl: newest
+        base finished before the target, plus archived WAL through
+        restore_command. The live database is not touched.
+        """
+        progress = progress or (lambda *args: None)
+        target = datetime.fromisoformat(target_time)
+        if target.tzinfo is None:
+            target = target.replace(tzinfo=timezone.utc)
+
+        candidates = [base for base in self.list_bases() if datetime.fromisoformat(base['finished_at']) <= target]
+        if not candidates:
+            return {"success": False, "error": "No base backup finished before the target time"}
+        base = candidates[-1]
+
+        data_dir = data_dir or os.path.join(self.pitr_dir, f"pitr_{target.strftime('%Y%m%d_%H%M%S')}")
+        if os.path.exists(data_dir) and os.listdir(data_dir):
+            return {"success": False, "error": f"{data_dir} is not empty"}
+        os.makedirs(data_dir, exist_ok=True)
+        os.chmod(data_dir, 0o700)   # postgres refuses group/world-accessible data directories
+
+        progress('pitr', None, None, f"Extracting base backup {base['label']}")
+        _safe_extract(os.path.join(base['path'], 'base.tar.gz'), data_dir)
+        _safe_extract(os.path.join(base['path'], 'pg_wal.tar.gz'), os.path.join(data_dir, 'pg_wal'))
+
+        # The segment pg_receivewal is still writing has no restorable name yet
+        for name in os.listdir(self.wal_dir):
+            if name.endswith('.partial'):
+                shutil.copy2(os.path.join(self.wal_dir, name),
+                             os.path.join(data_dir, 'pg_wal', name[:-len('.partial')]))
+
+        wal_dir = os.path.abspath(self.wal_dir)
+        with open(os.path.join(data_dir, 'postgresql.auto.conf'), 'a', encoding='utf-8') as conf:
+            conf.write(
+                "\n# Point-in-time recovery prepared by Hexashop\n"
+                f"restore_command = 'cp \"{wal_dir}/%f\" \"%p\"'\n"
+                f"recovery_target_time = '{target.isoformat()}'\n"
+                "recovery_target_action = 'promote'\n"
+            )
+        open(os.path.join(data_dir, 'recovery.signal'), 'w').close()
+
+        print(f"✅ PITR data directory prepared: {data_dir} (base {base['label']}, target {target.isoformat()})")
+        return {
+            "success": True,
+            "data_dir": os.path.abspath(data_dir),
+            "base": base['label'],
+            "target_time": target.isoformat(),
+            "next_step": f"pg_ctl -D {os.path.abspath(data_dir)} -o '-p 5433' start",
+        }
+
+# Global WAL archiver instance
+wal_archiver = WalArchiver()
+
+
+if __name__ == '__main__':
+    import argparse
+    from backup_manager import BackupManager
+
+    parser = argparse.ArgumentParser(description="Hexashop WAL backups")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    subcommands.add_parser('status')
+    subcommands.add_parser('base-backup')
+    subcommands.add_parser('drop-slot')
+    pitr = subcommands.add_parser('pitr')
+    pitr.add_argument('--target-time', required=True, help="ISO 8601, UTC unless an offset is given")
+    pitr.add_argument('--data-dir', help="Empty directory for the recovered cluster")
+    args = parser.parse_args()
+
+    wal_archiver.configure()
+    wal_archiver.manager = BackupManager()  # Command runner only; the URL comes from DATABASE_URL
+    if args.command == 'status':
+        print(json.dumps(wal_archiver.status(), indent=2))
+    elif args.command == 'drop-slot':
+        print(json.dumps({'dropped': wal_archiver.drop_slot()}))
+    elif args.command == 'base-backup':
+        os.makedirs(wal_archiver.base_dir, exist_ok=True)
+        print(json.dumps(wal_archiver.create_base_backup(), indent=2))
+    else:
+        print(json.dumps(wal_archiver.prepare_pitr(args.target_time, args.data_dir), indent=2))